@@ -435,7 +435,10 @@ export async function testSegmentationAction(
       const response = await fetch(serviceUrl, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ job_ad_text: jobAd.descriptionShort || jobAd.title }),
+        // The full ad: the service chunks long texts itself instead of truncating them.
+        body: JSON.stringify({
+          job_ad_text: [jobAd.title, jobAd.descriptionShort, jobAd.descriptionLong].filter(Boolean).join('\n\n'),
+        }),
       });
 
       if (!response.ok) {
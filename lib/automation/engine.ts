@@ -59,6 +59,9 @@ interface PythonSegmentationResponse {
     derived_audience_primitives: AudiencePrimitive[];
     assigned_cluster_id?: string;
     cluster_assignment_confidence?: number;
+    cluster_assignment_margin?: number | null; // Relative gap to the second-nearest cluster (0 = between two clusters)
+    top_clusters?: { cluster_id: string; confidence: number; distance: number }[] | null; // Nearest clusters first
+    error?: string | null; // Set per item by /segment/batch when that ad could not be segmented
 }
 
 // Add interface for cluster profiles
@@ -92,6 +95,11 @@ async function loadClusterProfiles(): Promise<Record<string, ClusterProfile>> {
     }
 }
 
+// The full ad is sent; the service chunks long texts itself instead of truncating them.
+function segmentationText(ad: JobAd): string {
+    return [ad.title, ad.descriptionShort, ad.descriptionLong].filter(Boolean).join('\n\n');
+}
+
 async function callPythonSegmentationService(jobAdText: string): Promise<PythonSegmentationResponse | null> {
     const serviceUrl = process.env.PYTHON_SEGMENTATION_SERVICE_URL;
     if (!serviceUrl) {
@@ -118,6 +126,47 @@ async function callPythonSegmentationService(jobAdText: string): Promise<PythonS
     }
 }
 
+// The service rejects /segment/batch requests above MAX_SEGMENT_BATCH_SIZE (1000) items with 413.
+const SEGMENTATION_BATCH_SIZE = Math.min(1000, Math.max(1, Number(process.env.SEGMENTATION_BATCH_SIZE) || 1000));
+
+// Segments many ads with /segment/batch calls of at most SEGMENTATION_BATCH_SIZE ads instead of one round-trip per ad.
+// Ads of a failed call come back as null so callers can fall back to per-ad requests for just those.
+async function callPythonSegmentationServiceBatch(jobAdTexts: string[]): Promise<(PythonSegmentationResponse | null)[]> {
+    const results: (PythonSegmentationResponse | null)[] = [];
+    for (let start = 0; start < jobAdTexts.length; start += SEGMENTATION_BATCH_SIZE) {
+        const chunk = jobAdTexts.slice(start, start + SEGMENTATION_BATCH_SIZE);
+        const chunkResults = await callPythonSegmentationServiceBatchChunk(chunk);
+        results.push(...(chunkResults ?? chunk.map(() => null)));
+    }
+    return results;
+}
+
+// One /segment/batch call; returns null if the whole call fails.
+async function callPythonSegmentationServiceBatchChunk(jobAdTexts: string[]): Promise<(PythonSegmentationResponse | null)[] | null> {
+    const serviceUrl = process.env.PYTHON_SEGMENTATION_SERVICE_URL;
+    if (!serviceUrl) {
+        console.error("PYTHON_SEGMENTATION_SERVICE_URL is not set.");
+        return null;
+    }
+    try {
+        console.log(`Calling Python service batch endpoint for ${jobAdTexts.length} ad text(s)...`);
+        const response = await fetch(`${serviceUrl}/segment/batch`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ job_ads: jobAdTexts.map(text => ({ job_ad_text: text })) }),
+        });
+        if (!response.ok) {
+            console.error(`Python service batch call failed with status ${response.status}:`, await response.text());
+            return null;
+        }
+        const data = await response.json() as { results: PythonSegmentationResponse[] };
+        return data.results.map(result => (result.error ? null : result));
+    } catch (error) {
+        console.error("Error calling Python segmentation service batch endpoint:", error);
+        return null;
+    }
+}
+
 export async function processScheduledAds() {
     console.log('Starting to process scheduled ads...');
     const now = new Date();
@@ -146,6 +195,18 @@ export async function processScheduledAds() {
 
         console.log(`Found ${eligibleAds.length} eligible ad(s) to process.`);
 
+        // Segment the whole backlog in batch calls; ads missing from them fall back to /segment below.
+        const batchSegmentationResults = await callPythonSegmentationServiceBatch(
+            eligibleAds.map(segmentationText)
+        );
+        const prefetchedSegmentation = new Map<number, PythonSegmentationResponse>();
+        eligibleAds.forEach((ad, index) => {
+            const result = batchSegmentationResults[index];
+            if (result) {
+                prefetchedSegmentation.set(ad.id, result);
+            }
+        });
+
         for (const ad of eligibleAds) {
             adsAttemptedInLoop++;
             console.log(`Processing ad ID: ${ad.id}, Title: ${ad.title} (Attempt ${adsAttemptedInLoop} of ${eligibleAds.length})`);
@@ -157,7 +218,8 @@ export async function processScheduledAds() {
             try {
                 await db.update(jobAds).set({ status: 'processing', updatedAt: new Date() }).where(eq(jobAds.id, ad.id));
 
-                const segmentationResult = await callPythonSegmentationService(ad.descriptionShort || ad.title);
+                const segmentationResult = prefetchedSegmentation.get(ad.id)
+                    ?? await callPythonSegmentationService(segmentationText(ad));
                 
                 if (!segmentationResult || !segmentationResult.derived_audience_primitives) {
                     console.error(`Segmentation failed for ad ID: ${ad.id}.`);
@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+# Offline benchmark of the segmentation service against the local models and corpus.
+#
+#   python bench_segmentation.py --output bench_report.json
+#
+# Measures cold start (fresh process: import, model load, first request), per-stage latency of the batched
+# pipeline (encode, reduce, assign, profile), single-request vs. batch throughput, latency percentiles under
+# concurrent load through an in-process ASGI client (no network), and peak RSS. The embedding cache and
+# near-duplicate reuse are disabled unless --with-cache is given, so repeated texts are not served from memory. Service settings
+# (SEGMENTATION_ENCODER_BACKEND, SEGMENTATION_REDUCTION_MODE, ...) are read from the environment as usual
+# and recorded in the report, so runs with different backends or bundles can be compared.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(SCRIPT_DIR, "data", "job_ads_corpus.json")
+DEFAULT_OUTPUT_PATH = "bench_report.json"
+
+def synthetic_corpus(size: int, seed: int = 42) -> List[str]:
+    """Expands data/job_ads_corpus.json to `size` distinct ads by recombining sentences of the real ads."""
+    with open(CORPUS_PATH, 'r') as f:
+        texts = [item['text'] for item in json.load(f) if item.get('text')]
+    sentences = [sentence for text in texts for sentence in re.split(r"(?<=[.!?])\s+", text) if sentence]
+    rng = random.Random(seed)
+    corpus = list(texts[:size])
+    while len(corpus) < size:
+        picked = rng.sample(sentences, k=min(len(sentences), rng.randint(3, 8)))
+        corpus.append(f"{' '.join(picked)} Ref {len(corpus)}.") # The reference keeps every ad distinct
+    return corpus
+
+def percentiles_ms(samples_s: List[float]) -> Dict[str, float]:
+    if not samples_s:
+        return {}
+    values = np.asarray(samples_s) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+def cold_start_child():
+    """Runs in a fresh interpreter: import, model load and first request, timed separately."""
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    main.load_models_sync()
+    loaded = time.perf_counter()
+    main.run_segmentation_batch([main.JobAdInput(job_ad_text=synthetic_corpus(1)[0])])
+    first_request = time.perf_counter()
+    print(json.dumps({
+        "import_s": round(imported - started, 3),
+        "model_load_s": round(loaded - imported, 3),
+        "first_request_s": round(first_request - loaded, 3),
+        "total_s": round(first_request - started, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+def bench_cold_start() -> dict:
+    print("Measuring cold start in a fresh process...")
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--cold-start-child"],
+                               cwd=SCRIPT_DIR, capture_output=True, text=True, env=os.environ.copy())
+    if completed.returncode != 0:
+        print(f"Cold start child failed: {completed.stderr[-2000:]}")
+        return {"error": completed.stderr[-2000:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def bench_stages(main, corpus: List[str], batch_sizes: List[int], repeats: int) -> dict:
+    """Per-stage latency of the batched pipeline, called stage by stage on the current models."""
+    models = main.current_models
+    results = {}
+    for batch_size in batch_sizes:
+        timings = {"encode": [], "reduce": [], "assign": [], "profile": []}
+        for repeat in range(repeats):
+            start = (repeat * batch_size) % max(1, len(corpus) - batch_size)
+            texts = corpus[start:start + batch_size]
+            item_errors = [None] * len(texts)
+            t0 = time.perf_counter()
+            sbert_embeddings = main._encode_stage(texts, item_errors)
+            t1 = time.perf_counter()
+            reduced_embeddings, _ = main._reduce_stage(models, sbert_embeddings)
+            t2 = time.perf_counter()
+            assignment = main._assign_stage(models, reduced_embeddings, main.DEFAULT_TOP_K_CLUSTERS)
+            t3 = time.perf_counter()
+            labels = [models.cluster_assigner.cluster_ids[i] for i in assignment.labels] if assignment is not None else [None] * len(texts)
+            for label in labels:
+                main._profile_primitives(models.cluster_profiles, label)
+            t4 = time.perf_counter()
+            for stage, seconds in zip(timings, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+                timings[stage].append(seconds)
+        results[str(batch_size)] = {
+            stage: {**percentiles_ms(samples), "per_item_mean_ms": round(1000 * float(np.mean(samples)) / batch_size, 4)}
+            for stage, samples in timings.items()
+        }
+        summary = ", ".join(f"{stage} {results[str(batch_size)][stage]['per_item_mean_ms']}" for stage in timings)
+        print(f"  batch {batch_size}: per-item ms: {summary}")
+    return results
+
+async def _timed_post(client, path: str, payload: dict, latencies: List[float], statuses: Dict[int, int]):
+    started = time.perf_counter()
+    response = await client.post(path, json=payload)
+    latencies.append(time.perf_counter() - started)
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+async def bench_http(main, corpus: List[str], n_requests: int, batch_sizes: List[int], concurrency_levels: List[int]) -> dict:
+    """Throughput and latency through the FastAPI app, in process, with the startup/shutdown events run explicitly."""
+    import httpx
+
+    results = {"single_sequential": {}, "batch": {}, "concurrent_single": {}}
+    await main.app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=300) as client:
+            await client.post("/segment", json={"job_ad_text": corpus[0]}) # Warm-up (numba/thread pools)
+
+            latencies, statuses = [], {}
+            started = time.perf_counter()
+            for text in corpus[:n_requests]:
+                await _timed_post(client, "/segment", {"job_ad_text": text}, latencies, statuses)
+            elapsed = time.perf_counter() - started
+            results["single_sequential"] = {"requests": len(latencies), "items_per_s": round(len(latencies) / elapsed, 2),
+                                            "statuses": statuses, **percentiles_ms(latencies)}
+            print(f"  sequential /segment: {results['single_sequential']['items_per_s']} items/s")
+
+            for batch_size in batch_sizes:
+                latencies, statuses = [], {}
+                n_batches = max(1, n_requests // batch_size)
+                started = time.perf_counter()
+                for i in range(n_batches):
+                    texts = corpus[(i * batch_size) % len(corpus):][:batch_size]
+                    await _timed_post(client, "/segment/batch", {"job_ads": [{"job_ad_text": text} for text in texts]}, latencies, statuses)
+                elapsed = time.perf_counter() - started
+                results["batch"][str(batch_size)] = {"requests": n_batches, "items_per_s": round(n_batches * batch_size / elapsed, 2),
+                                                     "statuses": statuses, **percentiles_ms(latencies)}
+                print(f"  /segment/batch x{batch_size}: {results['batch'][str(batch_size)]['items_per_s']} items/s")
+
+            for concurrency in concurrency_levels:
+                latencies, statuses = [], {}
+                queue = iter(corpus[:n_requests])
+
+                async def worker():
+                    for text in queue:
+                        await _timed_post(client, "/segment", {"job_ad_text": text}, latencies, statuses)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+                elapsed = time.perf_counter() - started
+                results["concurrent_single"][str(concurrency)] = {
+                    "requests": len(latencies), "items_per_s": round(len(latencies) / elapsed, 2),
+                    "statuses": statuses, **percentiles_ms(latencies),
+                }
+                entry = results["concurrent_single"][str(concurrency)]
+                print(f"  /segment x{concurrency} concurrent: {entry['items_per_s']} items/s, p50 {entry.get('p50_ms')} ms, "
+                      f"p99 {entry.get('p99_ms')} ms, statuses {statuses}")
+    finally:
+        await main.app.router.shutdown()
+    return results
+
+def run_benchmark(args) -> dict:
+    if not args.with_cache:
+        os.environ["SEGMENTATION_EMBEDDING_CACHE_MAX_ENTRIES"] = "0"
+        os.environ["SEGMENTATION_EMBEDDING_CACHE_DIR"] = ""
+        os.environ["SEGMENTATION_NEAR_DUPLICATE_MAX_ENTRIES"] = "0"
+    os.chdir(SCRIPT_DIR) # main.py resolves its model paths relative to the service directory
+    report = {
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "settings": {key: value for key, value in sorted(os.environ.items()) if key.startswith("SEGMENTATION_")},
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpu_count": os.cpu_count()},
+        "parameters": {"corpus_size": args.corpus_size, "requests": args.requests, "batch_sizes": args.batch_sizes,
+                       "concurrency": args.concurrency, "stage_repeats": args.stage_repeats, "seed": args.seed},
+    }
+    report["cold_start"] = bench_cold_start()
+
+    import main
+    main.load_models_sync()
+    corpus = synthetic_corpus(args.corpus_size, args.seed)
+    report["model"] = {
+        "model_version": main.current_models.version,
+        "encoder_backend": main.ENCODER_BACKEND,
+        "reduction_mode": main.current_models.reduction_mode,
+        "inference_executor": main.INFERENCE_EXECUTOR,
+    }
+    print(f"Benchmarking model {report['model']['model_version']} ({report['model']['encoder_backend']}, "
+          f"{report['model']['reduction_mode']}) on {len(corpus)} synthetic ads...")
+    print("Per-stage latency:")
+    report["stages"] = bench_stages(main, corpus, args.batch_sizes, args.stage_repeats)
+    print("HTTP throughput and latency (in-process ASGI client):")
+    report["http"] = asyncio.run(bench_http(main, corpus, args.requests, args.batch_sizes, args.concurrency))
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the audience segmentation service.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="JSON report path.")
+    parser.add_argument("--corpus-size", type=int, default=2000, help="Synthetic ads generated from the corpus.")
+    parser.add_argument("--requests", type=int, default=500, help="Ads sent per HTTP scenario.")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 8, 32, 128], help="Comma-separated batch sizes.")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32], help="Comma-separated concurrent client counts.")
+    parser.add_argument("--stage-repeats", type=int, default=20, help="Pipeline runs per batch size for the stage timings.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--with-cache", action="store_true", help="Keep the embedding cache and near-duplicate reuse enabled (measures hits too).")
+    parser.add_argument("--cold-start-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_start_child:
+        cold_start_child()
+    else:
+        output_path = os.path.abspath(args.output)
+        report = run_benchmark(args)
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark report saved to {output_path} (peak RSS {report['peak_rss_mb']} MB).")
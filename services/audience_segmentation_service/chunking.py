@@ -0,0 +1,137 @@
+from dataclasses import dataclass
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+
+# Long job ads: instead of letting the encoder silently truncate at its token limit, split each ad into
+# token-bounded chunks (with some overlap), encode the chunks of all ads of a batch in a single encode() call
+# and pool the chunk vectors back into one embedding per ad.
+#
+# SentenceTransformer.encode and encoders.OnnxSentenceEncoder both sort their input by length before batching,
+# so passing every chunk at once gives length-sorted batches: similar-length chunks are padded together.
+# Ads that fit in one chunk (the common case) are encoded as-is, so their embeddings are unchanged.
+LONG_TEXT_MODES = ("chunk", "truncate")
+POOLING_MODES = ("mean", "length") # "length": chunks weighted by their token count
+
+@dataclass(frozen=True)
+class ChunkingConfig:
+    mode: str = "chunk"
+    max_tokens: int = 0 # Tokens per chunk including special tokens, 0 = the encoder's max_seq_length
+    overlap_tokens: int = 32 # Tokens repeated at the start of the next chunk, keeps sentences cut at a boundary intact in one chunk
+    pooling: str = "mean"
+    max_chunks: int = 32 # Chunks encoded per ad at most; the rest of an extremely long text is dropped
+
+    def __post_init__(self):
+        if self.mode not in LONG_TEXT_MODES:
+            raise ValueError(f"Unknown long text mode '{self.mode}', expected one of {LONG_TEXT_MODES}.")
+        if self.pooling not in POOLING_MODES:
+            raise ValueError(f"Unknown chunk pooling '{self.pooling}', expected one of {POOLING_MODES}.")
+
+    def describe(self) -> str:
+        """Stable description for cache keys and embedding store names (embeddings change with these settings)."""
+        if self.mode == "truncate":
+            return "truncate"
+        return f"chunk:{self.max_tokens}:{self.overlap_tokens}:{self.pooling}:{self.max_chunks}"
+
+def _content_budget(encoder: Any, config: ChunkingConfig) -> int:
+    """Content tokens per chunk: the chunk size minus the special tokens ([CLS], [SEP], ...) the encoder adds."""
+    max_tokens = config.max_tokens or int(getattr(encoder, "max_seq_length", 0) or 256)
+    tokenizer = encoder.tokenizer
+    n_special = tokenizer.num_special_tokens_to_add() if hasattr(tokenizer, "num_special_tokens_to_add") else 2
+    return max(8, max_tokens - n_special)
+
+def _token_windows(n_tokens: int, budget: int, overlap: int, max_chunks: int) -> List[Tuple[int, int]]:
+    step = max(1, budget - min(overlap, budget // 2))
+    windows = []
+    start = 0
+    while len(windows) < max_chunks:
+        windows.append((start, min(start + budget, n_tokens)))
+        if start + budget >= n_tokens:
+            break
+        start += step
+    return windows
+
+def _split_with_offsets(tokenizer: Any, texts: List[str], budget: int, config: ChunkingConfig) -> List[List[Tuple[str, int]]]:
+    """Fast tokenizers: cut on token character offsets, so every chunk is an exact substring of the ad."""
+    encoded = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True, return_attention_mask=False,
+                        truncation=False, verbose=False)
+    chunks_per_text = []
+    for text, offsets in zip(texts, encoded["offset_mapping"]):
+        windows = _token_windows(len(offsets), budget, config.overlap_tokens, config.max_chunks)
+        if len(windows) == 1:
+            chunks_per_text.append([(text, len(offsets))]) # Fits after all: keep the text exactly as given
+            continue
+        chunks_per_text.append([(text[offsets[start][0]:offsets[end - 1][1]], end - start) for start, end in windows])
+    return chunks_per_text
+
+def _split_by_words(tokenizer: Any, texts: List[str], budget: int, config: ChunkingConfig) -> List[List[Tuple[str, int]]]:
+    """Slow tokenizers (no offsets): windows of whole words, measured with tokenizer.tokenize per word."""
+    chunks_per_text = []
+    for text in texts:
+        words = text.split()
+        word_tokens = [max(1, len(tokenizer.tokenize(word))) for word in words]
+        # Expand to one entry per token so the windows are token-bounded, then cut back on word boundaries.
+        token_words = np.repeat(np.arange(len(words)), word_tokens)
+        windows = _token_windows(len(token_words), budget, config.overlap_tokens, config.max_chunks)
+        if len(windows) == 1:
+            chunks_per_text.append([(text, len(token_words))])
+            continue
+        chunks = []
+        for start, end in windows:
+            first_word = token_words[start] if start == 0 or token_words[start] != token_words[start - 1] else token_words[start] + 1
+            last_word = token_words[end - 1] if end == len(token_words) or token_words[end] != token_words[end - 1] else token_words[end - 1] - 1
+            if last_word >= first_word:
+                chunks.append((" ".join(words[first_word:last_word + 1]), int(sum(word_tokens[first_word:last_word + 1]))))
+        chunks_per_text.append(chunks or [(text, len(token_words))])
+    return chunks_per_text
+
+def split_into_chunks(encoder: Any, texts: Sequence[str], config: ChunkingConfig) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Splits every text into token-bounded chunks. Returns (chunks, owners, token_counts): owners[i] is the index
+    of the text chunks[i] came from. Texts whose character count fits the budget are never tokenized here.
+    """
+    budget = _content_budget(encoder, config)
+    # Every token covers at least one character, so a text this short always fits in one chunk.
+    long_rows = [i for i, text in enumerate(texts) if len(text) > budget]
+    chunks_by_row = {}
+    if long_rows:
+        long_texts = [texts[i] for i in long_rows]
+        try:
+            split = _split_with_offsets(encoder.tokenizer, long_texts, budget, config)
+        except (NotImplementedError, KeyError, TypeError, ValueError):
+            split = _split_by_words(encoder.tokenizer, long_texts, budget, config)
+        chunks_by_row = dict(zip(long_rows, split))
+
+    chunks, owners, token_counts = [], [], []
+    for i, text in enumerate(texts):
+        for chunk, n_tokens in chunks_by_row.get(i, [(text, len(text))]):
+            chunks.append(chunk)
+            owners.append(i)
+            token_counts.append(n_tokens)
+    return chunks, np.asarray(owners, dtype=np.int64), np.asarray(token_counts, dtype=np.float32)
+
+def pool_chunks(chunk_embeddings: np.ndarray, owners: np.ndarray, token_counts: np.ndarray, n_texts: int, pooling: str = "mean") -> np.ndarray:
+    """
+    One embedding per text: the (token-count weighted, for "length") mean of its chunk vectors, rescaled to the
+    chunks' mean norm so pooled vectors of a normalizing encoder stay unit length like single-chunk ones.
+    """
+    chunk_embeddings = np.asarray(chunk_embeddings, dtype=np.float32)
+    weights = np.maximum(token_counts, 1.0) if pooling == "length" else np.ones(len(owners), dtype=np.float32)
+    weight_sums = np.bincount(owners, weights=weights, minlength=n_texts)[:, None]
+    pooled = np.zeros((n_texts, chunk_embeddings.shape[1]), dtype=np.float64)
+    np.add.at(pooled, owners, chunk_embeddings * weights[:, None])
+    pooled /= np.maximum(weight_sums, 1e-12)
+    chunk_norms = np.bincount(owners, weights=np.linalg.norm(chunk_embeddings, axis=1) * weights, minlength=n_texts)[:, None] / np.maximum(weight_sums, 1e-12)
+    pooled *= chunk_norms / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+    return pooled.astype(np.float32)
+
+def encode_long_texts(encoder: Any, texts: Sequence[str], config: ChunkingConfig, batch_size: int = 64, **encode_kwargs) -> np.ndarray:
+    """encoder.encode for whole job ads: (len(texts), dim) embeddings, chunked and pooled per `config`."""
+    texts = list(texts)
+    if config.mode == "truncate" or not texts:
+        return np.asarray(encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True, **encode_kwargs))
+    chunks, owners, token_counts = split_into_chunks(encoder, texts, config)
+    chunk_embeddings = np.asarray(encoder.encode(chunks, batch_size=batch_size, convert_to_numpy=True, **encode_kwargs))
+    if len(chunks) == len(texts):
+        return chunk_embeddings # No text needed more than one chunk
+    return pool_chunks(chunk_embeddings, owners, token_counts, len(texts), config.pooling)
@@ -0,0 +1,73 @@
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+class BatchAssignment(NamedTuple):
+    """Result of ClusterAssigner.assign for n items (k = number of clusters, t = top_k)."""
+    labels: np.ndarray # (n,) index of the nearest centroid
+    distances: np.ndarray # (n, k) euclidean distance to every centroid
+    confidences: np.ndarray # (n, k) confidence of every cluster, see ClusterAssigner
+    margins: np.ndarray # (n,) (d_second - d_best) / d_second, 0 = tie, 1 = on the best centroid; NaN if k == 1
+    top_indices: np.ndarray # (n, t) cluster indices ordered by increasing distance
+
+class ClusterAssigner:
+    """
+    Vectorized replacement for fitted_kmeans.predict + per-item distance/confidence lookups.
+    Built once at startup from the K-Means centroids and cluster profiles; assign() then computes
+    labels, distances to all centroids, confidences and a second-best margin for a batch in one pass.
+
+    Confidence of cluster j at distance d: 1 - d / characteristic_distance[j] clipped to [0, 1] when
+    the profile defines a positive characteristic_distance, otherwise the 1 / (1 + d) fallback.
+    """
+
+    def __init__(self, centroids: np.ndarray, cluster_ids: List[str], characteristic_distances: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.centroid_sq_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.cluster_ids = list(cluster_ids)
+        # NaN where the profile has no usable characteristic_distance
+        self.characteristic_distances = np.asarray(characteristic_distances, dtype=np.float32)
+        self.has_characteristic_distance = np.isfinite(self.characteristic_distances) & (self.characteristic_distances > 0)
+
+    @classmethod
+    def from_centroids(cls, centroids: np.ndarray, cluster_profiles: Optional[Dict[str, dict]]) -> "ClusterAssigner":
+        cluster_ids = [str(i) for i in range(centroids.shape[0])]
+        characteristic_distances = np.full(len(cluster_ids), np.nan, dtype=np.float32)
+        for i, cluster_id in enumerate(cluster_ids):
+            char_dist = (cluster_profiles or {}).get(cluster_id, {}).get('characteristic_distance')
+            if isinstance(char_dist, (int, float)) and char_dist > 0:
+                characteristic_distances[i] = char_dist
+        return cls(centroids, cluster_ids, characteristic_distances)
+
+    @property
+    def n_clusters(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def dimension(self) -> int:
+        return self.centroids.shape[1]
+
+    def assign(self, embeddings: np.ndarray, top_k: int = 1) -> BatchAssignment:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Expected embeddings of shape (n, {self.dimension}), got {embeddings.shape}.")
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, one matrix product for the whole batch
+        sq_distances = (np.einsum("ij,ij->i", embeddings, embeddings)[:, None]
+                        - 2.0 * embeddings @ self.centroids.T
+                        + self.centroid_sq_norms[None, :])
+        distances = np.sqrt(np.maximum(sq_distances, 0.0))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            profile_confidences = np.clip(1.0 - distances / self.characteristic_distances[None, :], 0.0, 1.0)
+        confidences = np.where(self.has_characteristic_distance[None, :], profile_confidences, 1.0 / (1.0 + distances))
+
+        top_k = max(1, min(top_k, self.n_clusters))
+        order = np.argsort(distances, axis=1, kind="stable")
+        rows = np.arange(distances.shape[0])
+        labels = order[:, 0]
+        if self.n_clusters >= 2:
+            best, second = distances[rows, order[:, 0]], distances[rows, order[:, 1]]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                margins = np.where(second > 0, (second - best) / second, 0.0)
+        else:
+            margins = np.full(distances.shape[0], np.nan, dtype=np.float32)
+        return BatchAssignment(labels, distances, confidences, margins, order[:, :top_k])
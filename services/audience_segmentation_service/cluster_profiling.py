@@ -0,0 +1,139 @@
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+from cluster_assignment import ClusterAssigner
+
+# Automatic cluster profiles for models/cluster_profiles.json, generated by train_models.py.
+# Everything is computed on sparse (ads x terms) matrices aggregated per cluster with one
+# (clusters x ads) indicator product, so the cost is a few passes over the corpus whatever k is.
+PROFILE_TOP_KEYWORDS = 8 # Distinguishing c-TF-IDF terms kept per cluster
+PROFILE_MAX_TERM_DOC_SHARE = 0.5 # Ignore terms found in more than this share of all ads
+PROFILE_MAX_SKILLS = 12
+PROFILE_MIN_SKILL_SHARE = 0.15 # A taxonomy skill must appear in at least this share of the cluster's ads
+PROFILE_MIN_LABEL_SHARE = 0.2 # Same for the industry / seniority picked for a cluster
+PROFILE_DISTANCE_PERCENTILES = (50, 75, 90, 95, 99)
+PROFILE_CHARACTERISTIC_PERCENTILE = 95 # characteristic_distance: confidence reaches 0 at this percentile of member distances
+FALLBACK_INDUSTRY = "General"
+
+def load_taxonomy(path: str) -> Dict[str, Any]:
+    """Reads lib/automation/audience_taxonomy.yaml. Returns {} (no taxonomy matching) if PyYAML or the file is missing."""
+    try:
+        import yaml # Only needed for training
+    except ImportError:
+        print("WARNING: PyYAML is not installed; cluster profiles will not be matched against the audience taxonomy.")
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        print(f"WARNING: Could not load audience taxonomy from {path}: {e}")
+        return {}
+
+def _phrase(label: str) -> str:
+    """Taxonomy label as the CountVectorizer would tokenize it ("Entry-Level" -> "entry level")."""
+    return " ".join(re.findall(r"(?u)\b\w\w+\b", label.lower()))
+
+def _cluster_indicator(labels: np.ndarray, n_clusters: int) -> sparse.csr_matrix:
+    """(clusters x ads) 0/1 matrix; indicator @ ad_term_matrix sums the term counts of each cluster."""
+    return sparse.csr_matrix((np.ones(len(labels)), (labels, np.arange(len(labels)))), shape=(n_clusters, len(labels)))
+
+def class_tfidf(texts: Sequence[str], indicator: sparse.csr_matrix, top_n: int = PROFILE_TOP_KEYWORDS) -> List[List[str]]:
+    """
+    Top distinguishing terms of each cluster with c-TF-IDF: all ads of a cluster form one document,
+    term frequency is normalized per cluster and idf = log(1 + mean words per cluster / corpus term frequency).
+    """
+    # Terms in most ads (e.g. "experience") distinguish no cluster; drop them once the corpus is big enough to tell.
+    vectorizer = CountVectorizer(ngram_range=(1, 2), stop_words="english", min_df=2 if len(texts) >= 50 else 1,
+                                 max_df=PROFILE_MAX_TERM_DOC_SHARE if len(texts) >= 20 else 1.0)
+    term_counts = vectorizer.fit_transform(texts)
+    class_counts = (indicator @ term_counts).tocsr().astype(np.float64)
+    words_per_class = np.asarray(class_counts.sum(axis=1)).ravel()
+    term_frequency = sparse.diags(1.0 / np.maximum(words_per_class, 1)) @ class_counts
+    idf = np.log(1.0 + words_per_class.mean() / np.maximum(np.asarray(class_counts.sum(axis=0)).ravel(), 1))
+    scores = (term_frequency @ sparse.diags(idf)).toarray()
+    vocabulary = vectorizer.get_feature_names_out()
+    top_terms = []
+    for row in scores:
+        order = np.argsort(-row)[:top_n]
+        top_terms.append([str(vocabulary[i]) for i in order if row[i] > 0])
+    return top_terms
+
+def _phrase_shares(texts: Sequence[str], labels: List[str], indicator: sparse.csr_matrix, cluster_sizes: np.ndarray) -> np.ndarray:
+    """(clusters x labels) share of each cluster's ads that mention each taxonomy label."""
+    if not labels:
+        return np.zeros((indicator.shape[0], 0))
+    phrases = [_phrase(label) for label in labels]
+    max_words = max(len(phrase.split()) for phrase in phrases)
+    vocabulary = sorted(set(phrases))
+    vectorizer = CountVectorizer(vocabulary=vocabulary, ngram_range=(1, max(1, max_words)), binary=True)
+    mentions = indicator @ vectorizer.transform(texts) # (clusters x vocabulary) number of ads mentioning each phrase
+    mentions = np.asarray(mentions.todense(), dtype=np.float64) / np.maximum(cluster_sizes, 1)[:, None]
+    column = {phrase: i for i, phrase in enumerate(vocabulary)}
+    return mentions[:, [column[phrase] for phrase in phrases]]
+
+def _best_label(shares: np.ndarray, corpus_shares: np.ndarray, labels: List[str]) -> Optional[str]:
+    """Label over-represented the most in the cluster (share minus corpus share), if common enough there."""
+    if not labels:
+        return None
+    lift = shares - corpus_shares
+    best = int(np.argmax(lift))
+    return labels[best] if shares[best] >= PROFILE_MIN_LABEL_SHARE and lift[best] > 0 else None
+
+def generate_cluster_profiles(texts: Sequence[str], reduced_embeddings: np.ndarray, centroids: np.ndarray,
+                              taxonomy: Optional[Dict[str, Any]] = None) -> Dict[str, dict]:
+    """
+    Builds {cluster_id: profile} in the format main.py reads: name, description, industry, seniority,
+    skills, keywords and characteristic_distance, plus size and distance_percentiles for inspection.
+    """
+    taxonomy = taxonomy or {}
+    assigner = ClusterAssigner.from_centroids(np.asarray(centroids), None)
+    assignment = assigner.assign(reduced_embeddings)
+    labels = assignment.labels
+    own_distances = assignment.distances[np.arange(len(labels)), labels]
+    indicator = _cluster_indicator(labels, assigner.n_clusters)
+    cluster_sizes = np.bincount(labels, minlength=assigner.n_clusters).astype(np.float64)
+
+    keywords = class_tfidf(texts, indicator)
+    skill_labels = list(dict.fromkeys(skill for skills in (taxonomy.get("skill_categories") or {}).values() for skill in skills or []))
+    industry_labels = [label for label in (taxonomy.get("industry_map") or {}) if label != FALLBACK_INDUSTRY]
+    seniority_labels = list(taxonomy.get("seniority_map") or {})
+    skill_shares = _phrase_shares(texts, skill_labels, indicator, cluster_sizes)
+    industry_shares = _phrase_shares(texts, industry_labels, indicator, cluster_sizes)
+    seniority_shares = _phrase_shares(texts, seniority_labels, indicator, cluster_sizes)
+    corpus_weights = cluster_sizes / max(cluster_sizes.sum(), 1)
+    corpus_industry_shares = corpus_weights @ industry_shares
+    corpus_seniority_shares = corpus_weights @ seniority_shares
+
+    profiles: Dict[str, dict] = {}
+    for cluster_index, cluster_id in enumerate(assigner.cluster_ids):
+        member_distances = own_distances[labels == cluster_index]
+        skill_order = np.argsort(-skill_shares[cluster_index], kind="stable") if skill_labels else []
+        skills = [skill_labels[i] for i in skill_order if skill_shares[cluster_index, i] >= PROFILE_MIN_SKILL_SHARE][:PROFILE_MAX_SKILLS]
+        industry = _best_label(industry_shares[cluster_index], corpus_industry_shares, industry_labels) or FALLBACK_INDUSTRY
+        seniority = _best_label(seniority_shares[cluster_index], corpus_seniority_shares, seniority_labels)
+        skill_phrases = {_phrase(skill) for skill in skills}
+        cluster_keywords = [term for term in keywords[cluster_index] if term not in skill_phrases]
+
+        profile = {
+            "name": f"{industry}: {', '.join(cluster_keywords[:3])}" if cluster_keywords else f"Cluster {cluster_id}",
+            "description": f"Generated from {len(member_distances)} corpus ads.",
+            "industry": industry,
+            "skills": skills,
+            "keywords": cluster_keywords,
+            "size": int(len(member_distances)),
+            "generated": True,
+        }
+        if seniority:
+            profile["seniority"] = seniority
+        if len(member_distances):
+            percentiles = np.percentile(member_distances, PROFILE_DISTANCE_PERCENTILES)
+            profile["distance_percentiles"] = {f"p{p}": round(float(value), 4) for p, value in zip(PROFILE_DISTANCE_PERCENTILES, percentiles)}
+            characteristic_distance = float(np.percentile(member_distances, PROFILE_CHARACTERISTIC_PERCENTILE))
+            if characteristic_distance > 0:
+                profile["characteristic_distance"] = round(characteristic_distance, 4)
+        profiles[cluster_id] = profile
+    return profiles
@@ -0,0 +1,157 @@
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+# Near-duplicate detection with MinHash signatures of word shingles and LSH banding.
+#
+# Job ads are often reposted with a different location or one sentence changed. Each ad is reduced to the
+# set of its word n-grams (shingles) after normalization; a MinHash signature of NUM_PERM values estimates the
+# Jaccard similarity of two such sets as the share of equal values. LSH splits the signature into BANDS bands
+# of ROWS values: two ads become candidates when any band matches exactly, which finds pairs above roughly
+# (1 / BANDS) ** (1 / ROWS) similarity (~0.71 here) without comparing every pair; candidates are then
+# checked against the caller's threshold.
+SHINGLE_SIZE = 3 # Words per shingle
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = np.uint64((1 << 32) - 5) # Largest prime below 2^32: a * x + b < 2^64 for 32-bit x, so uint64 never overflows
+
+def shingle_hashes(text: str, shingle_size: int = SHINGLE_SIZE) -> np.ndarray:
+    """Distinct 32-bit hashes of the word shingles of the normalized, lowercased text (stable across processes)."""
+    words = normalize_text(text).lower().split()
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    n_shingles = max(1, len(words) - shingle_size + 1)
+    hashes = {zlib.crc32(" ".join(words[i:i + shingle_size]).encode("utf-8")) for i in range(n_shingles)}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+class MinHasher:
+    """
+    MinHash with NUM_PERM universal hash functions (a * x + b) mod p, p = 2^32 - 5, a in [1, p), b in [0, p),
+    computed exactly in uint64. a and b must span the whole field: with small ones the mod never wraps, every
+    function keeps the order of x and all of them pick the same minimum shingle.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, _PRIME, size=num_perm, dtype=np.uint64)[:, None]
+        self.b = rng.randint(0, _PRIME, size=num_perm, dtype=np.uint64)[:, None]
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """(num_perm,) uint64 signature, or None for a text without words (never a duplicate of anything)."""
+        hashes = shingle_hashes(text)
+        if not len(hashes):
+            return None
+        return ((self.a * hashes[None, :] + self.b) % _PRIME).min(axis=1)
+
+def estimated_similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return float(np.mean(signature_a == signature_b))
+
+class NearDuplicateIndex:
+    """
+    LSH index of MinHash signatures with an optional value per entry. With `max_entries`, the least recently
+    matched or added entries are evicted first (serve-time result reuse); without it the index grows unbounded
+    (training-time corpus dedup). Thread-safe.
+    """
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 0, bands: int = BANDS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = bands
+        self._entries: "OrderedDict[Hashable, Tuple[np.ndarray, Any]]" = OrderedDict()
+        self._buckets: List[Dict[bytes, List[Hashable]]] = [{} for _ in range(bands)]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [band.tobytes() for band in np.array_split(signature, self.bands)]
+
+    def add(self, key: Hashable, signature: np.ndarray, value: Any = None):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (signature, value)
+            for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+                buckets.setdefault(band_key, []).append(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        signature, _ = self._entries.pop(key)
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket = buckets.get(band_key)
+            if bucket is not None:
+                bucket.remove(key)
+                if not bucket:
+                    del buckets[band_key]
+
+    def query(self, signature: np.ndarray) -> List[Tuple[Hashable, float, Any]]:
+        """(key, estimated similarity, value) of the entries at or above the threshold, most similar first."""
+        with self._lock:
+            candidates = {key for buckets, band_key in zip(self._buckets, self._band_keys(signature))
+                          for key in buckets.get(band_key, ())}
+            matches = []
+            for key in candidates:
+                stored_signature, value = self._entries[key]
+                similarity = estimated_similarity(signature, stored_signature)
+                if similarity >= self.threshold:
+                    matches.append((key, similarity, value))
+            matches.sort(key=lambda match: -match[1])
+            for key, _, _ in matches[:1]:
+                self._entries.move_to_end(key) # Keep frequently matched entries
+            if matches:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return matches
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets = [{} for _ in range(self.bands)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+def deduplicate(ad_ids: Sequence[str], texts: Sequence[str], threshold: float = 0.85) -> Tuple[List[int], Dict[str, str]]:
+    """
+    Collapses near-duplicate ads, keeping the first ad of each group. Returns the indices of the kept ads
+    (input order) and {dropped ad id: id of the kept ad it duplicates}.
+    """
+    hasher = MinHasher()
+    index = NearDuplicateIndex(threshold=threshold)
+    kept: List[int] = []
+    duplicate_of: Dict[str, str] = {}
+    for i, (ad_id, text) in enumerate(zip(ad_ids, texts)):
+        signature = hasher.signature(text)
+        if signature is not None:
+            matches = index.query(signature)
+            if matches:
+                duplicate_of[ad_id] = matches[0][0]
+                continue
+            index.add(ad_id, signature)
+        kept.append(i)
+    return kept, duplicate_of
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("audience_segmentation.embedding_cache")
+
+def normalize_text(text: str) -> str:
+    """Normalization applied before hashing: NFKC unicode form and collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def cache_key(text: str, model_version: str) -> str:
+    """Content address of a job ad text for a given model version (SBERT + reducer)."""
+    payload = f"{model_version}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+class EmbeddingCache:
+    """
+    Two-tier cache of (sbert_embedding, reduced_embedding) pairs keyed by cache_key().
+    Tier 1 is an in-memory LRU bounded by `max_entries` with a `ttl_seconds` expiry.
+    Tier 2 (optional, when `disk_dir` is set) stores one .npz file per key so entries survive
+    restarts and are shared between worker processes; its TTL is checked against the file mtime.
+    Safe to use from several inference threads.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 86400.0, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir or None
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.disk_dir is not None
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds > 0 and (time.time() - stored_at) > self.ttl_seconds
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npz")
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, sbert_embedding, reduced_embedding = entry
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return sbert_embedding, reduced_embedding
+                del self._entries[key]
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                stored_at = os.path.getmtime(path)
+                if not self._expired(stored_at):
+                    with np.load(path) as data:
+                        sbert_embedding, reduced_embedding = data["sbert"], data["reduced"]
+                    self._put_memory(key, sbert_embedding, reduced_embedding, stored_at)
+                    with self._lock:
+                        self.disk_hits += 1
+                    return sbert_embedding, reduced_embedding
+            except (OSError, ValueError, KeyError):
+                pass # Missing, expired or unreadable entry: treat as a miss
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_memory(self, key: str, sbert_embedding: np.ndarray, reduced_embedding: np.ndarray, stored_at: float):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (stored_at, sbert_embedding, reduced_embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key: str, sbert_embedding: np.ndarray, reduced_embedding: np.ndarray):
+        sbert_embedding = np.array(sbert_embedding, dtype=np.float32)
+        reduced_embedding = np.array(reduced_embedding, dtype=np.float32)
+        self._put_memory(key, sbert_embedding, reduced_embedding, time.time())
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a temp file and rename so concurrent readers never see a partial file.
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, sbert=sbert_embedding, reduced=reduced_embedding)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not write embedding cache entry to disk: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_dir": self.disk_dir,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+            }
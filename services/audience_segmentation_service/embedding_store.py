@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+# Persistent SBERT embeddings of the training corpus, so train_models.py only encodes new or changed ads.
+#
+#   data/embedding_store/
+#     index.json        <- encoder name, dimension, row count, matrix file name and {ad_id: {"row": r, "sha256": h}}
+#     embeddings-N.npy  <- (capacity, dimension) float32 matrix, opened memory-mapped
+#
+# A row is reused while its ad's content hash is unchanged. New and changed ads are appended as new rows
+# (the index is only rewritten after the matrix is flushed, so a crash never pairs a hash with the wrong
+# vector); the rows they replace, and those of ads that left the corpus, are dropped by compact().
+# compact() renumbers the rows, so it writes a new matrix file: the old index keeps pointing at the old
+# file until save() atomically switches the index over, and only then is the old file deleted.
+INDEX_FILENAME = "index.json"
+EMBEDDINGS_FILENAME = "embeddings.npy" # Matrix file of indexes saved before matrix files were versioned
+EMBEDDINGS_FILE_PATTERN = "embeddings-{generation}.npy"
+STORE_FORMAT_VERSION = 1
+MIN_CAPACITY = 1024
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+class EmbeddingStore:
+    """On-disk embedding matrix keyed by ad id and content hash. Not safe for concurrent writers."""
+
+    def __init__(self, store_dir: str, encoder_name: str, dimension: int):
+        self.store_dir = store_dir
+        self.encoder_name = encoder_name
+        self.dimension = dimension
+        self.entries: Dict[str, Dict[str, object]] = {} # ad_id -> {"row": int, "sha256": str}
+        self.n_rows = 0
+        self.embeddings_file = EMBEDDINGS_FILE_PATTERN.format(generation=0)
+        self._matrix: Optional[np.ndarray] = None
+        os.makedirs(store_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.store_dir, INDEX_FILENAME)
+
+    @property
+    def _embeddings_path(self) -> str:
+        return os.path.join(self.store_dir, self.embeddings_file)
+
+    def _load(self):
+        try:
+            with open(self._index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return # New (or unreadable) store: start empty
+        if (index.get("format_version"), index.get("encoder"), index.get("dimension")) != (STORE_FORMAT_VERSION, self.encoder_name, self.dimension):
+            print(f"Embedding store in {self.store_dir} was built for {index.get('encoder')} ({index.get('dimension')}d); starting a new one.")
+            return
+        self.embeddings_file = index.get("embeddings_file", EMBEDDINGS_FILENAME)
+        try:
+            self._matrix = np.load(self._embeddings_path, mmap_mode='r+')
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Could not open {self._embeddings_path} ({e}); starting a new embedding store.")
+            self.embeddings_file = self._next_embeddings_file()
+            return
+        self.entries = index["entries"]
+        self.n_rows = int(index["rows"])
+
+    def _next_embeddings_file(self) -> str:
+        """A matrix file name no index refers to yet."""
+        generation = 0
+        while os.path.exists(os.path.join(self.store_dir, EMBEDDINGS_FILE_PATTERN.format(generation=generation))):
+            generation += 1
+        return EMBEDDINGS_FILE_PATTERN.format(generation=generation)
+
+    def _ensure_capacity(self, n_rows: int):
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if n_rows <= capacity:
+            return
+        new_capacity = max(MIN_CAPACITY, capacity * 2, n_rows)
+        tmp_path = self._embeddings_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(new_capacity, self.dimension))
+        if self._matrix is not None:
+            grown[:self.n_rows] = self._matrix[:self.n_rows]
+        grown.flush()
+        del grown
+        self._matrix = None
+        os.replace(tmp_path, self._embeddings_path)
+        self._matrix = np.load(self._embeddings_path, mmap_mode='r+')
+
+    def lookup(self, ad_id: str, text_hash: str) -> Optional[int]:
+        """Row holding the embedding of `ad_id` if it was stored for the same content, else None."""
+        entry = self.entries.get(ad_id)
+        return int(entry["row"]) if entry is not None and entry["sha256"] == text_hash else None
+
+    def embed(self, ad_ids: Sequence[str], texts: Sequence[str], encode_fn: Callable[[List[str]], np.ndarray]) -> Tuple[np.ndarray, int]:
+        """
+        Returns the (len(texts), dimension) embeddings in input order, calling `encode_fn` only for ads
+        that are new or whose text changed, and the number of ads encoded. Call save() to persist.
+        """
+        hashes = [content_hash(text) for text in texts]
+        rows = [self.lookup(ad_id, text_hash) for ad_id, text_hash in zip(ad_ids, hashes)]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            new_embeddings = np.asarray(encode_fn([texts[i] for i in missing]), dtype=np.float32)
+            self._ensure_capacity(self.n_rows + len(missing))
+            for i, embedding in zip(missing, new_embeddings):
+                row = self.n_rows
+                self.n_rows += 1
+                self._matrix[row] = embedding
+                self.entries[ad_ids[i]] = {"row": row, "sha256": hashes[i]}
+                rows[i] = row
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32), 0
+        return np.array(self._matrix[rows], dtype=np.float32), len(missing)
+
+    def compact(self, keep_ad_ids: Sequence[str]):
+        """Rewrites the matrix with only the current rows of `keep_ad_ids`, dropping removed ads and superseded rows."""
+        keep = [ad_id for ad_id in dict.fromkeys(keep_ad_ids) if ad_id in self.entries]
+        if len(keep) == self.n_rows:
+            return
+        old_rows = [int(self.entries[ad_id]["row"]) for ad_id in keep]
+        kept_embeddings = np.array(self._matrix[old_rows], dtype=np.float32) if old_rows else np.zeros((0, self.dimension), np.float32)
+        print(f"Compacting embedding store: dropping {self.n_rows - len(keep)} stale row(s).")
+        self.entries = {ad_id: {"row": row, "sha256": self.entries[ad_id]["sha256"]} for row, ad_id in enumerate(keep)}
+        self.n_rows = len(keep)
+        # The renumbered rows go to a new file; the saved index still refers to the old one until save().
+        self._matrix = None
+        self.embeddings_file = self._next_embeddings_file()
+        self._ensure_capacity(self.n_rows)
+        if self.n_rows:
+            self._matrix[:self.n_rows] = kept_embeddings
+
+    def save(self):
+        """
+        Flushes the matrix, then atomically replaces the index (rows written before the index are never referenced
+        early), then deletes matrix files the index no longer refers to (superseded by compact(), or left by a crash).
+        """
+        if self._matrix is not None:
+            self._matrix.flush()
+        index = {
+            "format_version": STORE_FORMAT_VERSION,
+            "encoder": self.encoder_name,
+            "dimension": self.dimension,
+            "rows": self.n_rows,
+            "embeddings_file": self.embeddings_file,
+            "entries": self.entries,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path)
+        for filename in os.listdir(self.store_dir):
+            if filename.startswith("embeddings") and filename.endswith(".npy") and filename != self.embeddings_file:
+                os.remove(os.path.join(self.store_dir, filename))
@@ -0,0 +1,126 @@
+import json
+import os
+from typing import List, Union
+
+import numpy as np
+
+# Selectable sentence encoder backends (SEGMENTATION_ENCODER_BACKEND in main.py).
+#   "torch"     - the regular sentence-transformers / PyTorch model
+#   "onnx"      - the same network exported to an ONNX Runtime graph (fp32)
+#   "onnx-int8" - the ONNX graph with dynamically quantized int8 weights
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_FP32_FILENAME = "model.onnx"
+ONNX_INT8_FILENAME = "model.int8.onnx"
+ONNX_CONFIG_FILENAME = "encoder_config.json"
+
+class OnnxSentenceEncoder:
+    """
+    ONNX Runtime replacement for SentenceTransformer.encode on CPU.
+    Mirrors the subset of the SentenceTransformer API used by the service (encode,
+    get_sentence_embedding_dimension, tokenizer, max_seq_length) so it can be swapped in directly.
+    Reproduces the exported model's mean pooling and optional L2 normalization.
+    """
+
+    def __init__(self, export_dir: str, quantized: bool = False, intra_op_threads: int = 0):
+        import onnxruntime as ort # Optional dependency, only needed for the ONNX backends
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(export_dir, ONNX_CONFIG_FILENAME), 'r') as f:
+            self.config = json.load(f)
+        model_path = os.path.join(export_dir, ONNX_INT8_FILENAME if quantized else ONNX_FP32_FILENAME)
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            session_options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, sess_options=session_options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.max_seq_length = int(self.config.get("max_seq_length", 256))
+        self.normalize = bool(self.config.get("normalize", True))
+        self.dimension = int(self.config["dimension"])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_numpy: bool = True, **_) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        # Sort by length so each batch is padded to similar lengths, then restore input order.
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), batch_size):
+            batch_idx = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in batch_idx], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np",
+            )
+            feed = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            token_embeddings = self.session.run(None, feed)[0]
+            # Mean pooling over non-padding tokens, as in the sentence-transformers Pooling module.
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            embeddings[batch_idx] = pooled
+        return embeddings[0] if single else embeddings
+
+def load_encoder(backend: str, model_name: str, onnx_dir: str):
+    """Returns a SentenceTransformer-compatible encoder for the requested backend."""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}'. Expected one of {ENCODER_BACKENDS}.")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    return OnnxSentenceEncoder(onnx_dir, quantized=(backend == "onnx-int8"))
+
+def export_onnx_encoder(sbert_model, model_name: str, output_dir: str, quantize: bool = True) -> str:
+    """
+    Exports the transformer inside a loaded SentenceTransformer to ONNX (plus an int8 copy when
+    `quantize` is set) together with its tokenizer and pooling config. Returns the output directory.
+    """
+    import torch
+    from sentence_transformers.models import Normalize, Pooling
+
+    pooling = next((module for module in sbert_model if isinstance(module, Pooling)), None)
+    if pooling is not None and not pooling.pooling_mode_mean_tokens:
+        raise ValueError("Only mean-pooling sentence encoders can be exported to the ONNX backend.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    transformer = sbert_model[0].auto_model.eval()
+    tokenizer = sbert_model.tokenizer
+    sample = tokenizer(["export sample"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(input_names, args))).last_hidden_state
+
+    fp32_path = os.path.join(output_dir, ONNX_FP32_FILENAME)
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(transformer), tuple(sample[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=14,
+        )
+    tokenizer.save_pretrained(output_dir)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(output_dir, ONNX_INT8_FILENAME), weight_type=QuantType.QInt8)
+
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILENAME), 'w') as f:
+        json.dump({
+            "model_name": model_name,
+            "dimension": sbert_model.get_sentence_embedding_dimension(),
+            "max_seq_length": sbert_model.max_seq_length,
+            "pooling": "mean",
+            "normalize": any(isinstance(module, Normalize) for module in sbert_model),
+            "quantized_variant": quantize,
+        }, f, indent=2)
+    return output_dir
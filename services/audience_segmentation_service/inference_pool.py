@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+def _call_with_pid(fn: Callable[..., Any], *args: Any):
+    return os.getpid(), fn(*args)
+
+class InferencePoolSaturatedError(Exception):
+    """Raised by InferencePool.run when max_pending calls are already admitted."""
+
+class InferencePool:
+    """
+    Runs CPU-bound inference off the asyncio event loop.
+    `mode` is "thread" (default; SBERT/NumPy release the GIL for most of the work) or "process"
+    (separate interpreters; `initializer` must load the models in each worker process).
+    At most `max_workers` calls run at once and at most `max_pending` are admitted in total
+    (running + waiting); beyond that `run` fails fast with InferencePoolSaturatedError so the
+    API can answer 503 instead of queueing without bound.
+    """
+
+    def __init__(self, mode: str = "thread", max_workers: int = 1, max_pending: int = 4,
+                 initializer: Optional[Callable[[], None]] = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference pool mode '{mode}'. Expected 'thread' or 'process'.")
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self._initializer = initializer
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0 # Calls currently running in the executor
+        self.pending = 0 # Calls admitted (running + waiting for a slot)
+        self.rejected = 0
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.mode == "process":
+            # "spawn" avoids forking a process that already holds torch/OpenMP thread pools.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self._initializer,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        self._slots = asyncio.Semaphore(self.max_workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def warm_up(self, fn: Callable[..., Any], *args: Any, timeout_s: float = 300.0, poll_interval_s: float = 0.05) -> Dict[int, Any]:
+        """
+        "process" mode: starts every worker process (running `initializer`) before the pool takes traffic, and
+        runs `fn(*args)` in each of them. ProcessPoolExecutor otherwise spawns workers lazily, so the first
+        requests would wait for the model loads. Returns {worker pid: fn's result}. Workers that are ready
+        first can take every call of a round, so rounds are repeated until each worker has answered or
+        `timeout_s` has passed. Thread mode shares the parent's models and only runs `fn` once.
+        """
+        if self._executor is None:
+            raise RuntimeError("InferencePool.warm_up called before start().")
+        loop = asyncio.get_running_loop()
+        if self.mode != "process":
+            return dict([await loop.run_in_executor(self._executor, _call_with_pid, fn, *args)])
+        deadline = loop.time() + timeout_s
+        results: Dict[int, Any] = {}
+        while True:
+            calls = [loop.run_in_executor(self._executor, _call_with_pid, fn, *args) for _ in range(self.max_workers)]
+            results.update(await asyncio.gather(*calls))
+            if len(results) >= self.max_workers or loop.time() >= deadline:
+                return results
+            await asyncio.sleep(poll_interval_s)
+
+    async def drain(self, poll_interval_s: float = 0.05):
+        """Waits until every admitted call has finished, then shuts the executor down. Used when replacing a pool."""
+        while self.pending > 0:
+            await asyncio.sleep(poll_interval_s)
+        self.shutdown()
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending >= self.max_pending
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._executor is None:
+            raise RuntimeError("InferencePool.run called before start().")
+        if self.saturated:
+            self.rejected += 1
+            raise InferencePoolSaturatedError(f"Inference pool saturated ({self.pending} calls pending, max {self.max_pending}).")
+        self.pending += 1
+        try:
+            async with self._slots:
+                self.in_flight += 1
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+                finally:
+                    self.in_flight -= 1
+        finally:
+            self.pending -= 1
@@ -1,21 +1,114 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional, Dict
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, List, Optional, Dict, Tuple
+from dataclasses import dataclass, field
 import numpy as np
 import joblib # For loading/saving pre-trained scikit-learn models (UMAP, KMeans)
 import os
+import hashlib
+import hmac
+import json
+import asyncio
+import functools
+import math
+import time
+import logging
+import contextlib
+import cProfile
+import random
+import itertools
 
-from sentence_transformers import SentenceTransformer
+from chunking import ChunkingConfig, encode_long_texts
+from cluster_assignment import BatchAssignment, ClusterAssigner
+from dedup import MinHasher, NearDuplicateIndex
+from embedding_cache import EmbeddingCache, cache_key
+from inference_pool import InferencePool, InferencePoolSaturatedError
+from micro_batcher import MicroBatcher, MicroBatcherFullError
+from model_bundle import ModelBundle, ModelBundleError, resolve_bundle_version, sha256_file
+from encoders import load_encoder
+from metrics import BATCH_SIZE_BUCKETS, PROMETHEUS_CONTENT_TYPE, Registry
+from vector_index import IVF_DEFAULT_N_PROBE, VectorIndex
 from umap import UMAP # We'll use this for type hinting, but load a fitted one
 from sklearn.cluster import KMeans # For type hinting and potentially for the dummy model
-from sklearn.metrics.pairwise import euclidean_distances # For distance to centroid
 
 # --- Configuration --- #
 MODEL_DIR = "./models" # Directory to store/load pre-trained models
 SBERT_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Sentence encoder backend, one of encoders.ENCODER_BACKENDS: "torch" (default), "onnx" or "onnx-int8".
+# The ONNX variants are produced by `python train_models.py --export-onnx` into ONNX_ENCODER_DIR.
+ENCODER_BACKEND = os.environ.get("SEGMENTATION_ENCODER_BACKEND", "torch")
+ONNX_ENCODER_DIR = os.path.join(MODEL_DIR, "onnx_encoder")
 UMAP_MODEL_PATH = os.path.join(MODEL_DIR, "fitted_umap.pkl")
 KMEANS_MODEL_PATH = os.path.join(MODEL_DIR, "fitted_kmeans.pkl")
+PROJECTION_PATH = os.path.join(MODEL_DIR, "fitted_projection.npz") # Fast UMAP approximations written by train_models.py
+# Stage 3 reduction: "umap" (fitted_umap.transform), or "linear" / "pca" (one matrix multiply onto the UMAP
+# coordinates, no numba warm-up). train_models.py reports each mode's cluster agreement with true UMAP.
+REDUCTION_MODE = os.environ.get("SEGMENTATION_REDUCTION_MODE", "umap")
 CLUSTER_PROFILES_PATH = os.path.join(MODEL_DIR, "cluster_profiles.json") # Placeholder for pre-computed profiles
+# Pickle-free artifact bundles written by train_models.py (see model_bundle.py). When a bundle is found its
+# memory-mapped centroids/projections and profiles are used; the .pkl/.npz/.json files above are the fallback.
+MODEL_BUNDLE_DIR = os.path.join(MODEL_DIR, "bundles")
+MODEL_BUNDLE_VERSION = os.environ.get("SEGMENTATION_MODEL_BUNDLE", "latest") # A version name, "latest", or "none" for the legacy files
+VERIFY_BUNDLE_CHECKSUMS = os.environ.get("SEGMENTATION_VERIFY_BUNDLE_CHECKSUMS", "0") == "1" # Hash every file at startup (slower cold start)
+LEGACY_MODEL_VERSION = "legacy-pickle" # model_version reported when running on the .pkl/.npz/.json files
+
+# Hot reload of a new bundle without a restart (POST /admin/reload, or polling LATEST)
+ADMIN_TOKEN = os.environ.get("SEGMENTATION_ADMIN_TOKEN", "") # Required in X-Admin-Token; /admin/reload is disabled when unset
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("SEGMENTATION_MODEL_WATCH_INTERVAL_S", "0")) # Poll LATEST every N seconds and reload on change, 0 = off
+RELOAD_CANARY_CORPUS_PATH = "./data/job_ads_corpus.json" # Canary ads a new bundle must segment before it is swapped in
+RELOAD_CANARY_SIZE = 8
+SBERT_ENCODE_BATCH_SIZE = 64 # Internal mini-batch size for sbert_model.encode
+# Long job ads (see chunking.py): "chunk" encodes every token-bounded chunk of an ad and pools the chunk vectors,
+# "truncate" keeps the encoder's own truncation at max_seq_length. Must match the setting the bundle was trained with.
+CHUNKING = ChunkingConfig(
+    mode=os.environ.get("SEGMENTATION_LONG_TEXT_MODE", "chunk"),
+    max_tokens=int(os.environ.get("SEGMENTATION_CHUNK_MAX_TOKENS", "0")), # Per chunk incl. special tokens, 0 = encoder max_seq_length
+    overlap_tokens=int(os.environ.get("SEGMENTATION_CHUNK_OVERLAP_TOKENS", "32")),
+    pooling=os.environ.get("SEGMENTATION_CHUNK_POOLING", "mean"), # "mean" or "length" (weighted by chunk token count)
+)
+MAX_SEGMENT_BATCH_SIZE = 1000 # Max job ads accepted by /segment/batch in one request
+STREAM_CHUNK_SIZE = int(os.environ.get("SEGMENTATION_STREAM_CHUNK_SIZE", "256")) # Job ads per pipeline run in /segment/stream
+STREAM_SATURATED_RETRY_S = 0.1 # /segment/stream waits and retries a chunk instead of failing mid-stream when the pool is full
+DEFAULT_TOP_K_CLUSTERS = int(os.environ.get("SEGMENTATION_DEFAULT_TOP_K_CLUSTERS", "3")) # Size of top_clusters unless the request sets top_k_clusters
+LOW_CONFIDENCE_THRESHOLD = 0.25 # Matches CONFIDENCE_THRESHOLD in lib/automation/engine.ts
+MAX_SIMILAR_ADS = 50 # Upper bound of top_k_similar_ads per job ad
+SIMILAR_ADS_N_PROBE = int(os.environ.get("SEGMENTATION_SIMILAR_ADS_N_PROBE", str(IVF_DEFAULT_N_PROBE))) # IVF lists scanned per lookup (recall vs. latency)
+
+# Micro-batching of concurrent /segment calls (see micro_batcher.py)
+MICRO_BATCH_MAX_SIZE = int(os.environ.get("SEGMENTATION_MICRO_BATCH_MAX_SIZE", "32")) # Max items coalesced into one pipeline run
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get("SEGMENTATION_MICRO_BATCH_MAX_WAIT_MS", "5")) # Max time the first queued item waits for company
+MICRO_BATCH_MAX_QUEUE_DEPTH = int(os.environ.get("SEGMENTATION_MICRO_BATCH_MAX_QUEUE_DEPTH", "1000")) # Pending items before /segment returns 503
+
+# Inference worker pool, keeps CPU-bound model calls off the event loop (see inference_pool.py)
+INFERENCE_EXECUTOR = os.environ.get("SEGMENTATION_INFERENCE_EXECUTOR", "thread") # "thread" or "process"
+INFERENCE_MAX_WORKERS = int(os.environ.get("SEGMENTATION_INFERENCE_MAX_WORKERS", "2")) # Batches running concurrently
+INFERENCE_MAX_PENDING = int(os.environ.get("SEGMENTATION_INFERENCE_MAX_PENDING", "8")) # Running + waiting batches before 503
+
+# Embedding cache (see embedding_cache.py); a hit skips SBERT and UMAP entirely
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("SEGMENTATION_EMBEDDING_CACHE_MAX_ENTRIES", "10000")) # In-memory LRU size, 0 disables it
+EMBEDDING_CACHE_TTL_SECONDS = float(os.environ.get("SEGMENTATION_EMBEDDING_CACHE_TTL_SECONDS", "86400")) # 0 means no expiry
+EMBEDDING_CACHE_DIR = os.environ.get("SEGMENTATION_EMBEDDING_CACHE_DIR", "") # Optional on-disk tier, e.g. "./cache/embeddings"
+
+# Near-duplicate reuse (see dedup.py), opt-in: an ad whose MinHash similarity to a recently segmented ad (or an earlier
+# ad of the same batch) reaches the threshold gets that ad's result (cluster, confidences, similar ads) without running
+# the model pipeline. The result then describes a *different* ad: at 0.9 a one-word edit such as "Senior" -> "Junior"
+# in an average-length ad still matches. Reused results carry near_duplicate_similarity so callers can tell.
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.environ.get("SEGMENTATION_NEAR_DUPLICATE_MAX_ENTRIES", "0")) # Recent results kept per process, 0 (default) disables reuse
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("SEGMENTATION_NEAR_DUPLICATE_THRESHOLD", "0.9")) # Estimated Jaccard similarity of word 3-shingles
+
+# Logging & instrumentation (see metrics.py; scraped at /metrics)
+LOG_LEVEL = os.environ.get("SEGMENTATION_LOG_LEVEL", "INFO").upper() # DEBUG adds per-batch details; WARNING for quiet production logs
+PROFILE_SAMPLE_RATE = float(os.environ.get("SEGMENTATION_PROFILE_SAMPLE_RATE", "0")) # Share of pipeline batches run under cProfile, 0 = off
+PROFILE_DIR = os.environ.get("SEGMENTATION_PROFILE_DIR", "./profiles") # Where sampled .prof files are written (view with snakeviz / pstats)
+
+logger = logging.getLogger("audience_segmentation")
+logger.setLevel(LOG_LEVEL)
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
 
 app = FastAPI(
     title="Audience Segmentation Service",
@@ -24,231 +117,1014 @@ app = FastAPI(
 )
 
 # --- Globals for Loaded Models & Data --- #
-sbert_model: Optional[SentenceTransformer] = None
-fitted_umap: Optional[UMAP] = None
-fitted_kmeans: Optional[KMeans] = None
-cluster_profiles: Optional[Dict[str, dict]] = None # e.g., {"0": {"name": "Profile A"}, "1": ...}
+@dataclass(frozen=True)
+class SegmentationModels:
+    """
+    Everything downstream of the sentence encoder that a retrain replaces (reducer, centroids, profiles).
+    Immutable: a hot reload builds a new instance and swaps `current_models` in one reference assignment,
+    while batches already running keep the instance they started with.
+    """
+    version: str # Bundle model_version, or LEGACY_MODEL_VERSION for the pickled files
+    reduction_mode: str # REDUCTION_MODE, or "umap" if the projection could not be loaded
+    fitted_umap: Optional[UMAP]
+    projection_weights: Optional[np.ndarray] # (sbert_dim, reduced_dim) float32, for the "linear"/"pca" reduction modes
+    projection_bias: Optional[np.ndarray]
+    fitted_kmeans: Optional[KMeans] # Only set on the legacy pickle path
+    cluster_profiles: Dict[str, dict] # e.g., {"0": {"name": "Profile A"}, "1": ...}
+    cluster_assigner: Optional[ClusterAssigner] # Centroid table built from the K-Means centroids + cluster_profiles
+    bundle: Optional[ModelBundle] # Loaded artifact bundle, None when running on the legacy pickles
+    cache_version: str # Part of every embedding cache key
+    similar_ads_index: Optional[VectorIndex] = None # Corpus k-NN index from the bundle, for top_k_similar_ads
+    similar_ads_space: Optional[str] = None # "sbert" or "reduced": which embedding the index is queried with
+    load_problems: Tuple[str, ...] = () # Reasons these models must not serve, found while loading (see validate_segmentation_models)
+    loaded_at: float = field(default_factory=time.time)
+
+sbert_model: Optional[Any] = None # SentenceTransformer, or encoders.OnnxSentenceEncoder for the ONNX backends
+current_models: Optional[SegmentationModels] = None # Read once per batch; replaced atomically by reloads
+embedding_cache = EmbeddingCache(
+    max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+    ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+    disk_dir=EMBEDDING_CACHE_DIR or None,
+)
+min_hasher = MinHasher()
+near_duplicate_index = NearDuplicateIndex(threshold=NEAR_DUPLICATE_THRESHOLD, max_entries=NEAR_DUPLICATE_MAX_ENTRIES) # Values are SegmentationOutputs
+_near_duplicate_keys = itertools.count()
+inference_pool: Optional[InferencePool] = None # Runs run_segmentation_batch off the event loop
+segment_batcher: Optional[MicroBatcher] = None # Coalesces concurrent /segment calls
+reload_lock = asyncio.Lock() # One reload at a time
+last_reload: Optional[dict] = None # Outcome of the most recent reload attempt, reported by /health
+model_watch_task: Optional[asyncio.Task] = None
+
+# --- Metrics --- #
+# Pipeline stats are measured where the batch runs (possibly a worker process) and recorded here by
+# run_segmentation_batch_offloaded; state owned by other objects is read by callback gauges at scrape time.
+METRICS = Registry()
+STAGE_DURATION = METRICS.histogram("segmentation_stage_duration_seconds", "Time per pipeline stage and batch (encode=SBERT, reduce=UMAP/projection, assign=K-Means, similar=similar-ads lookup, profile=primitives, dedup=near-duplicate lookup).", ("stage",))
+BATCH_SIZE = METRICS.histogram("segmentation_batch_size", "Job ads per pipeline run.", buckets=BATCH_SIZE_BUCKETS)
+ITEMS_TOTAL = METRICS.counter("segmentation_items_total", "Job ads run through the pipeline.")
+ITEM_ERRORS_TOTAL = METRICS.counter("segmentation_item_errors_total", "Job ads that failed within a batch.")
+LOW_CONFIDENCE_TOTAL = METRICS.counter("segmentation_low_confidence_total", f"Assignments with confidence below {LOW_CONFIDENCE_THRESHOLD}.")
+DEFAULT_PRIMITIVES_TOTAL = METRICS.counter("segmentation_default_primitives_total", "Job ads answered with the generic fallback primitives instead of a cluster profile.")
+REDUCTION_FALLBACKS_TOTAL = METRICS.counter("segmentation_reduction_fallbacks_total", "Batches whose reduction failed and fell back to SBERT embeddings.")
+CACHE_LOOKUPS_TOTAL = METRICS.counter("segmentation_embedding_cache_lookups_total", "Embedding cache lookups of distinct texts by result.", ("result",))
+NEAR_DUPLICATES_TOTAL = METRICS.counter("segmentation_near_duplicate_reuses_total", "Job ads answered with the result of a near-duplicate ad instead of running the model pipeline.")
+POOL_REJECTED_TOTAL = METRICS.counter("segmentation_inference_rejected_total", "Batches rejected because the inference pool was saturated.")
+REQUESTS_IN_FLIGHT = METRICS.gauge("segmentation_requests_in_flight", "Requests currently being handled.", ("endpoint",))
+REQUEST_DURATION = METRICS.histogram("segmentation_request_duration_seconds", "Request handling time.", ("endpoint", "status"))
+METRICS.gauge("segmentation_micro_batch_queue_depth", "Single-item requests waiting to be coalesced into a batch.",
+              callback=lambda: {(): segment_batcher.queue_depth} if segment_batcher else {})
+METRICS.gauge("segmentation_inference_pending", "Batches admitted to the inference pool (running + waiting).",
+              callback=lambda: {(): inference_pool.pending} if inference_pool else {})
+METRICS.gauge("segmentation_inference_in_flight", "Batches currently running in the inference pool.",
+              callback=lambda: {(): inference_pool.in_flight} if inference_pool else {})
+METRICS.gauge("segmentation_embedding_cache_entries", "Entries in the parent process's in-memory embedding cache.",
+              callback=lambda: {(): embedding_cache.stats()["entries"]})
+METRICS.gauge("segmentation_model_info", "Loaded model bundle (value is always 1).", ("model_version", "reduction_mode", "encoder_backend"),
+              callback=lambda: {(current_models.version, current_models.reduction_mode, ENCODER_BACKEND): 1} if current_models else {})
 
 # --- Lifespan Events for Model Loading --- #
-@app.on_event("startup")
-async def load_models():
-    global sbert_model, fitted_umap, fitted_kmeans, cluster_profiles
-    print(f"Loading Sentence-BERT model ({SBERT_MODEL_NAME})...")
-    try:
-        sbert_model = SentenceTransformer(SBERT_MODEL_NAME)
-        print("Sentence-BERT model loaded successfully.")
-    except Exception as e:
-        print(f"CRITICAL: Error loading Sentence-BERT model: {e}")
-        # App might not be usable without SBERT, consider raising an error or specific handling
+def _file_digest(path: str) -> str:
+    """Short sha256 of a model file, used to version cache keys."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+def load_models_sync(bundle_version: str = MODEL_BUNDLE_VERSION):
+    """Loads the encoder and the segmentation models into the module globals. Also the initializer of "process" inference workers."""
+    global sbert_model, current_models
+    if sbert_model is None:
+        logger.info(f"Loading Sentence-BERT model ({SBERT_MODEL_NAME}, backend={ENCODER_BACKEND})...")
+        try:
+            sbert_model = load_encoder(ENCODER_BACKEND, SBERT_MODEL_NAME, ONNX_ENCODER_DIR)
+            logger.info("Sentence-BERT model loaded successfully.")
+        except Exception as e:
+            logger.critical(f"Error loading Sentence-BERT model: {e}")
+            # App might not be usable without SBERT, consider raising an error or specific handling
+
+    current_models = load_segmentation_models(bundle_version)
 
+def load_segmentation_models(bundle_version: str) -> SegmentationModels:
+    """Builds a SegmentationModels from a bundle version ("latest", a name, or "none" for the legacy files). Does not touch the globals."""
     # Ensure model directory exists (for dummy model creation if paths don't exist)
     os.makedirs(MODEL_DIR, exist_ok=True)
 
-    print(f"Loading pre-fitted UMAP model from {UMAP_MODEL_PATH}...")
-    if os.path.exists(UMAP_MODEL_PATH):
+    model_bundle = _load_model_bundle(bundle_version)
+    trained_chunking = model_bundle.manifest.get("encoder", {}).get("long_text") if model_bundle else None
+    if trained_chunking is not None and trained_chunking != CHUNKING.describe():
+        logger.warning(f"Bundle was trained with long text setting '{trained_chunking}' but the service uses '{CHUNKING.describe()}'; "
+                       "embeddings of long ads will not match the trained models.")
+    fitted_umap: Optional[UMAP] = None
+    fitted_kmeans: Optional[KMeans] = None
+    load_problems: List[str] = []
+    cache_version = f"{SBERT_MODEL_NAME}:{ENCODER_BACKEND}:{CHUNKING.describe()}"
+
+    active_reduction_mode = "umap"
+    projection_weights, projection_bias = None, None
+    if REDUCTION_MODE != "umap" and model_bundle is not None and model_bundle.has(f"{REDUCTION_MODE}_weights"):
+        # Memory-mapped: every worker process shares the same physical pages.
+        projection_weights = model_bundle.array(f"{REDUCTION_MODE}_weights")
+        projection_bias = model_bundle.array(f"{REDUCTION_MODE}_bias")
+        active_reduction_mode = REDUCTION_MODE
+        cache_version = f"{SBERT_MODEL_NAME}:{ENCODER_BACKEND}:{CHUNKING.describe()}|{REDUCTION_MODE}:{model_bundle.version}"
+        logger.info(f"'{REDUCTION_MODE}' projection memory-mapped from bundle (weights {projection_weights.shape}). UMAP will not be loaded.")
+    elif REDUCTION_MODE != "umap":
+        logger.info(f"Loading '{REDUCTION_MODE}' projection from {PROJECTION_PATH}...")
         try:
-            fitted_umap = joblib.load(UMAP_MODEL_PATH)
-            print("Pre-fitted UMAP model loaded successfully.")
+            with np.load(PROJECTION_PATH) as projection:
+                projection_weights = np.ascontiguousarray(projection[f"{REDUCTION_MODE}_weights"], dtype=np.float32)
+                projection_bias = np.ascontiguousarray(projection[f"{REDUCTION_MODE}_bias"], dtype=np.float32)
+            active_reduction_mode = REDUCTION_MODE
+            cache_version = f"{SBERT_MODEL_NAME}:{ENCODER_BACKEND}:{CHUNKING.describe()}|{REDUCTION_MODE}:{_file_digest(PROJECTION_PATH)}"
+            logger.info(f"Projection loaded successfully (weights {projection_weights.shape}). UMAP will not be loaded.")
         except Exception as e:
-            print(f"WARNING: Error loading pre-fitted UMAP model: {e}. Placeholder will not be effective.")
+            projection_weights, projection_bias = None, None
+            logger.warning(f"Error loading '{REDUCTION_MODE}' projection: {e}. Falling back to UMAP.")
+
+    trained_umap_sha256 = model_bundle.manifest.get("reduction", {}).get("umap_model_sha256") if model_bundle else None
+    if projection_weights is None:
+        logger.info(f"Loading pre-fitted UMAP model from {UMAP_MODEL_PATH}...")
+        if trained_umap_sha256 and (not os.path.exists(UMAP_MODEL_PATH) or sha256_file(UMAP_MODEL_PATH) != trained_umap_sha256):
+            # The bundle's centroids live in the space of the UMAP it was trained with; any other UMAP is silently wrong.
+            load_problems.append(f"{UMAP_MODEL_PATH} is not the UMAP model bundle '{model_bundle.version}' was trained with (sha256 mismatch).")
+            logger.error(f"{load_problems[-1]} Not loading it; use a 'linear'/'pca' reduction mode or the matching bundle.")
+        elif os.path.exists(UMAP_MODEL_PATH):
+            try:
+                fitted_umap = joblib.load(UMAP_MODEL_PATH)
+                logger.info("Pre-fitted UMAP model loaded successfully.")
+                # Cached embeddings are only valid for this exact SBERT model + UMAP file.
+                cache_version = f"{SBERT_MODEL_NAME}:{ENCODER_BACKEND}:{CHUNKING.describe()}|umap:{_file_digest(UMAP_MODEL_PATH)}"
+            except Exception as e:
+                logger.warning(f"Error loading pre-fitted UMAP model: {e}. Placeholder will not be effective.")
+        else:
+            logger.warning(f"UMAP model not found at {UMAP_MODEL_PATH}. Live UMAP transformation will be attempted (not ideal for production). Consider training and saving a UMAP model.")
+            # Fallback to initializing a new UMAP for `fit_transform` per call if no model found
+            # This is NOT the recommended production approach for Option B but allows code to run.
+            try:
+                fitted_umap = UMAP(n_components=50, n_neighbors=15, min_dist=0.1, random_state=42, n_jobs=1)
+                logger.info("Initialized a new UMAP transformer as a fallback.")
+            except Exception as e:
+                logger.critical(f"Error initializing fallback UMAP: {e}")
+
+    kmeans_centroids = None
+    if model_bundle is not None and model_bundle.has("kmeans_centroids"):
+        kmeans_centroids = model_bundle.array("kmeans_centroids")
+        logger.info(f"K-Means centroids memory-mapped from bundle ({kmeans_centroids.shape[0]} clusters); {KMEANS_MODEL_PATH} not loaded.")
     else:
-        print(f"WARNING: UMAP model not found at {UMAP_MODEL_PATH}. Live UMAP transformation will be attempted (not ideal for production). Consider training and saving a UMAP model.")
-        # Fallback to initializing a new UMAP for `fit_transform` per call if no model found
-        # This is NOT the recommended production approach for Option B but allows code to run.
+        fitted_kmeans = _load_pickled_kmeans()
+        if fitted_kmeans is not None and hasattr(fitted_kmeans, 'cluster_centers_'):
+            kmeans_centroids = fitted_kmeans.cluster_centers_
+
+    if model_bundle is not None and model_bundle.has("cluster_profiles"):
         try:
-            fitted_umap = UMAP(n_components=50, n_neighbors=15, min_dist=0.1, random_state=42, n_jobs=1)
-            print("Initialized a new UMAP transformer as a fallback.")
+            cluster_profiles = model_bundle.json_file("cluster_profiles")
+            logger.info(f"Cluster profiles loaded from bundle ({len(cluster_profiles)} profiles).")
         except Exception as e:
-            print(f"CRITICAL: Error initializing fallback UMAP: {e}")
+            logger.warning(f"Error loading cluster profiles from bundle: {e}")
+            cluster_profiles = _load_cluster_profiles_file()
+    else:
+        cluster_profiles = _load_cluster_profiles_file()
+
+    cluster_assigner = None
+    if kmeans_centroids is not None:
+        cluster_assigner = ClusterAssigner.from_centroids(kmeans_centroids, cluster_profiles)
+        logger.info(f"Cluster assignment table built ({cluster_assigner.n_clusters} centroids, "
+              f"{int(cluster_assigner.has_characteristic_distance.sum())} with characteristic_distance).")
+
+    similar_ads_index, similar_ads_space = _load_similar_ads_index(model_bundle)
+
+    return SegmentationModels(
+        version=model_bundle.version if model_bundle else LEGACY_MODEL_VERSION,
+        reduction_mode=active_reduction_mode,
+        fitted_umap=fitted_umap,
+        projection_weights=projection_weights,
+        projection_bias=projection_bias,
+        fitted_kmeans=fitted_kmeans,
+        cluster_profiles=cluster_profiles,
+        cluster_assigner=cluster_assigner,
+        bundle=model_bundle,
+        cache_version=cache_version,
+        similar_ads_index=similar_ads_index,
+        similar_ads_space=similar_ads_space,
+        load_problems=tuple(load_problems),
+    )
 
-    print(f"Loading pre-fitted K-Means model from {KMEANS_MODEL_PATH}...")
+def _load_similar_ads_index(model_bundle: Optional[ModelBundle]) -> Tuple[Optional[VectorIndex], Optional[str]]:
+    """Memory-maps the bundle's similar-ads index, if it has one. Returns (index, space)."""
+    if model_bundle is None or not model_bundle.has("similar_ads_vectors"):
+        return None, None
+    try:
+        description = model_bundle.manifest["similar_ads"]
+        arrays = {name: model_bundle.array(f"similar_ads_{name}") for name in ("vectors", "list_centroids", "list_offsets")
+                  if model_bundle.has(f"similar_ads_{name}")}
+        index = VectorIndex.from_arrays(arrays, model_bundle.json_file("similar_ads_ids"), description["metric"])
+        logger.info(f"Similar-ads index memory-mapped from bundle ({index.kind}, {index.size} ads, {description['space']} space).")
+        return index, description["space"]
+    except Exception as e:
+        logger.warning(f"Error loading the similar-ads index from bundle: {e}. top_k_similar_ads will be ignored.")
+        return None, None
+
+def _load_model_bundle(bundle_version: str, verify_checksums: bool = VERIFY_BUNDLE_CHECKSUMS) -> Optional[ModelBundle]:
+    """Loads a pickle-free bundle, or returns None to fall back to the legacy pickled models."""
+    if bundle_version == "none":
+        return None
+    logger.info(f"Loading model bundle '{bundle_version}' from {MODEL_BUNDLE_DIR}...")
+    try:
+        bundle = ModelBundle.load(MODEL_BUNDLE_DIR, bundle_version, verify_checksums=verify_checksums)
+    except ModelBundleError as e:
+        logger.warning(f"{e} Falling back to the pickled models.")
+        return None
+    if bundle.encoder_name != SBERT_MODEL_NAME:
+        logger.warning(f"Bundle '{bundle.version}' was trained with encoder '{bundle.encoder_name}', not '{SBERT_MODEL_NAME}'. Ignoring it.")
+        return None
+    logger.info(f"Model bundle '{bundle.version}' loaded.")
+    return bundle
+
+def _load_pickled_kmeans() -> Optional[KMeans]:
+    """Legacy path: unpickles fitted_kmeans.pkl."""
+    fitted_kmeans = None
+    logger.info(f"Loading pre-fitted K-Means model from {KMEANS_MODEL_PATH}...")
     if os.path.exists(KMEANS_MODEL_PATH):
         try:
             fitted_kmeans = joblib.load(KMEANS_MODEL_PATH)
-            print("Pre-fitted K-Means model loaded successfully.")
+            logger.info("Pre-fitted K-Means model loaded successfully.")
         except Exception as e:
-            print(f"WARNING: Error loading pre-fitted K-Means model: {e}. Placeholder will not be effective.")
+            logger.warning(f"Error loading pre-fitted K-Means model: {e}. Placeholder will not be effective.")
     else:
-        print(f"WARNING: K-Means model not found at {KMEANS_MODEL_PATH}. Clustering will not be effective. Consider training and saving a K-Means model.")
+        logger.warning(f"K-Means model not found at {KMEANS_MODEL_PATH}. Clustering will not be effective. Consider training and saving a K-Means model.")
         # We cannot effectively run K-Means predict without a fitted model on a single new instance.
         # For a dummy, one might create a KMeans with 1 cluster, but it won't be meaningful.
+    return fitted_kmeans
 
-    print(f"Loading cluster profiles from {CLUSTER_PROFILES_PATH}...")
+def _load_cluster_profiles_file() -> Dict[str, dict]:
+    """Legacy path: cluster profiles from models/cluster_profiles.json."""
+    logger.info(f"Loading cluster profiles from {CLUSTER_PROFILES_PATH}...")
     if os.path.exists(CLUSTER_PROFILES_PATH):
-        import json
         try:
             with open(CLUSTER_PROFILES_PATH, 'r') as f:
-                cluster_profiles = json.load(f)
-            print("Cluster profiles loaded successfully.")
+                profiles = json.load(f)
+            logger.info("Cluster profiles loaded successfully.")
+            return profiles
         except Exception as e:
-            print(f"WARNING: Error loading cluster profiles: {e}")
-    else:
-        print(f"WARNING: Cluster profiles not found at {CLUSTER_PROFILES_PATH}. Profiles will be empty.")
-        cluster_profiles = {} # Default to empty if not found
+            logger.warning(f"Error loading cluster profiles: {e}")
+            return {}
+    logger.warning(f"Cluster profiles not found at {CLUSTER_PROFILES_PATH}. Profiles will be empty.")
+    return {} # Default to empty if not found
+
+@app.on_event("startup")
+async def load_models():
+    load_models_sync()
+
+@app.on_event("startup")
+async def start_inference_workers():
+    global inference_pool, segment_batcher
+    inference_pool = _create_inference_pool(current_models)
+    logger.info(f"Inference pool started (mode={INFERENCE_EXECUTOR}, max_workers={INFERENCE_MAX_WORKERS}, max_pending={INFERENCE_MAX_PENDING}).")
+    # Startup events finish before the first request is served, so the workers are ready when /health is.
+    problems = await _warm_inference_pool(inference_pool, current_models)
+    if problems:
+        logger.error(f"Inference workers failed the canary at startup: {problems}")
+
+    segment_batcher = MicroBatcher(
+        run_segmentation_batch_offloaded,
+        max_batch_size=MICRO_BATCH_MAX_SIZE,
+        max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+        max_queue_depth=MICRO_BATCH_MAX_QUEUE_DEPTH,
+        max_concurrent_batches=INFERENCE_MAX_WORKERS,
+    )
+    segment_batcher.start()
+    logger.info(f"Micro-batcher started (max_batch_size={MICRO_BATCH_MAX_SIZE}, max_wait_ms={MICRO_BATCH_MAX_WAIT_MS}, max_queue_depth={MICRO_BATCH_MAX_QUEUE_DEPTH}).")
+
+@app.on_event("startup")
+async def start_model_watcher():
+    global model_watch_task
+    if MODEL_WATCH_INTERVAL_S > 0 and MODEL_BUNDLE_VERSION == "latest":
+        model_watch_task = asyncio.create_task(_watch_latest_bundle())
+        logger.info(f"Watching {MODEL_BUNDLE_DIR} for new bundles every {MODEL_WATCH_INTERVAL_S}s.")
+
+@app.on_event("shutdown")
+async def stop_inference_workers():
+    if model_watch_task:
+        model_watch_task.cancel()
+    if segment_batcher:
+        await segment_batcher.stop()
+    if inference_pool:
+        inference_pool.shutdown()
 
 # --- Pydantic Models --- #
 class JobAdInput(BaseModel):
     job_ad_text: str
+    top_k_clusters: Optional[int] = Field(default=None, ge=1) # Nearest clusters to return in top_clusters (default DEFAULT_TOP_K_CLUSTERS)
+    top_k_similar_ads: Optional[int] = Field(default=None, ge=0, le=MAX_SIMILAR_ADS) # Most similar corpus ads to return in similar_ads (default none)
 
 class AudiencePrimitive(BaseModel):
     category: str 
     value: str
     confidence: Optional[float] = None
 
+class ClusterCandidate(BaseModel):
+    cluster_id: str
+    confidence: float
+    distance: float # Euclidean distance to the cluster centroid in the reduced space
+
+class SimilarAd(BaseModel):
+    ad_id: str # Corpus id of the past job ad
+    distance: float # 1 - cosine similarity ("sbert" index) or euclidean distance ("reduced" index)
+
 class SegmentationOutput(BaseModel):
     job_ad_input: JobAdInput
     derived_audience_primitives: List[AudiencePrimitive]
     assigned_cluster_id: Optional[str] = None # Changed from cluster_id to assigned_cluster_id
     cluster_assignment_confidence: Optional[float] = None # e.g., 1 - normalized_distance_to_centroid
     # silhouette_score is for overall clustering quality (offline), not per-instance assignment
+    cluster_assignment_margin: Optional[float] = None # (d_second - d_best) / d_second; near 0 means the ad sits between two clusters
+    top_clusters: Optional[List[ClusterCandidate]] = None # Nearest clusters first, lets callers blend profiles
+    similar_ads: Optional[List[SimilarAd]] = None # Nearest past ads first, when top_k_similar_ads was requested and the bundle has an index
+    model_version: Optional[str] = None # Bundle version that produced this result (changes after a hot reload)
+    near_duplicate_similarity: Optional[float] = None # Set when this result was reused from a near-duplicate ad (estimated Jaccard similarity)
+    error: Optional[str] = None # Set per item when this ad could not be segmented (batch requests)
 
-# --- API Endpoints --- #
-@app.post("/segment", response_model=SegmentationOutput)
-async def segment_audience(job_ad_data: JobAdInput):
-    if not sbert_model:
-        raise HTTPException(status_code=503, detail="Sentence-BERT model not available.")
-    # Not strictly necessary to check umap/kmeans here if we have fallbacks or error handling below
+class BatchSegmentationInput(BaseModel):
+    job_ads: List[JobAdInput]
+
+class BatchSegmentationOutput(BaseModel):
+    results: List[SegmentationOutput] # Same order as the input job_ads
 
-    # Stage 2: Vectorizer (Sentence-BERT)
-    print("Generating SBERT embedding...")
+# --- Batched Segmentation Pipeline --- #
+# Each stage runs once per batch on a single (n_items, dim) matrix instead of once per ad.
+# Per-item failures are recorded in `item_errors` so one bad ad does not fail the whole batch.
+
+def _encode_stage(texts: List[str], item_errors: List[Optional[str]]) -> np.ndarray:
+    """
+    Stage 2: encodes all texts with one SBERT call (the chunks of long ads included, see CHUNKING).
+    Falls back to item-by-item encoding to isolate failures.
+    """
     try:
-        sbert_embedding = sbert_model.encode(job_ad_data.job_ad_text)
-        print(f"SBERT embedding shape: {sbert_embedding.shape}")
+        return encode_long_texts(sbert_model, texts, CHUNKING, batch_size=SBERT_ENCODE_BATCH_SIZE)
     except Exception as e:
-        print(f"Error during SBERT encoding: {e}")
-        raise HTTPException(status_code=500, detail="Failed to generate text embedding.")
+        logger.error(f"Error during batched SBERT encoding: {e}. Retrying item by item to isolate failing ads.")
 
-    # Stage 3: Dimensionality Reduction (UMAP)
-    reduced_embedding = None
-    if fitted_umap:
-        print("Applying pre-fitted UMAP...")
+    embedding_dim = sbert_model.get_sentence_embedding_dimension()
+    sbert_embeddings = np.zeros((len(texts), embedding_dim), dtype=np.float32)
+    for i, text in enumerate(texts):
         try:
-            reshaped_sbert_embedding = sbert_embedding.reshape(1, -1)
-            reduced_embedding = fitted_umap.transform(reshaped_sbert_embedding) # Use transform with fitted model
-            print(f"UMAP reduced embedding shape: {reduced_embedding.shape}")
+            sbert_embeddings[i] = encode_long_texts(sbert_model, [text], CHUNKING, batch_size=SBERT_ENCODE_BATCH_SIZE)[0]
         except Exception as e:
-            print(f"Error during UMAP transform: {e}. Check if UMAP was fitted correctly.")
-            # Fallback or error if UMAP transform fails even with a loaded model
-            # For now, we'll allow it to proceed to K-Means with unreduced if this happens & K-Means can handle it or has its own error
-            pass # Or raise HTTPException
-    else:
-        print("WARN: No pre-fitted UMAP model. UMAP stage will be ineffective or skipped.")
-        # If UMAP is critical, raise HTTPException here
-        # If proceeding with original sbert_embedding for K-Means (if K-Means was trained on that):
-        # reduced_embedding = sbert_embedding.reshape(1, -1) # Use SBERT if UMAP fails/missing
-
-    if reduced_embedding is None:
-        # This means UMAP failed and we didn't set a fallback to sbert_embedding for KMeans
-        # Or if UMAP is essential and not loaded, it's an issue.
-        # For now, assume K-Means might expect the UMAP-reduced dimension or handle original if trained that way.
-        # We will default to using SBERT embedding if UMAP failed and K-Means is present.
-        print("UMAP transformation resulted in None, attempting to use SBERT embedding for K-Means.")
-        reduced_embedding_for_kmeans = sbert_embedding.reshape(1, -1)
-    else:
-        reduced_embedding_for_kmeans = reduced_embedding
-
-    # Stage 4: Clustering/Assignment (K-Means)
-    assigned_cluster_label: Optional[str] = None
-    cluster_assignment_confidence: Optional[float] = None
-    actual_distance_to_centroid: Optional[float] = None # For logging/info
+            logger.error(f"Error during SBERT encoding of batch item {i}: {e}")
+            item_errors[i] = "Failed to generate text embedding."
+    return sbert_embeddings
 
-    if fitted_kmeans and reduced_embedding_for_kmeans is not None:
-        print("Assigning to pre-fitted K-Means cluster...")
+def _reduce_stage(models: SegmentationModels, sbert_embeddings: np.ndarray) -> Tuple[np.ndarray, bool]:
+    """Stage 3: applies the reduction (projection or pre-fitted UMAP) to the whole batch. Returns (embeddings, reduced_ok); falls back to SBERT embeddings on failure."""
+    if models.projection_weights is not None:
+        # Fast path: one matrix multiply approximating the UMAP transform.
+        return np.asarray(sbert_embeddings, dtype=np.float32) @ models.projection_weights + models.projection_bias, True
+    if models.fitted_umap:
         try:
-            cluster_prediction = fitted_kmeans.predict(reduced_embedding_for_kmeans)
-            assigned_cluster_label = str(cluster_prediction[0])
-            print(f"Assigned to K-Means cluster: {assigned_cluster_label}")
-
-            if hasattr(fitted_kmeans, 'cluster_centers_'):
-                centroid = fitted_kmeans.cluster_centers_[cluster_prediction[0]]
-                distance = euclidean_distances(reduced_embedding_for_kmeans, centroid.reshape(1, -1))[0,0]
-                actual_distance_to_centroid = float(distance)
-                print(f"Distance to centroid: {actual_distance_to_centroid:.4f}")
-                
-                # Revised Confidence Calculation (using characteristic_distance from profile)
-                if cluster_profiles and assigned_cluster_label in cluster_profiles:
-                    cluster_profile_data = cluster_profiles[assigned_cluster_label]
-                    char_dist = cluster_profile_data.get('characteristic_distance')
-                    if isinstance(char_dist, (int, float)) and char_dist > 0:
-                        # Normalize confidence: 1 if at centroid, 0 if at characteristic_distance, negative if beyond
-                        # Cap at 0 and 1.
-                        confidence_raw = 1.0 - (actual_distance_to_centroid / char_dist)
-                        cluster_assignment_confidence = max(0.0, min(1.0, confidence_raw))
-                        print(f"Characteristic distance for cluster {assigned_cluster_label}: {char_dist:.2f}, Confidence: {cluster_assignment_confidence:.4f}")
-                    else:
-                        print(f"WARN: Characteristic distance not found or invalid for cluster {assigned_cluster_label}. Using fallback confidence.")
-                        # Fallback to simpler confidence if characteristic_distance is missing
-                        cluster_assignment_confidence = 1.0 / (1.0 + actual_distance_to_centroid) 
-                else:
-                    # Fallback if profile or label is somehow missing after assignment
-                    cluster_assignment_confidence = 1.0 / (1.0 + actual_distance_to_centroid)
-                    print(f"WARN: Cluster profile not found for assigned label {assigned_cluster_label}. Using basic confidence.")
-
-                if cluster_assignment_confidence is not None and cluster_assignment_confidence < 0.25: # Example threshold
-                    print(f"Low assignment confidence ({cluster_assignment_confidence:.2f}), may need fallback in calling service.")
-            else:
-                print("K-Means model does not have cluster_centers_. Cannot calculate distance-based confidence.")
+            reduced_embeddings = models.fitted_umap.transform(sbert_embeddings) # Use transform with fitted model
+            logger.debug("UMAP reduced embeddings shape: %s", reduced_embeddings.shape)
+            return reduced_embeddings, True
         except Exception as e:
-            print(f"Error during K-Means prediction or confidence calculation: {e}")
+            logger.error(f"Error during UMAP transform: {e}. Check if UMAP was fitted correctly.")
     else:
-        print("WARN: No pre-fitted K-Means model or input embedding missing. Clustering stage skipped.")
+        logger.warning("No pre-fitted UMAP model. UMAP stage will be ineffective or skipped.")
+    # Same fallback as the single-item path: let K-Means try the SBERT embeddings directly.
+    logger.warning("UMAP transformation resulted in None, attempting to use SBERT embeddings for K-Means.")
+    return sbert_embeddings, False
+
+def _embed_stage(models: SegmentationModels, texts: List[str], item_errors: List[Optional[str]],
+                 batch_stats: Optional[Dict[str, Any]] = None, use_cache: bool = True) -> Tuple[List[int], np.ndarray, np.ndarray]:
+    """
+    Stages 2 & 3 behind the embedding cache: only distinct texts that miss the cache reach SBERT and UMAP.
+    Returns the rows that were embedded successfully with their reduced and SBERT embeddings (one row each, same order).
+    With `use_cache=False` the cache is neither read nor written.
+    """
+    batch_stats = batch_stats if batch_stats is not None else _new_batch_stats()
+    cache_enabled = embedding_cache.enabled and use_cache
+    # Group identical (normalized) texts so each distinct text is looked up and encoded once per batch.
+    rows_by_key: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        key = cache_key(text, models.cache_version) if cache_enabled else str(i)
+        rows_by_key.setdefault(key, []).append(i)
+
+    sbert_rows: List[Optional[np.ndarray]] = [None] * len(texts)
+    reduced_rows: List[Optional[np.ndarray]] = [None] * len(texts)
+    miss_keys: List[str] = []
+    for key, rows in rows_by_key.items():
+        cached = embedding_cache.get(key) if cache_enabled else None
+        if cached is None:
+            miss_keys.append(key)
+            continue
+        for row in rows:
+            sbert_rows[row], reduced_rows[row] = cached
+
+    if cache_enabled:
+        batch_stats["cache_hits"] += len(rows_by_key) - len(miss_keys)
+        batch_stats["cache_misses"] += len(miss_keys)
+
+    reduced_ok = True
+    if miss_keys:
+        logger.debug("Generating SBERT embeddings for %d uncached text(s) out of %d...", len(miss_keys), len(texts))
+        miss_errors: List[Optional[str]] = [None] * len(miss_keys)
+        stage_started = time.perf_counter()
+        miss_sbert = _encode_stage([texts[rows_by_key[key][0]] for key in miss_keys], miss_errors)
+        batch_stats["stage_seconds"]["encode"] = time.perf_counter() - stage_started
+        for key, error in zip(miss_keys, miss_errors):
+            if error is not None:
+                for row in rows_by_key[key]:
+                    item_errors[row] = error
+        encoded = [j for j, error in enumerate(miss_errors) if error is None]
+        if encoded:
+            stage_started = time.perf_counter()
+            miss_reduced, reduced_ok = _reduce_stage(models, miss_sbert[encoded])
+            batch_stats["stage_seconds"]["reduce"] = time.perf_counter() - stage_started
+            batch_stats["reduction_fallbacks"] += not reduced_ok
+            for j, reduced in zip(encoded, miss_reduced):
+                key = miss_keys[j]
+                # Only cache real reduction output; a fallback result must not outlive the failure.
+                if reduced_ok and cache_enabled:
+                    embedding_cache.put(key, miss_sbert[j], reduced)
+                for row in rows_by_key[key]:
+                    sbert_rows[row], reduced_rows[row] = miss_sbert[j], reduced
+
+    ok_rows = [i for i, error in enumerate(item_errors) if error is None]
+    if not ok_rows:
+        return ok_rows, np.zeros((0, 0), dtype=np.float32), np.zeros((0, 0), dtype=np.float32)
+    # If the reduction fell back for the misses, cached rows must use the same (SBERT) space for K-Means.
+    chosen_rows = reduced_rows if reduced_ok else sbert_rows
+    return ok_rows, np.vstack([chosen_rows[i] for i in ok_rows]), np.vstack([sbert_rows[i] for i in ok_rows])
+
+def _assign_stage(models: SegmentationModels, reduced_embeddings: np.ndarray, top_k: int) -> Optional[BatchAssignment]:
+    """Stage 4: nearest centroid, confidences and second-best margins for the whole batch in one NumPy pass."""
+    if models.cluster_assigner is None:
+        logger.warning("No pre-fitted K-Means model (or no cluster_centers_). Clustering stage skipped.")
+        return None
+    try:
+        assignment = models.cluster_assigner.assign(reduced_embeddings, top_k=top_k)
+        assigned_confidences = assignment.confidences[np.arange(len(assignment.labels)), assignment.labels]
+        low_confidence_count = int(np.sum(assigned_confidences < LOW_CONFIDENCE_THRESHOLD))
+        if low_confidence_count:
+            logger.debug("%d/%d assignments have low confidence (< %s), may need fallback in calling service.", low_confidence_count, len(assignment.labels), LOW_CONFIDENCE_THRESHOLD)
+        return assignment
+    except Exception as e:
+        logger.error(f"Error during K-Means assignment or confidence calculation: {e}")
+        return None
 
-    # Stage 5 & 6: Cluster Profiling (using assigned_cluster_label) & Taxonomy Mapping
+def _similar_stage(models: SegmentationModels, query_embeddings: np.ndarray, top_k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Nearest corpus ads for the rows that asked for them, from the bundle's similar-ads index: (rows, distances)."""
+    try:
+        return models.similar_ads_index.search(query_embeddings, top_k, n_probe=SIMILAR_ADS_N_PROBE)
+    except Exception as e:
+        logger.error(f"Error during similar-ads lookup: {e}")
+        return None
+
+def _profile_primitives(cluster_profiles: Dict[str, dict], cluster_label: Optional[str]) -> List[AudiencePrimitive]:
+    """Stages 5 & 6: cluster profiling & taxonomy mapping for one assigned label."""
     derived_primitives: List[AudiencePrimitive] = []
-    if assigned_cluster_label and cluster_profiles and assigned_cluster_label in cluster_profiles:
-        print(f"Using profile for cluster {assigned_cluster_label}: {cluster_profiles[assigned_cluster_label]}")
-        profile = cluster_profiles[assigned_cluster_label]
-        
+    if cluster_label and cluster_profiles and cluster_label in cluster_profiles:
+        profile = cluster_profiles[cluster_label]
+
         if profile.get('industry'):
             derived_primitives.append(AudiencePrimitive(category='industry', value=profile['industry']))
-        
+
         for skill in profile.get('skills', []):
              derived_primitives.append(AudiencePrimitive(category='skill_keyword', value=skill))
-        
+
         if profile.get('seniority'): # Added seniority
             derived_primitives.append(AudiencePrimitive(category='seniority', value=profile['seniority']))
 
         for keyword in profile.get('keywords', []): # Added keywords
             derived_primitives.append(AudiencePrimitive(category='generic_keyword', value=keyword))
-        
+
         # You can add more logic here to extract other fields from your cluster_profiles.json if needed
         # For example, if your profiles had a "target_audience_description_text":
         # if profile.get('target_audience_description_text'):
         #     derived_primitives.append(AudiencePrimitive(category='audience_description', value=profile['target_audience_description_text']))
 
     else:
-        print("No specific cluster profile found or clustering skipped, using default primitives.")
         derived_primitives = [
             AudiencePrimitive(category="industry", value="General", confidence=0.5),
             AudiencePrimitive(category="skill_keyword", value="Communication", confidence=0.5),
         ]
-    
+
     if not derived_primitives:
          derived_primitives = [AudiencePrimitive(category="status", value="Segmentation incomplete")]
+    return derived_primitives
+
+def _new_batch_stats() -> Dict[str, Any]:
+    """Per-batch counters filled in by the pipeline; plain data so process-pool workers can return them."""
+    return {"stage_seconds": {}, "items": 0, "item_errors": 0, "low_confidence": 0, "default_primitives": 0,
+            "reduction_fallbacks": 0, "cache_hits": 0, "cache_misses": 0, "near_duplicates": 0}
+
+def _covers_request(source: JobAdInput, job_ad: JobAdInput, models: SegmentationModels) -> bool:
+    """
+    Whether the result for `source` has at least as many top clusters and similar ads as `job_ad` asks for.
+    Requests are capped at what the models can return (e.g. top_k_clusters=10 with 3 clusters returns 3).
+    """
+    n_clusters = models.cluster_assigner.n_clusters if models.cluster_assigner is not None else DEFAULT_TOP_K_CLUSTERS
+    n_similar_ads = models.similar_ads_index.size if models.similar_ads_index is not None else 0
+    top_k_clusters = lambda ad: min(ad.top_k_clusters or DEFAULT_TOP_K_CLUSTERS, n_clusters)
+    top_k_similar_ads = lambda ad: min(ad.top_k_similar_ads or 0, n_similar_ads)
+    return top_k_clusters(source) >= top_k_clusters(job_ad) and top_k_similar_ads(source) >= top_k_similar_ads(job_ad)
+
+def _reusable_result(result: SegmentationOutput, job_ad: JobAdInput, models: SegmentationModels) -> bool:
+    return result.error is None and result.model_version == models.version and _covers_request(result.job_ad_input, job_ad, models)
+
+def _reuse_result(result: SegmentationOutput, job_ad: JobAdInput, similarity: float) -> SegmentationOutput:
+    top_k = job_ad.top_k_clusters or DEFAULT_TOP_K_CLUSTERS
+    return result.model_copy(update={
+        "job_ad_input": job_ad,
+        "top_clusters": result.top_clusters[:top_k] if result.top_clusters is not None else None,
+        "similar_ads": result.similar_ads[:job_ad.top_k_similar_ads] if job_ad.top_k_similar_ads and result.similar_ads is not None else None,
+        "near_duplicate_similarity": similarity,
+    })
+
+def run_segmentation_batch(job_ads: List[JobAdInput], models: Optional[SegmentationModels] = None,
+                           batch_stats: Optional[Dict[str, Any]] = None) -> List[SegmentationOutput]:
+    """
+    Runs the full segmentation pipeline over a batch of job ads, one matrix per stage.
+    The whole batch uses one SegmentationModels snapshot (current_models unless `models` is given),
+    so a reload happening meanwhile never mixes two model versions within a batch.
+    Near-duplicates of recently segmented ads, or of earlier ads in the batch, reuse that result instead.
+    Stage timings and counts are added to `batch_stats` (see _new_batch_stats) when given.
+    """
+    if not job_ads:
+        return []
+    models = models or current_models
+    batch_stats = batch_stats if batch_stats is not None else _new_batch_stats()
+    if NEAR_DUPLICATE_MAX_ENTRIES <= 0:
+        return _run_model_pipeline(job_ads, models, batch_stats)
+
+    stage_started = time.perf_counter()
+    results: List[Optional[SegmentationOutput]] = [None] * len(job_ads)
+    signatures = [min_hasher.signature(job_ad.job_ad_text) for job_ad in job_ads]
+    batch_index = NearDuplicateIndex(threshold=NEAR_DUPLICATE_THRESHOLD) # Earlier ads of this batch that will run the pipeline
+    followers: Dict[int, Tuple[int, float]] = {} # row -> (row whose result it reuses, similarity)
+    pipeline_rows: List[int] = []
+    for row, (job_ad, signature) in enumerate(zip(job_ads, signatures)):
+        if signature is not None:
+            match = next(((similarity, result) for _, similarity, result in near_duplicate_index.query(signature)
+                          if _reusable_result(result, job_ad, models)), None)
+            if match is not None:
+                results[row] = _reuse_result(match[1], job_ad, match[0])
+                continue
+            leader = next(((leader_row, similarity) for leader_row, similarity, _ in batch_index.query(signature)
+                           if _covers_request(job_ads[leader_row], job_ad, models)), None)
+            if leader is not None:
+                followers[row] = leader
+                continue
+            batch_index.add(row, signature)
+        pipeline_rows.append(row)
+    batch_stats["stage_seconds"]["dedup"] = time.perf_counter() - stage_started
+
+    for row, result in zip(pipeline_rows, _run_model_pipeline([job_ads[row] for row in pipeline_rows], models, batch_stats)):
+        results[row] = result
+        if signatures[row] is not None and result.error is None:
+            near_duplicate_index.add(next(_near_duplicate_keys), signatures[row], result)
+    for row, (leader_row, similarity) in followers.items():
+        leader_result = results[leader_row]
+        results[row] = _reuse_result(leader_result, job_ads[row], similarity) if leader_result.error is None else leader_result.model_copy(update={"job_ad_input": job_ads[row]})
+    n_reused = len(job_ads) - len(pipeline_rows)
+    batch_stats["near_duplicates"] += n_reused
+    batch_stats["items"] += n_reused
+    return results
+
+def _run_model_pipeline(job_ads: List[JobAdInput], models: SegmentationModels, batch_stats: Dict[str, Any],
+                        use_cache: bool = True) -> List[SegmentationOutput]:
+    """Stages 2-6 for every ad of the batch (encode, reduce, assign, similar ads, profile); `use_cache` as in _embed_stage."""
+    if not job_ads:
+        return []
+    item_errors: List[Optional[str]] = [None] * len(job_ads)
+
+    ok_rows, reduced_embeddings, sbert_embeddings = _embed_stage(models, [ad.job_ad_text for ad in job_ads], item_errors, batch_stats, use_cache)
+    top_k_by_item = [ad.top_k_clusters or DEFAULT_TOP_K_CLUSTERS for ad in job_ads]
+    stage_started = time.perf_counter()
+    assignment = _assign_stage(models, reduced_embeddings, max(top_k_by_item)) if ok_rows else None
+    batch_stats["stage_seconds"]["assign"] = time.perf_counter() - stage_started
+    if assignment is not None:
+        assigned_confidences = assignment.confidences[np.arange(len(assignment.labels)), assignment.labels]
+        batch_stats["low_confidence"] += int(np.sum(assigned_confidences < LOW_CONFIDENCE_THRESHOLD))
+    cluster_assigner = models.cluster_assigner
+    assignment_position = {row: position for position, row in enumerate(ok_rows)}
+
+    # Similar past ads, only for the items that requested them.
+    similar_positions = [position for position, row in enumerate(ok_rows) if job_ads[row].top_k_similar_ads]
+    similar_by_position: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+    if similar_positions and models.similar_ads_index is not None:
+        stage_started = time.perf_counter()
+        query_embeddings = sbert_embeddings if models.similar_ads_space == "sbert" else reduced_embeddings
+        similar = _similar_stage(models, query_embeddings[similar_positions], max(job_ads[ok_rows[position]].top_k_similar_ads for position in similar_positions))
+        if similar is not None:
+            similar_by_position = {position: (similar[0][i], similar[1][i]) for i, position in enumerate(similar_positions)}
+        batch_stats["stage_seconds"]["similar"] = time.perf_counter() - stage_started
+
+    # Profiles only depend on the label, so build each label's primitives once per batch.
+    stage_started = time.perf_counter()
+    primitives_by_label: Dict[Optional[str], List[AudiencePrimitive]] = {}
+    results: List[SegmentationOutput] = []
+    for row, (job_ad, top_k, error) in enumerate(zip(job_ads, top_k_by_item, item_errors)):
+        if error is not None:
+            batch_stats["item_errors"] += 1
+            results.append(SegmentationOutput(job_ad_input=job_ad, derived_audience_primitives=[], model_version=models.version, error=error))
+            continue
+        label, confidence, margin, top_clusters = None, None, None, None
+        if assignment is not None:
+            position = assignment_position[row]
+            label_index = int(assignment.labels[position])
+            label = cluster_assigner.cluster_ids[label_index]
+            confidence = float(assignment.confidences[position, label_index])
+            margin = float(assignment.margins[position]) if np.isfinite(assignment.margins[position]) else None
+            top_clusters = [
+                ClusterCandidate(
+                    cluster_id=cluster_assigner.cluster_ids[cluster_index],
+                    confidence=float(assignment.confidences[position, cluster_index]),
+                    distance=float(assignment.distances[position, cluster_index]),
+                )
+                for cluster_index in assignment.top_indices[position, :top_k]
+            ]
+        similar_ads = None
+        if assignment_position[row] in similar_by_position:
+            similar_rows, similar_distances = similar_by_position[assignment_position[row]]
+            similar_ads = [
+                SimilarAd(ad_id=models.similar_ads_index.ad_ids[similar_row], distance=float(distance))
+                for similar_row, distance in zip(similar_rows[:job_ad.top_k_similar_ads], similar_distances[:job_ad.top_k_similar_ads])
+                if similar_row >= 0
+            ]
+        if label not in primitives_by_label:
+            primitives_by_label[label] = _profile_primitives(models.cluster_profiles, label)
+        if label is None or label not in models.cluster_profiles:
+            batch_stats["default_primitives"] += 1 # Generic fallback primitives instead of a cluster profile
+        results.append(SegmentationOutput(
+            job_ad_input=job_ad,
+            derived_audience_primitives=primitives_by_label[label],
+            assigned_cluster_id=label,
+            cluster_assignment_confidence=confidence,
+            cluster_assignment_margin=margin,
+            top_clusters=top_clusters,
+            similar_ads=similar_ads,
+            model_version=models.version
+        ))
+    batch_stats["stage_seconds"]["profile"] = time.perf_counter() - stage_started
+    batch_stats["items"] += len(job_ads)
+    return results
+
+def _run_segmentation_batch_instrumented(job_ads: List[JobAdInput]) -> Tuple[List[SegmentationOutput], Dict[str, Any]]:
+    """
+    Inference pool entry point: returns the results with the batch's stats, which the parent records, so
+    metrics also cover process-mode workers. A PROFILE_SAMPLE_RATE share of batches runs under cProfile.
+    """
+    batch_stats = _new_batch_stats()
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return run_segmentation_batch(job_ads, batch_stats=batch_stats), batch_stats
+    profiler = cProfile.Profile()
+    try:
+        results = profiler.runcall(run_segmentation_batch, job_ads, batch_stats=batch_stats)
+    finally:
+        profile_path = os.path.join(PROFILE_DIR, f"batch-{time.time_ns()}-{os.getpid()}.prof")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(profile_path)
+            logger.info(f"Profiled a batch of {len(job_ads)} job ads: {profile_path}")
+        except OSError as e:
+            logger.warning(f"Could not write profile {profile_path}: {e}")
+    return results, batch_stats
+
+def _record_batch_stats(batch_stats: Dict[str, Any]):
+    for stage, seconds in batch_stats["stage_seconds"].items():
+        STAGE_DURATION.observe(seconds, (stage,))
+    BATCH_SIZE.observe(batch_stats["items"])
+    ITEMS_TOTAL.inc(batch_stats["items"])
+    ITEM_ERRORS_TOTAL.inc(batch_stats["item_errors"])
+    LOW_CONFIDENCE_TOTAL.inc(batch_stats["low_confidence"])
+    DEFAULT_PRIMITIVES_TOTAL.inc(batch_stats["default_primitives"])
+    REDUCTION_FALLBACKS_TOTAL.inc(batch_stats["reduction_fallbacks"])
+    NEAR_DUPLICATES_TOTAL.inc(batch_stats["near_duplicates"])
+    CACHE_LOOKUPS_TOTAL.inc(batch_stats["cache_hits"], ("hit",))
+    CACHE_LOOKUPS_TOTAL.inc(batch_stats["cache_misses"], ("miss",))
+
+async def run_segmentation_batch_offloaded(job_ads: List[JobAdInput]) -> List[SegmentationOutput]:
+    """Runs run_segmentation_batch in the inference pool so the event loop stays free for other requests."""
+    try:
+        results, batch_stats = await inference_pool.run(_run_segmentation_batch_instrumented, job_ads)
+    except InferencePoolSaturatedError:
+        POOL_REJECTED_TOTAL.inc()
+        raise
+    _record_batch_stats(batch_stats)
+    return results
+
+def _raise_overloaded(e: Exception):
+    # Backpressure: tell the caller to retry shortly instead of queueing without bound.
+    raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
-    return SegmentationOutput(
-        job_ad_input=job_ad_data,
-        derived_audience_primitives=derived_primitives,
-        assigned_cluster_id=assigned_cluster_label,
-        cluster_assignment_confidence=cluster_assignment_confidence
+# --- Hot Reload --- #
+# A reload loads and validates the new bundle next to the running one, then swaps `current_models`.
+# Batches already running finish on the old snapshot; new batches pick up the new one. The encoder
+# (and therefore the embedding cache contents) is shared, only cache keys change with the version.
+
+def _create_inference_pool(models: Optional[SegmentationModels]) -> InferencePool:
+    # In "process" mode every worker process loads its own copy of the models via load_models_sync,
+    # pinned to the concrete version so a LATEST change cannot give two workers different models.
+    bundle_version = models.bundle.version if models and models.bundle else ("none" if models else MODEL_BUNDLE_VERSION)
+    pool = InferencePool(
+        mode=INFERENCE_EXECUTOR,
+        max_workers=INFERENCE_MAX_WORKERS,
+        max_pending=INFERENCE_MAX_PENDING,
+        initializer=functools.partial(load_models_sync, bundle_version),
     )
+    pool.start()
+    return pool
+
+def _check_worker_models(expected_version: str) -> List[str]:
+    """Runs in an inference worker: the canary on the models that worker will serve with."""
+    if current_models is None:
+        return ["No models loaded in the worker."]
+    if current_models.version != expected_version:
+        return [f"Worker loaded {current_models.version} instead of {expected_version}."]
+    return validate_segmentation_models(current_models)
+
+async def _warm_inference_pool(pool: InferencePool, models: Optional[SegmentationModels]) -> List[str]:
+    """
+    "process" mode: starts every worker of `pool` (each loads the encoder and models) and runs the canary in
+    each of them, so a new pool never serves its first requests cold. Returns the problems found.
+    Thread workers share the parent's models, which the caller validates itself.
+    """
+    if pool.mode != "process" or models is None:
+        return []
+    started = time.perf_counter()
+    try:
+        results = await pool.warm_up(_check_worker_models, models.version)
+    except Exception as e: # e.g. BrokenProcessPool when a worker's initializer fails
+        return [f"Inference workers failed to start: {type(e).__name__}: {e}"]
+    problems = [f"Worker {pid}: {problem}" for pid, worker_problems in results.items() for problem in worker_problems]
+    if len(results) < pool.max_workers:
+        logger.warning(f"Only {len(results)} of {pool.max_workers} inference workers reached during warm-up.")
+    logger.info(f"{len(results)} inference worker(s) warmed up on {models.version} in {time.perf_counter() - started:.1f}s.")
+    return problems
+
+def _canary_job_ads() -> List[JobAdInput]:
+    """Job ads a candidate model must segment before it goes live; taken from the training corpus when available."""
+    texts: List[str] = []
+    try:
+        with open(RELOAD_CANARY_CORPUS_PATH, 'r') as f:
+            texts = [ad['text'] for ad in json.load(f) if ad.get('text')][:RELOAD_CANARY_SIZE]
+    except Exception as e:
+        logger.warning(f"Could not read reload canary ads from {RELOAD_CANARY_CORPUS_PATH}: {e}. Using built-in examples.")
+    return [JobAdInput(job_ad_text=text) for text in texts or [
+        "Senior backend engineer with Python, PostgreSQL and AWS experience.",
+        "Registered nurse for a busy hospital emergency department, night shifts.",
+        "Sales manager to grow B2B accounts across the region.",
+    ]]
+
+def validate_segmentation_models(models: SegmentationModels) -> List[str]:
+    """Runs the canary ads through `models`; returns the problems found (empty list = safe to swap in)."""
+    if models.load_problems:
+        return list(models.load_problems)
+    problems: List[str] = []
+    if models.cluster_assigner is None:
+        return ["No K-Means centroids loaded."]
+    if models.projection_weights is not None and models.projection_weights.shape[1] != models.cluster_assigner.dimension:
+        return [f"Projection output dimension {models.projection_weights.shape[1]} does not match centroid dimension {models.cluster_assigner.dimension}."]
+    try:
+        # Straight through the models: no near-duplicate reuse or cached embeddings (which could hide a broken
+        # bundle), and canary results must not end up in the shared index or cache either.
+        results = _run_model_pipeline(_canary_job_ads(), models, _new_batch_stats(), use_cache=False)
+    except Exception as e:
+        return [f"Canary segmentation raised {type(e).__name__}: {e}"]
+    for i, result in enumerate(results):
+        if result.error:
+            problems.append(f"Canary ad {i}: {result.error}")
+        elif result.assigned_cluster_id is None:
+            problems.append(f"Canary ad {i}: no cluster assigned.")
+        elif result.cluster_assignment_confidence is None or not math.isfinite(result.cluster_assignment_confidence):
+            problems.append(f"Canary ad {i}: non-finite confidence {result.cluster_assignment_confidence}.")
+        elif result.assigned_cluster_id not in models.cluster_profiles:
+            # Not fatal: the ad still gets the generic fallback primitives.
+            logger.warning(f"Canary ad {i} assigned to cluster {result.assigned_cluster_id}, which has no profile in {models.version}.")
+    return problems
+
+async def reload_models(bundle_version: str = MODEL_BUNDLE_VERSION) -> dict:
+    """Loads, validates and swaps in a bundle version. Raises HTTPException (409/422/500) and keeps the current models on failure."""
+    global current_models, inference_pool, last_reload
+    if reload_lock.locked():
+        raise HTTPException(status_code=409, detail="A model reload is already in progress.")
+    async with reload_lock:
+        started = time.perf_counter()
+        previous_version = current_models.version if current_models else None
+        outcome = {"requested_version": bundle_version, "previous_version": previous_version, "at": time.time()}
+        try:
+            # Disk I/O, checksum verification and the canary run stay off the event loop.
+            candidate = await asyncio.to_thread(load_segmentation_models, bundle_version)
+            problems = await asyncio.to_thread(validate_segmentation_models, candidate)
+        except Exception as e:
+            last_reload = {**outcome, "status": "failed", "problems": [f"{type(e).__name__}: {e}"]}
+            raise HTTPException(status_code=500, detail=f"Model reload failed: {e}")
+        if bundle_version != "none" and candidate.bundle is None:
+            problems = [f"Bundle '{bundle_version}' could not be loaded (see logs)."] + problems
+        if problems:
+            last_reload = {**outcome, "status": "rejected", "candidate_version": candidate.version, "problems": problems}
+            logger.warning(f"Model reload to {candidate.version} rejected: {problems}")
+            raise HTTPException(status_code=422, detail={"message": "Candidate models failed validation; keeping the current models.", "problems": problems})
+
+        new_pool = None
+        if INFERENCE_EXECUTOR == "process":
+            # Worker processes hold their own copies: start a pool on the new version and warm every worker
+            # (model load + canary in the process that will serve) while the old pool keeps serving.
+            new_pool = _create_inference_pool(candidate)
+            problems = await _warm_inference_pool(new_pool, candidate)
+            if problems:
+                new_pool.shutdown()
+                last_reload = {**outcome, "status": "rejected", "candidate_version": candidate.version, "problems": problems}
+                logger.warning(f"Model reload to {candidate.version} rejected by the inference workers: {problems}")
+                raise HTTPException(status_code=422, detail={"message": "Candidate models failed validation in the inference workers; keeping the current models.", "problems": problems})
+
+        current_models = candidate
+        if new_pool is not None:
+            # Swap in the warmed pool and let the old one drain.
+            old_pool, inference_pool = inference_pool, new_pool
+            if old_pool:
+                asyncio.create_task(old_pool.drain())
+        last_reload = {**outcome, "status": "ok", "version": candidate.version,
+                       "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+        logger.info(f"Models reloaded: {previous_version} -> {candidate.version} in {last_reload['duration_ms']} ms.")
+        return last_reload
+
+async def _watch_latest_bundle():
+    """Polls the LATEST pointer and hot-reloads when train_models.py publishes a new bundle."""
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL_S)
+        try:
+            latest = resolve_bundle_version(MODEL_BUNDLE_DIR, "latest")
+        except ModelBundleError:
+            continue
+        if current_models is None or latest == current_models.version:
+            continue
+        if last_reload and last_reload.get("status") != "ok" and last_reload.get("requested_version") == latest:
+            continue # Already rejected; wait for the next bundle instead of retrying every interval
+        logger.info(f"New model bundle {latest} detected, reloading...")
+        try:
+            await reload_models(latest)
+        except HTTPException as e:
+            logger.warning(f"Automatic reload to {latest} failed: {e.detail}")
+
+# --- API Endpoints --- #
+@contextlib.contextmanager
+def _track_request(endpoint: str):
+    """In-flight gauge and duration histogram for one request. Done per endpoint rather than as HTTP
+    middleware, which would buffer /segment/stream (see _DuplexStreamingResponse)."""
+    REQUESTS_IN_FLIGHT.inc(labels=(endpoint,))
+    started = time.perf_counter()
+    status = "200"
+    try:
+        yield
+    except HTTPException as e:
+        status = str(e.status_code)
+        raise
+    except BaseException:
+        status = "500"
+        raise
+    finally:
+        REQUESTS_IN_FLIGHT.dec(labels=(endpoint,))
+        REQUEST_DURATION.observe(time.perf_counter() - started, (endpoint, status))
+
+@app.post("/segment", response_model=SegmentationOutput)
+async def segment_audience(job_ad_data: JobAdInput):
+    with _track_request("/segment"):
+        if not sbert_model:
+            raise HTTPException(status_code=503, detail="Sentence-BERT model not available.")
+
+        # Concurrent single-item calls are coalesced into one batched pipeline run.
+        try:
+            result = await segment_batcher.submit(job_ad_data)
+        except (MicroBatcherFullError, InferencePoolSaturatedError) as e:
+            _raise_overloaded(e)
+        if result.error:
+            raise HTTPException(status_code=500, detail=result.error)
+        return result
+
+@app.post("/segment/batch", response_model=BatchSegmentationOutput)
+async def segment_audience_batch(batch_data: BatchSegmentationInput):
+    with _track_request("/segment/batch"):
+        if not sbert_model:
+            raise HTTPException(status_code=503, detail="Sentence-BERT model not available.")
+        if len(batch_data.job_ads) > MAX_SEGMENT_BATCH_SIZE:
+            raise HTTPException(status_code=413, detail=f"Batch too large: {len(batch_data.job_ads)} job ads (max {MAX_SEGMENT_BATCH_SIZE}).")
+
+        try:
+            results = await run_segmentation_batch_offloaded(batch_data.job_ads)
+        except InferencePoolSaturatedError as e:
+            _raise_overloaded(e)
+        return BatchSegmentationOutput(results=results)
+
+def _parse_ndjson_line(line: bytes, line_number: int) -> Tuple[JobAdInput, Optional[str]]:
+    """Parses one NDJSON job ad; returns an empty placeholder and an error message for invalid lines."""
+    try:
+        return JobAdInput.model_validate_json(line), None
+    except ValueError as e:
+        return JobAdInput(job_ad_text=""), f"Invalid job ad on line {line_number}: {e}"
+
+async def _read_ndjson_chunks(request: Request, chunk_size: int):
+    """Yields lists of (job_ad, parse_error) from an NDJSON request body without buffering the whole body."""
+    chunk: List[Tuple[JobAdInput, Optional[str]]] = []
+    buffer = b""
+    line_number = 0
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                chunk.append(_parse_ndjson_line(line, line_number))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if buffer.strip():
+        chunk.append(_parse_ndjson_line(buffer, line_number + 1))
+    if chunk:
+        yield chunk
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body generator reads the request body while responding. The stock class
+    listens for a client disconnect concurrently, which consumes (and so steals) the request body messages;
+    here a disconnect surfaces as ClientDisconnect from request.stream() inside the generator instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+async def _segment_stream_chunk(job_ads: List[JobAdInput]) -> List[SegmentationOutput]:
+    # A bulk stream is not latency sensitive: wait for capacity rather than aborting a half-written response.
+    while True:
+        try:
+            return await run_segmentation_batch_offloaded(job_ads)
+        except InferencePoolSaturatedError:
+            await asyncio.sleep(STREAM_SATURATED_RETRY_S)
+
+@app.post("/segment/stream")
+async def segment_audience_stream(request: Request):
+    """
+    Bulk segmentation for backfills. The body is NDJSON, one JobAdInput per line; the response is NDJSON,
+    one SegmentationOutput per non-empty input line in the same order, flushed as each chunk of
+    STREAM_CHUNK_SIZE ads completes. Invalid lines produce an output line with `error` set.
+    """
+    if not sbert_model:
+        raise HTTPException(status_code=503, detail="Sentence-BERT model not available.")
+
+    async def generate_results():
+        with _track_request("/segment/stream"): # Covers the whole streamed response, not just the handler
+            async for chunk in _read_ndjson_chunks(request, STREAM_CHUNK_SIZE):
+                valid_ads = [job_ad for job_ad, parse_error in chunk if parse_error is None]
+                valid_results = iter(await _segment_stream_chunk(valid_ads) if valid_ads else [])
+                lines = []
+                for job_ad, parse_error in chunk:
+                    result = SegmentationOutput(job_ad_input=job_ad, derived_audience_primitives=[], error=parse_error) if parse_error else next(valid_results)
+                    lines.append(result.model_dump_json())
+                yield "\n".join(lines) + "\n"
+
+    return _DuplexStreamingResponse(generate_results(), media_type="application/x-ndjson")
+
+class ReloadRequest(BaseModel):
+    version: Optional[str] = None # Bundle version to load; defaults to SEGMENTATION_MODEL_BUNDLE (usually "latest")
+
+@app.post("/admin/reload")
+async def admin_reload(reload_request: Optional[ReloadRequest] = None, x_admin_token: Optional[str] = Header(default=None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model reload is disabled (SEGMENTATION_ADMIN_TOKEN not set).")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+    version = (reload_request.version if reload_request else None) or MODEL_BUNDLE_VERSION
+    if version != "none":
+        try:
+            resolve_bundle_version(MODEL_BUNDLE_DIR, version)
+        except ModelBundleError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    return await reload_models(version)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the service metrics (see the Metrics section and metrics.py)."""
+    return Response(METRICS.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 @app.get("/health")
 async def health_check():
     model_status = []
     loaded_models_count = 0
     if sbert_model is not None:
-        model_status.append("SBERT:OK")
+        model_status.append(f"SBERT:OK ({ENCODER_BACKEND})")
         loaded_models_count +=1
     else:
         model_status.append("SBERT:FAIL")
     
-    if fitted_umap is not None:
+    models = current_models
+    if models and models.projection_weights is not None:
+        model_status.append(f"Projection:OK ({models.reduction_mode})")
+        loaded_models_count +=1
+    elif models and models.fitted_umap is not None:
         # Check if it's a fitted UMAP or the fallback un-fitted one
-        if hasattr(fitted_umap, 'embedding_'): # A property of fitted UMAP
+        if hasattr(models.fitted_umap, 'embedding_'): # A property of fitted UMAP
             model_status.append("UMAP:OK (Fitted)")
             loaded_models_count +=1
-        elif isinstance(fitted_umap, UMAP): # Fallback un-fitted UMAP
+        elif isinstance(models.fitted_umap, UMAP): # Fallback un-fitted UMAP
             model_status.append("UMAP:OK (Unfitted Fallback)")
             loaded_models_count +=1 # Still counts as loaded for basic operation
         else:
@@ -256,8 +1132,11 @@ async def health_check():
     else:
         model_status.append("UMAP:FAIL")
 
-    if fitted_kmeans is not None:
-        if hasattr(fitted_kmeans, 'cluster_centers_'):
+    if models and models.bundle is not None and models.cluster_assigner is not None:
+        model_status.append(f"KMeans:OK (Bundle, {models.cluster_assigner.n_clusters} centroids)")
+        loaded_models_count +=1
+    elif models and models.fitted_kmeans is not None:
+        if hasattr(models.fitted_kmeans, 'cluster_centers_'):
             model_status.append("KMeans:OK (Fitted)")
             loaded_models_count +=1
         else:
@@ -265,20 +1144,55 @@ async def health_check():
     else:
         model_status.append("KMeans:FAIL")
         
-    if cluster_profiles is not None:
-        model_status.append(f"Profiles:OK ({len(cluster_profiles)} loaded)")
+    if models and models.cluster_profiles is not None:
+        model_status.append(f"Profiles:OK ({len(models.cluster_profiles)} loaded)")
     else:
         model_status.append("Profiles:FAIL")
 
     # App is healthy if SBERT is loaded. UMAP/KMeans/Profiles are for segmentation quality.
     is_healthy = sbert_model is not None 
+    micro_batcher_stats = {
+        "queue_depth": segment_batcher.queue_depth if segment_batcher else 0,
+        "max_batch_size": MICRO_BATCH_MAX_SIZE,
+        "max_wait_ms": MICRO_BATCH_MAX_WAIT_MS,
+        "max_queue_depth": MICRO_BATCH_MAX_QUEUE_DEPTH,
+        "batches_processed": segment_batcher.batches_processed if segment_batcher else 0,
+        "items_processed": segment_batcher.items_processed if segment_batcher else 0,
+    }
+    inference_pool_stats = {
+        "mode": INFERENCE_EXECUTOR,
+        "max_workers": INFERENCE_MAX_WORKERS,
+        "max_pending": INFERENCE_MAX_PENDING,
+        "in_flight": inference_pool.in_flight if inference_pool else 0,
+        "pending": inference_pool.pending if inference_pool else 0,
+        "saturated": inference_pool.saturated if inference_pool else False,
+        "rejected": inference_pool.rejected if inference_pool else 0,
+    }
     return {
         "status": "healthy" if is_healthy else "degraded", 
+        "model_version": models.version if models else None,
+        "model_bundle": {
+            "created_at": models.bundle.manifest.get("created_at"),
+            "encoder": models.bundle.encoder_name,
+            "reduction_modes": models.bundle.manifest.get("reduction", {}).get("modes", []),
+            "n_clusters": models.bundle.manifest.get("kmeans", {}).get("n_clusters"),
+            "similar_ads_index": models.bundle.manifest.get("similar_ads") if models.similar_ads_index is not None else None,
+        } if models and models.bundle else None,
+        "models_loaded_at": models.loaded_at if models else None,
+        "last_reload": last_reload,
+        "model_problems": list(models.load_problems) if models else [],
         "sbert_model": "Loaded" if sbert_model else "Not Loaded",
-        "umap_model": "Loaded/Initialized" if fitted_umap else "Not Loaded",
-        "kmeans_model": "Loaded/Initialized" if fitted_kmeans else "Not Loaded",
-        "cluster_profiles": f"{len(cluster_profiles) if cluster_profiles else 0} Loaded",
-        "details": "; ".join(model_status)
+        "encoder_backend": ENCODER_BACKEND,
+        "long_text": CHUNKING.describe(),
+        "reduction_mode": models.reduction_mode if models else None,
+        "umap_model": "Loaded/Initialized" if models and models.fitted_umap else "Not Loaded",
+        "kmeans_model": "Loaded/Initialized" if models and models.cluster_assigner else "Not Loaded",
+        "cluster_profiles": f"{len(models.cluster_profiles) if models and models.cluster_profiles else 0} Loaded",
+        "details": "; ".join(model_status),
+        "micro_batcher": micro_batcher_stats,
+        "embedding_cache": embedding_cache.stats(),
+        "near_duplicate_index": near_duplicate_index.stats(),
+        "inference_pool": inference_pool_stats
     }
 
 # Note on pre-trained models:
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+class MicroBatcherFullError(Exception):
+    """Raised by MicroBatcher.submit when the request queue is at max depth."""
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching scheduler.
+    Concurrent callers submit single items; a background task collects them for up to
+    `max_wait_ms` (or until `max_batch_size` items are queued), runs `process_batch` once
+    on the whole batch and resolves each caller's future with its own result.
+    `process_batch` is a coroutine function that takes a list of items and must return a list of
+    results in the same order. Up to `max_concurrent_batches` batches run at once; while all are
+    busy new items keep queueing (and are rejected once the queue is at max depth).
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, max_queue_depth: int = 1000, max_concurrent_batches: int = 1):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue_depth = max_queue_depth
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._batch_slots: Optional[asyncio.Semaphore] = None
+        self._batch_tasks: set = set()
+        # Running stats, reported by /health
+        self.batches_processed = 0
+        self.items_processed = 0
+        self.last_batch_size = 0
+
+    def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+            self._batch_slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for task in list(self._batch_tasks):
+            task.cancel()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item: Any) -> Any:
+        if self._queue is None:
+            raise RuntimeError("MicroBatcher.submit called before start().")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise MicroBatcherFullError(f"Micro-batch queue is full ({self.max_queue_depth} pending items).")
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Still drain whatever is already queued without waiting any longer.
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]):
+        items = [item for item, _ in batch]
+        try:
+            results = await self.process_batch(items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._batch_slots.release()
+        self.batches_processed += 1
+        self.items_processed += len(items)
+        self.last_batch_size = len(items)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self):
+        while True:
+            # Wait for a free batch slot first so items keep accumulating while all slots are busy.
+            await self._batch_slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                self._batch_slots.release()
+                raise
+            # Skip callers that gave up (e.g. client disconnected) before the batch ran.
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                self._batch_slots.release()
+                continue
+            task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
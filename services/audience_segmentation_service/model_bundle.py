@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+import numpy as np
+
+# Versioned, pickle-free model artifacts written by train_models.py and read by main.py.
+#
+#   models/bundles/
+#     LATEST                      <- name of the current version (written last, atomically)
+#     <version>/
+#       manifest.json             <- format, model version, encoder name, file checksums
+#       kmeans_centroids.npy      <- raw arrays, memory-mapped by the service so workers share pages
+#       linear_weights.npy ...
+#       cluster_profiles.json
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILENAME = "manifest.json"
+LATEST_POINTER_FILENAME = "LATEST"
+
+class ModelBundleError(Exception):
+    """Raised when a bundle is missing, incomplete or fails checksum verification."""
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+def _atomic_write_text(path: str, text: str):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    # mkstemp creates 0600 files; the service may run as another user than the trainer.
+    os.chmod(tmp_path, 0o666 & ~_umask())
+    os.replace(tmp_path, path)
+
+def _check_version_name(bundle_root: str, version: str) -> str:
+    """`version` must name an existing version directory directly inside `bundle_root` (it may come from a request)."""
+    separators = [sep for sep in (os.sep, os.altsep, "/") if sep]
+    if not version or version.startswith(".") or ".." in version or any(sep in version for sep in separators):
+        raise ModelBundleError(f"Invalid bundle version {version!r}.")
+    if not os.path.isdir(os.path.join(bundle_root, version)):
+        raise ModelBundleError(f"Bundle version '{version}' not found in {bundle_root}.")
+    return version
+
+def resolve_bundle_version(bundle_root: str, version: str = "latest") -> str:
+    """
+    Returns the concrete version name for `version` ("latest" follows the LATEST pointer). Raises ModelBundleError
+    unless it is an existing version directory directly inside `bundle_root` (no paths, no "..").
+    """
+    if version != "latest":
+        return _check_version_name(bundle_root, version)
+    pointer_path = os.path.join(bundle_root, LATEST_POINTER_FILENAME)
+    try:
+        with open(pointer_path, 'r') as f:
+            return _check_version_name(bundle_root, f.read().strip())
+    except OSError:
+        raise ModelBundleError(f"No {LATEST_POINTER_FILENAME} pointer found in {bundle_root}.")
+
+class ModelBundle:
+    """A loaded bundle: its manifest plus lazily memory-mapped arrays."""
+
+    def __init__(self, path: str, manifest: Dict[str, Any]):
+        self.path = path
+        self.manifest = manifest
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    @property
+    def version(self) -> str:
+        return self.manifest["model_version"]
+
+    @property
+    def encoder_name(self) -> str:
+        return self.manifest["encoder"]["name"]
+
+    @classmethod
+    def load(cls, bundle_root: str, version: str = "latest", verify_checksums: bool = False) -> "ModelBundle":
+        version = resolve_bundle_version(bundle_root, version)
+        path = os.path.join(bundle_root, version)
+        try:
+            with open(os.path.join(path, MANIFEST_FILENAME), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ModelBundleError(f"Could not read manifest of bundle '{version}': {e}")
+        if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+            raise ModelBundleError(f"Bundle '{version}' has unsupported format_version {manifest.get('format_version')}.")
+        bundle = cls(path, manifest)
+        for name, entry in manifest.get("files", {}).items():
+            file_path = os.path.join(path, entry["file"])
+            if not os.path.exists(file_path):
+                raise ModelBundleError(f"Bundle '{version}' is missing {entry['file']}.")
+            if verify_checksums and sha256_file(file_path) != entry["sha256"]:
+                raise ModelBundleError(f"Checksum mismatch for {entry['file']} in bundle '{version}'.")
+        return bundle
+
+    def has(self, name: str) -> bool:
+        return name in self.manifest.get("files", {})
+
+    def array(self, name: str) -> np.ndarray:
+        """Memory-mapped, read-only view of a .npy array; pages are shared by every process mapping it."""
+        if name not in self._arrays:
+            entry = self.manifest["files"][name]
+            self._arrays[name] = np.load(os.path.join(self.path, entry["file"]), mmap_mode='r')
+        return self._arrays[name]
+
+    def json_file(self, name: str) -> Any:
+        entry = self.manifest["files"][name]
+        with open(os.path.join(self.path, entry["file"]), 'r') as f:
+            return json.load(f)
+
+def write_bundle(bundle_root: str, arrays: Dict[str, np.ndarray], json_files: Dict[str, Any],
+                 metadata: Dict[str, Any], set_latest: bool = True) -> str:
+    """
+    Writes a new bundle version and (by default) points LATEST at it. `arrays` are saved as .npy
+    files, `json_files` as .json; `metadata` (encoder, reduction, kmeans, ...) is merged into the
+    manifest. Returns the new version name.
+    """
+    os.makedirs(bundle_root, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=bundle_root, prefix=".staging-")
+    files: Dict[str, Dict[str, Any]] = {}
+    for name, array in arrays.items():
+        filename = f"{name}.npy"
+        array = np.ascontiguousarray(array)
+        np.save(os.path.join(staging_dir, filename), array)
+        files[name] = {"file": filename, "shape": list(array.shape), "dtype": str(array.dtype)}
+    for name, content in json_files.items():
+        filename = f"{name}.json"
+        with open(os.path.join(staging_dir, filename), 'w') as f:
+            json.dump(content, f, indent=2)
+        files[name] = {"file": filename}
+    for entry in files.values():
+        entry["sha256"] = sha256_file(os.path.join(staging_dir, entry["file"]))
+
+    content_digest = hashlib.sha256("".join(files[name]["sha256"] for name in sorted(files)).encode()).hexdigest()[:8]
+    version = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{content_digest}"
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "model_version": version,
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        **metadata,
+        "files": files,
+    }
+    with open(os.path.join(staging_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # The version directory appears complete or not at all; LATEST only moves once it exists.
+    # mkdtemp creates it 0700: give it the permissions of a normal directory (the files already have them).
+    os.chmod(staging_dir, 0o777 & ~_umask())
+    final_dir = os.path.join(bundle_root, version)
+    os.replace(staging_dir, final_dir)
+    if set_latest:
+        _atomic_write_text(os.path.join(bundle_root, LATEST_POINTER_FILENAME), version + "\n")
+    return version
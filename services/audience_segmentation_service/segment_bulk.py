@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import List, Optional, Tuple
+
+from model_bundle import ModelBundleError, resolve_bundle_version
+
+# Offline bulk segmentation (backfills, re-segmenting all ads after a retrain).
+# Reads a JSONL file of job ads, runs main.run_segmentation_batch over chunks of it in a pool of
+# worker processes and writes one JSON result per input line, in input order. At most
+# `workers * 2` chunks are in memory at any time, so the input size is not limited by RAM.
+#
+#   python segment_bulk.py ads.jsonl results.jsonl --workers 4 --chunk-size 512
+#
+# Input lines are objects with the job ad text under --text-field (default "job_ad_text", the
+# /segment request format) and optionally an identifier under --id-field that is copied to the output.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_BUNDLE_DIR = os.path.join(SCRIPT_DIR, "models", "bundles") # Same location main.py loads bundles from
+DEFAULT_CHUNK_SIZE = 512
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+def _init_worker(bundle_version: str, threads_per_worker: int):
+    # main.py resolves its model paths relative to the service directory.
+    os.chdir(SCRIPT_DIR)
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker) # Avoid oversubscribing cores across worker processes
+    except ImportError:
+        pass
+    import main
+    main.load_models_sync(bundle_version)
+
+def _segment_chunk(lines: List[str], first_line_number: int, text_field: str, id_field: Optional[str]) -> Tuple[List[str], int]:
+    """Runs one chunk of raw JSONL lines through the pipeline; returns the output lines (same order) and the error count."""
+    import main
+    records, job_ads, parse_errors = [], [], []
+    for offset, line in enumerate(lines):
+        record, error = {}, None
+        try:
+            record = json.loads(line)
+            job_ad = main.JobAdInput(job_ad_text=record[text_field], top_k_clusters=record.get("top_k_clusters"),
+                                     top_k_similar_ads=record.get("top_k_similar_ads"))
+        except (ValueError, KeyError, TypeError) as e:
+            job_ad, error = main.JobAdInput(job_ad_text=""), f"Invalid job ad on line {first_line_number + offset}: {e!r}"
+        records.append(record if isinstance(record, dict) else {})
+        job_ads.append(job_ad)
+        parse_errors.append(error)
+
+    valid_results = iter(main.run_segmentation_batch([ad for ad, error in zip(job_ads, parse_errors) if error is None]))
+    output_lines, n_errors = [], 0
+    for record, job_ad, error in zip(records, job_ads, parse_errors):
+        result = main.SegmentationOutput(job_ad_input=job_ad, derived_audience_primitives=[], error=error) if error else next(valid_results)
+        n_errors += result.error is not None
+        output = result.model_dump(mode="json")
+        if id_field and id_field in record:
+            output = {id_field: record[id_field], **output}
+        output_lines.append(json.dumps(output))
+    return output_lines, n_errors
+
+def _read_chunks(input_file, chunk_size: int):
+    """Yields (first_line_number, lines) for non-empty lines, `chunk_size` at a time."""
+    chunk, first_line_number = [], None
+    for line_number, line in enumerate(input_file, start=1):
+        if not line.strip():
+            continue
+        if first_line_number is None:
+            first_line_number = line_number
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield first_line_number, chunk
+            chunk, first_line_number = [], None
+    if chunk:
+        yield first_line_number, chunk
+
+def segment_file(input_path: str, output_path: str, workers: int = DEFAULT_WORKERS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 text_field: str = "job_ad_text", id_field: Optional[str] = "id", bundle_version: str = "latest"):
+    workers = max(1, workers)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    max_chunks_in_flight = workers * 2
+    if bundle_version == "latest":
+        # Resolve once so every worker loads the same version even if a new bundle is published meanwhile.
+        try:
+            bundle_version = resolve_bundle_version(MODEL_BUNDLE_DIR, "latest")
+        except ModelBundleError as e:
+            print(f"WARNING: {e} Workers will fall back to the legacy pickled models.")
+    started = time.perf_counter()
+    n_items, n_errors = 0, 0
+    print(f"Segmenting {input_path} -> {output_path} (workers={workers}, chunk_size={chunk_size}, bundle={bundle_version})...")
+
+    with open(input_path, 'r') as input_file, open(output_path, 'w') as output_file, ProcessPoolExecutor(
+        max_workers=workers,
+        # "spawn" for the same reason as the service's process pool: no forked torch/OpenMP state.
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(bundle_version, threads_per_worker),
+    ) as executor:
+        in_flight = deque()
+
+        def write_oldest():
+            nonlocal n_items, n_errors
+            output_lines, chunk_errors = in_flight.popleft().result()
+            output_file.writelines(output_line + "\n" for output_line in output_lines)
+            n_items += len(output_lines)
+            n_errors += chunk_errors
+            elapsed = time.perf_counter() - started
+            print(f"  {n_items} job ads written ({n_items / elapsed:.1f}/s, {n_errors} errors)")
+
+        for first_line_number, lines in _read_chunks(input_file, chunk_size):
+            in_flight.append(executor.submit(_segment_chunk, lines, first_line_number, text_field, id_field))
+            if len(in_flight) >= max_chunks_in_flight:
+                write_oldest() # Keeps memory bounded and the output in input order
+        while in_flight:
+            write_oldest()
+
+    print(f"Done: {n_items} job ads in {time.perf_counter() - started:.1f}s ({n_errors} errors).")
+    return n_items, n_errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segment a JSONL file of job ads offline, in parallel and in bounded memory.")
+    parser.add_argument("input", help="JSONL file, one job ad object per line.")
+    parser.add_argument("output", help="JSONL file to write one SegmentationOutput per input line to.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes, each with its own copy of the models.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Job ads per pipeline run.")
+    parser.add_argument("--text-field", default="job_ad_text", help="Field holding the job ad text.")
+    parser.add_argument("--id-field", default="id", help="Field copied from each input line to its result (if present).")
+    parser.add_argument("--bundle", default=os.environ.get("SEGMENTATION_MODEL_BUNDLE", "latest"),
+                        help='Model bundle version, "latest", or "none" for the legacy pickled models.')
+    args = parser.parse_args()
+
+    segment_file(os.path.abspath(args.input), os.path.abspath(args.output), workers=args.workers,
+                 chunk_size=args.chunk_size, text_field=args.text_field, id_field=args.id_field,
+                 bundle_version=args.bundle)
@@ -0,0 +1,93 @@
+import re
+import zlib
+
+import numpy as np
+import pytest
+
+from chunking import ChunkingConfig, encode_long_texts, pool_chunks, split_into_chunks
+
+class WordTokenizer:
+    """One token per word; `offsets=False` behaves like a slow tokenizer without offset mappings."""
+
+    def __init__(self, offsets=True):
+        self.offsets = offsets
+
+    def __call__(self, texts, return_offsets_mapping=False, **kwargs):
+        if return_offsets_mapping and not self.offsets:
+            raise NotImplementedError("return_offset_mapping is not available when using Python tokenizers.")
+        return {"offset_mapping": [[match.span() for match in re.finditer(r"\S+", text)] for text in texts]}
+
+    def tokenize(self, word):
+        return [word]
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+class FakeEncoder:
+    def __init__(self, max_seq_length=20, offsets=True):
+        self.max_seq_length = max_seq_length
+        self.tokenizer = WordTokenizer(offsets)
+        self.encoded = []
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True, **kwargs):
+        self.encoded.append(list(texts))
+        vectors = np.stack([np.random.RandomState(zlib.crc32(text.encode())).normal(size=8) for text in texts]) if texts else np.zeros((0, 8))
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def words(n, prefix="w"):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+@pytest.mark.parametrize("offsets", [True, False])
+def test_long_texts_are_split_within_the_budget(offsets):
+    encoder = FakeEncoder(max_seq_length=20, offsets=offsets)
+    text = words(100)
+    chunks, owners, token_counts = split_into_chunks(encoder, [text], ChunkingConfig(overlap_tokens=4))
+    assert len(chunks) > 1 and set(owners) == {0}
+    assert all(len(chunk.split()) <= 18 for chunk in chunks)  # 20 - 2 special tokens
+    assert list(token_counts) == [len(chunk.split()) for chunk in chunks]
+    assert all(chunk in text for chunk in chunks)
+    covered = {word for chunk in chunks for word in chunk.split()}
+    assert covered == set(text.split())
+
+def test_max_chunks_caps_the_chunks_per_text():
+    chunks, _, _ = split_into_chunks(FakeEncoder(), [words(1000)], ChunkingConfig(max_chunks=3))
+    assert len(chunks) == 3
+
+def test_short_texts_match_a_plain_encode():
+    texts = ["short ad", words(10)]
+    embeddings = encode_long_texts(FakeEncoder(), texts, ChunkingConfig())
+    np.testing.assert_array_equal(embeddings, FakeEncoder().encode(texts))
+
+def test_chunks_of_all_texts_are_encoded_in_one_call():
+    encoder = FakeEncoder()
+    texts = ["short ad", words(100), words(60, "x")]
+    embeddings = encode_long_texts(encoder, texts, ChunkingConfig())
+    assert embeddings.shape == (3, 8) and len(encoder.encoded) == 1
+    np.testing.assert_allclose(embeddings[0], FakeEncoder().encode(["short ad"])[0], rtol=1e-6, atol=1e-7)
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-5)
+
+def test_truncate_mode_is_a_plain_encode():
+    encoder = FakeEncoder()
+    texts = [words(100)]
+    encode_long_texts(encoder, texts, ChunkingConfig(mode="truncate"))
+    assert encoder.encoded == [texts]
+
+def test_pooling_keeps_the_mean_chunk_norm():
+    chunk_embeddings = np.array([[3.0, 0.0], [0.0, 1.0], [2.0, 2.0]], dtype=np.float32)
+    owners = np.array([0, 0, 1])
+    pooled = pool_chunks(chunk_embeddings, owners, np.array([10.0, 10.0, 5.0]), 2)
+    np.testing.assert_allclose(np.linalg.norm(pooled, axis=1), [2.0, np.sqrt(8)], rtol=1e-6)
+    np.testing.assert_allclose(pooled[0] / np.linalg.norm(pooled[0]), np.array([3.0, 1.0]) / np.sqrt(10), rtol=1e-6)
+
+def test_length_pooling_weights_chunks_by_token_count():
+    chunk_embeddings = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+    pooled = pool_chunks(chunk_embeddings, np.array([0, 0]), np.array([30.0, 10.0]), 1, pooling="length")
+    np.testing.assert_allclose(pooled[0] / np.linalg.norm(pooled[0]), np.array([3.0, 1.0]) / np.sqrt(10), rtol=1e-6)
+
+def test_invalid_config_is_rejected():
+    with pytest.raises(ValueError):
+        ChunkingConfig(mode="summarize")
+    with pytest.raises(ValueError):
+        ChunkingConfig(pooling="max")
+    assert ChunkingConfig(mode="truncate").describe() == "truncate"
+    assert ChunkingConfig().describe() != ChunkingConfig(pooling="length").describe()
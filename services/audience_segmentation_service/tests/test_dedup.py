@@ -0,0 +1,69 @@
+import numpy as np
+
+from dedup import MinHasher, NearDuplicateIndex, deduplicate, estimated_similarity, shingle_hashes
+
+WORDS = ("senior backend engineer python kubernetes remote salary equity berlin team product growth data "
+         "platform cloud hiring benefits flexible hours startup series funding customers analytics").split()
+
+def ad(seed, n_words=60):
+    rng = np.random.RandomState(seed)
+    return " ".join(f"{WORDS[i]}{j}" for i, j in zip(rng.randint(0, len(WORDS), n_words), rng.randint(0, 50, n_words)))
+
+def jaccard(text_a, text_b):
+    a, b = set(shingle_hashes(text_a).tolist()), set(shingle_hashes(text_b).tolist())
+    return len(a & b) / len(a | b)
+
+def test_estimate_tracks_true_jaccard():
+    hasher = MinHasher()
+    errors = []
+    for seed in range(20):
+        words = ad(seed).split()
+        for n_changed in (3, 10, 30):
+            edited = words[:]
+            for i in np.random.RandomState(seed + 100).choice(len(words), n_changed, replace=False):
+                edited[i] = f"edit{i}"
+            text_a, text_b = " ".join(words), " ".join(edited)
+            errors.append(abs(estimated_similarity(hasher.signature(text_a), hasher.signature(text_b)) - jaccard(text_a, text_b)))
+    assert np.mean(errors) < 0.05
+
+def test_disjoint_texts_with_ordered_shingles_are_not_similar():
+    # With small hash coefficients the mod never wraps and every function picks the same minimum shingle.
+    hasher = MinHasher()
+    assert estimated_similarity(hasher.signature("ad 0 5 bar baz"), hasher.signature("ad 0 5 foo qux")) < 0.5
+
+def test_signature_is_deterministic_and_empty_text_has_none():
+    assert np.array_equal(MinHasher().signature(ad(1)), MinHasher().signature(ad(1)))
+    assert MinHasher().signature("   ") is None
+
+def test_index_query_respects_threshold():
+    hasher = MinHasher()
+    index = NearDuplicateIndex(threshold=0.8)
+    index.add("a", hasher.signature(ad(1)), value="result-a")
+    index.add("b", hasher.signature(ad(2)))
+    matches = index.query(hasher.signature(ad(1) + " extra"))
+    assert [(key, value) for key, _, value in matches] == [("a", "result-a")]
+    assert index.query(hasher.signature(ad(3))) == []
+    assert index.stats()["hits"] == 1 and index.stats()["misses"] == 1
+
+def test_index_evicts_least_recently_matched():
+    hasher = MinHasher()
+    index = NearDuplicateIndex(threshold=0.8, max_entries=2)
+    index.add("a", hasher.signature(ad(1)))
+    index.add("b", hasher.signature(ad(2)))
+    assert index.query(hasher.signature(ad(1)))  # "a" becomes most recently used
+    index.add("c", hasher.signature(ad(3)))
+    assert len(index) == 2 and index.stats()["evictions"] == 1
+    assert index.query(hasher.signature(ad(2))) == []
+    assert [key for key, _, _ in index.query(hasher.signature(ad(1)))] == ["a"]
+
+def test_deduplicate_drops_reposts_and_keeps_distinct_ads():
+    texts = [ad(seed) for seed in range(30)]
+    reposts = [text + " apply now" for text in texts[:10]]
+    ad_ids = [f"ad-{i}" for i in range(40)]
+    kept, duplicate_of = deduplicate(ad_ids, texts + reposts)
+    assert kept == list(range(30))
+    assert duplicate_of == {f"ad-{30 + i}": f"ad-{i}" for i in range(10)}
+
+def test_deduplicate_keeps_empty_texts():
+    kept, duplicate_of = deduplicate(["a", "b", "c"], ["", "", ad(1)])
+    assert kept == [0, 1, 2] and duplicate_of == {}
@@ -0,0 +1,61 @@
+import os
+import time
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache, cache_key
+
+def vectors(value):
+    return np.full(4, value, dtype=np.float32), np.full(2, value, dtype=np.float32)
+
+def test_cache_key_normalizes_whitespace_and_depends_on_model_version():
+    assert cache_key("Python  engineer\n", "v1") == cache_key("Python engineer", "v1")
+    assert cache_key("Python engineer", "v1") != cache_key("Python engineer", "v2")
+
+def test_lru_evicts_least_recently_used():
+    cache = EmbeddingCache(max_entries=2, ttl_seconds=0)
+    cache.put("a", *vectors(1))
+    cache.put("b", *vectors(2))
+    assert cache.get("a") is not None # "a" is now the most recently used
+    cache.put("c", *vectors(3))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expires_entries(monkeypatch):
+    cache = EmbeddingCache(max_entries=10, ttl_seconds=60)
+    cache.put("a", *vectors(1))
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+def test_zero_entries_and_no_disk_disables_the_cache():
+    cache = EmbeddingCache(max_entries=0)
+    assert not cache.enabled
+    cache.put("a", *vectors(1))
+    assert cache.get("a") is None
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    EmbeddingCache(max_entries=10, disk_dir=str(tmp_path)).put("ab12", *vectors(5))
+    cache = EmbeddingCache(max_entries=10, disk_dir=str(tmp_path))
+    sbert, reduced = cache.get("ab12")
+    np.testing.assert_array_equal(sbert, vectors(5)[0])
+    np.testing.assert_array_equal(reduced, vectors(5)[1])
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.get("ab12") is not None and cache.stats()["hits"] == 1 # Promoted to memory
+    assert not [name for name in os.listdir(tmp_path / "ab") if name.endswith(".tmp")]
+
+def test_disk_tier_ttl_uses_the_file_mtime(tmp_path):
+    EmbeddingCache(max_entries=0, disk_dir=str(tmp_path)).put("cd34", *vectors(1))
+    path = tmp_path / "cd" / "cd34.npz"
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert EmbeddingCache(max_entries=0, ttl_seconds=60, disk_dir=str(tmp_path)).get("cd34") is None
+
+def test_unreadable_disk_entry_is_a_miss(tmp_path):
+    cache = EmbeddingCache(max_entries=0, disk_dir=str(tmp_path))
+    os.makedirs(tmp_path / "ef")
+    (tmp_path / "ef" / "ef56.npz").write_bytes(b"not an npz")
+    assert cache.get("ef56") is None
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,76 @@
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+DIM = 4
+
+def fake_encoder(calls):
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[len(text), sum(map(ord, text)) % 97, 1.0, i] for i, text in enumerate(texts)], dtype=np.float32)
+    return encode
+
+def open_store(tmp_path):
+    return EmbeddingStore(str(tmp_path), "enc", DIM)
+
+def test_only_new_or_changed_ads_are_encoded(tmp_path):
+    calls = []
+    store = open_store(tmp_path)
+    first, n_encoded = store.embed(["a", "b"], ["ad a", "ad b"], fake_encoder(calls))
+    store.save()
+    assert n_encoded == 2
+
+    store = open_store(tmp_path)
+    again, n_encoded = store.embed(["a", "b", "c"], ["ad a", "ad b changed", "ad c"], fake_encoder(calls))
+    assert n_encoded == 2 and calls[-1] == ["ad b changed", "ad c"]
+    np.testing.assert_array_equal(again[0], first[0])
+
+def test_unsaved_rows_are_not_visible_after_reopening(tmp_path):
+    store = open_store(tmp_path)
+    store.embed(["a"], ["ad a"], fake_encoder([]))
+    store.save()
+    store.embed(["b"], ["ad b"], fake_encoder([])) # Crash before save()
+    _, n_encoded = open_store(tmp_path).embed(["a", "b"], ["ad a", "ad b"], fake_encoder([]))
+    assert n_encoded == 1
+
+def test_other_encoder_or_dimension_starts_a_new_store(tmp_path):
+    store = open_store(tmp_path)
+    store.embed(["a"], ["ad a"], fake_encoder([]))
+    store.save()
+    _, n_encoded = EmbeddingStore(str(tmp_path), "other-encoder", DIM).embed(["a"], ["ad a"], fake_encoder([]))
+    assert n_encoded == 1
+
+def test_compaction_keeps_vectors_and_drops_stale_rows(tmp_path):
+    store = open_store(tmp_path)
+    ids, texts = ["a", "b", "c", "d"], ["ad a", "ad b", "ad c", "ad d"]
+    reference, _ = store.embed(ids, texts, fake_encoder([]))
+    store.save()
+    store.compact(["c", "d"])
+    store.save()
+    assert store.n_rows == 2
+
+    reopened = open_store(tmp_path)
+    embeddings, n_encoded = reopened.embed(["c", "d"], texts[2:], fake_encoder([]))
+    assert n_encoded == 0
+    np.testing.assert_array_equal(embeddings, reference[2:])
+    assert sorted(name for name in tmp_path.iterdir() if name.suffix == ".npy") == [tmp_path / reopened.embeddings_file]
+
+def test_compaction_without_save_keeps_the_old_index_consistent(tmp_path):
+    store = open_store(tmp_path)
+    ids, texts = ["a", "b", "c", "d"], ["ad a", "ad b", "ad c", "ad d"]
+    reference, _ = store.embed(ids, texts, fake_encoder([]))
+    store.save()
+    store.compact(["c", "d"]) # Crash before save(): the saved index must still match its matrix
+
+    embeddings, n_encoded = open_store(tmp_path).embed(ids, texts, fake_encoder([]))
+    assert n_encoded == 0
+    np.testing.assert_array_equal(embeddings, reference)
+
+def test_store_grows_past_its_initial_capacity(tmp_path):
+    store = open_store(tmp_path)
+    ids = [str(i) for i in range(1500)]
+    reference, _ = store.embed(ids, [f"ad {i}" for i in ids], fake_encoder([]))
+    store.save()
+    embeddings, n_encoded = open_store(tmp_path).embed(ids, [f"ad {i}" for i in ids], fake_encoder([]))
+    assert n_encoded == 0
+    np.testing.assert_array_equal(embeddings, reference)
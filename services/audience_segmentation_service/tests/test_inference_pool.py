@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+
+import pytest
+
+from inference_pool import InferencePool, InferencePoolSaturatedError
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_thread_pool_runs_off_the_event_loop():
+    async def scenario():
+        pool = InferencePool(mode="thread", max_workers=1)
+        pool.start()
+        try:
+            return await pool.run(threading.get_ident)
+        finally:
+            pool.shutdown()
+
+    assert run(scenario()) != threading.get_ident()
+
+def test_saturated_pool_fails_fast_and_recovers():
+    started, release = threading.Event(), threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    async def scenario():
+        pool = InferencePool(mode="thread", max_workers=1, max_pending=2)
+        pool.start()
+        try:
+            admitted = [asyncio.ensure_future(pool.run(blocking)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            assert pool.pending == 2 and pool.in_flight == 1 and pool.saturated
+            with pytest.raises(InferencePoolSaturatedError):
+                await pool.run(blocking)
+            assert pool.rejected == 1
+            release.set()
+            results = await asyncio.gather(*admitted)
+            assert pool.pending == 0 and not pool.saturated
+            return results
+        finally:
+            pool.shutdown()
+
+    assert run(scenario()) == ["done", "done"]
+
+def test_run_before_start_raises():
+    with pytest.raises(RuntimeError):
+        run(InferencePool().run(time.time))
+
+def test_drain_waits_for_admitted_calls():
+    async def scenario():
+        pool = InferencePool(mode="thread", max_workers=1)
+        pool.start()
+        call = asyncio.ensure_future(pool.run(time.sleep, 0.1))
+        await asyncio.sleep(0.01)
+        await pool.drain()
+        return call.done(), pool._executor
+
+    assert run(scenario()) == (True, None)
+
+def test_process_warm_up_reaches_every_worker():
+    async def scenario():
+        # Slow initializers: without repeated rounds the first ready worker would take every call.
+        pool = InferencePool(mode="process", max_workers=3, initializer=functools.partial(time.sleep, 0.3))
+        pool.start()
+        try:
+            return await pool.warm_up(os.getpid, timeout_s=60)
+        finally:
+            pool.shutdown()
+
+    results = run(scenario())
+    assert len(results) == 3
+    assert all(pid == result and pid != os.getpid() for pid, result in results.items())
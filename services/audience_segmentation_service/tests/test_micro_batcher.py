@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from micro_batcher import MicroBatcher, MicroBatcherFullError
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_concurrent_submits_are_coalesced_and_results_routed_back():
+    batches = []
+
+    async def process(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=8, max_wait_ms=50)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        finally:
+            await batcher.stop()
+
+    assert run(scenario()) == [0, 10, 20, 30, 40]
+    assert batches == [[0, 1, 2, 3, 4]]
+
+def test_batches_never_exceed_max_batch_size():
+    sizes = []
+
+    async def process(items):
+        sizes.append(len(items))
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=3, max_wait_ms=20)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(7)))
+        finally:
+            await batcher.stop()
+
+    assert run(scenario()) == list(range(7))
+    assert max(sizes) <= 3 and sum(sizes) == 7
+
+def test_batch_failure_is_raised_to_every_caller_of_that_batch():
+    async def process(items):
+        raise ValueError("boom")
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=20)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+
+def test_full_queue_rejects_instead_of_queueing():
+    release = None
+
+    async def process(items):
+        await release.wait()
+        return items
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        batcher = MicroBatcher(process, max_batch_size=1, max_wait_ms=0, max_queue_depth=2)
+        batcher.start()
+        try:
+            running = asyncio.ensure_future(batcher.submit("running"))
+            await asyncio.sleep(0.01) # Taken by the only batch slot
+            queued = [asyncio.ensure_future(batcher.submit(i)) for i in range(2)]
+            await asyncio.sleep(0.01)
+            with pytest.raises(MicroBatcherFullError):
+                await batcher.submit("overflow")
+            release.set()
+            return await asyncio.gather(running, *queued)
+        finally:
+            await batcher.stop()
+
+    assert run(scenario()) == ["running", 0, 1]
+
+def test_submit_before_start_raises():
+    async def process(items):
+        return items
+
+    with pytest.raises(RuntimeError):
+        run(MicroBatcher(process).submit(1))
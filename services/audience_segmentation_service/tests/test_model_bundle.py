@@ -0,0 +1,75 @@
+import json
+import os
+import stat
+
+import numpy as np
+import pytest
+
+from model_bundle import LATEST_POINTER_FILENAME, MANIFEST_FILENAME, ModelBundle, ModelBundleError, resolve_bundle_version, write_bundle
+
+def write(root, value=1.0, **kwargs):
+    arrays = {"kmeans_centroids": np.full((3, 4), value, dtype=np.float32)}
+    return write_bundle(str(root), arrays, {"cluster_profiles": {"0": {"name": "A"}}}, {"encoder": {"name": "enc"}}, **kwargs)
+
+def test_round_trip_is_memory_mapped_and_read_only(tmp_path):
+    version = write(tmp_path)
+    bundle = ModelBundle.load(str(tmp_path), "latest", verify_checksums=True)
+    assert bundle.version == version and bundle.encoder_name == "enc"
+    centroids = bundle.array("kmeans_centroids")
+    assert isinstance(centroids, np.memmap) and not centroids.flags.writeable
+    np.testing.assert_array_equal(centroids, np.ones((3, 4), dtype=np.float32))
+    assert bundle.json_file("cluster_profiles") == {"0": {"name": "A"}}
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".staging-")]
+
+def test_latest_moves_only_when_asked(tmp_path):
+    first = write(tmp_path, 1.0)
+    second = write(tmp_path, 2.0, set_latest=False)
+    assert first != second
+    assert resolve_bundle_version(str(tmp_path)) == first
+    assert ModelBundle.load(str(tmp_path), second).array("kmeans_centroids")[0, 0] == 2.0
+
+def test_checksum_mismatch_is_detected(tmp_path):
+    version = write(tmp_path)
+    path = tmp_path / version / "kmeans_centroids.npy"
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    ModelBundle.load(str(tmp_path), version) # Checksums are only verified on request
+    with pytest.raises(ModelBundleError, match="Checksum mismatch"):
+        ModelBundle.load(str(tmp_path), version, verify_checksums=True)
+
+def test_missing_file_and_unknown_format_are_rejected(tmp_path):
+    version = write(tmp_path)
+    os.remove(tmp_path / version / "cluster_profiles.json")
+    with pytest.raises(ModelBundleError, match="missing"):
+        ModelBundle.load(str(tmp_path), version)
+
+    version = write(tmp_path, 3.0)
+    manifest_path = tmp_path / version / MANIFEST_FILENAME
+    manifest = json.loads(manifest_path.read_text())
+    manifest["format_version"] = 999
+    manifest_path.write_text(json.dumps(manifest))
+    with pytest.raises(ModelBundleError, match="format_version"):
+        ModelBundle.load(str(tmp_path), version)
+
+@pytest.mark.parametrize("version", ["../outside", "/etc", "..", ".staging-x", "a/b", "", "missing"])
+def test_versions_outside_the_bundle_root_are_rejected(tmp_path, version):
+    write(tmp_path)
+    (tmp_path.parent / "outside").mkdir(exist_ok=True)
+    with pytest.raises(ModelBundleError):
+        ModelBundle.load(str(tmp_path), version)
+
+def test_latest_pointer_is_validated_too(tmp_path):
+    write(tmp_path)
+    (tmp_path / LATEST_POINTER_FILENAME).write_text("../elsewhere\n")
+    with pytest.raises(ModelBundleError):
+        resolve_bundle_version(str(tmp_path))
+
+def test_bundle_is_readable_by_other_users(tmp_path):
+    previous_umask = os.umask(0o022)
+    try:
+        version = write(tmp_path)
+    finally:
+        os.umask(previous_umask)
+    assert stat.S_IMODE(os.stat(tmp_path / version).st_mode) == 0o755
+    assert stat.S_IMODE(os.stat(tmp_path / LATEST_POINTER_FILENAME).st_mode) == 0o644
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from vector_index import VectorIndex
+
+def corpus(n=2000, dim=16, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.normal(size=(20, dim)) * 4
+    vectors = centers[rng.randint(0, 20, size=n)] + rng.normal(size=(n, dim))
+    return vectors.astype(np.float32), [f"ad-{i}" for i in range(n)]
+
+def brute_force(vectors, queries, k, metric):
+    if metric == "cosine":
+        v = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        distances = 1 - q @ v.T
+    else:
+        distances = np.linalg.norm(queries[:, None, :] - vectors[None, :, :], axis=2)
+    return np.argsort(distances, axis=1, kind="stable")[:, :k], np.sort(distances, axis=1)[:, :k]
+
+@pytest.mark.parametrize("metric", ["cosine", "euclidean"])
+
+def test_exact_index_matches_brute_force(metric):
+    vectors, ids = corpus(500)
+    queries = vectors[:70] + 0.01  # More than one query block
+    index = VectorIndex.build(vectors, ids, kind="exact", metric=metric)
+    rows, distances = index.search(queries, k=5)
+    expected_rows, expected_distances = brute_force(vectors, queries, 5, metric)
+    # float32 ||q||^2 - 2 q.v + ||v||^2 loses a few digits against the float64 reference.
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-3, atol=5e-3)
+    assert (rows == expected_rows).mean() > 0.99  # Ties may order differently
+
+def test_self_lookup_has_zero_distance():
+    vectors, ids = corpus(300)
+    rows, distances = VectorIndex.build(vectors, ids, kind="exact").search(vectors[:10], k=1)
+    assert list(rows[:, 0]) == list(range(10))
+    assert np.all(distances >= 0) and np.all(distances < 1e-5)
+
+@pytest.mark.parametrize("metric", ["cosine", "euclidean"])
+
+def test_ivf_recall_against_exact(metric):
+    vectors, ids = corpus()
+    queries = vectors[::40] + 0.05
+    exact_rows, _ = VectorIndex.build(vectors, ids, kind="exact", metric=metric).search(queries, k=10)
+    ivf = VectorIndex.build(vectors, ids, kind="ivf", metric=metric, n_lists=32)
+    ivf_rows, _ = ivf.search(queries, k=10, n_probe=8)
+    ivf_ids = [[ivf.ad_ids[row] for row in query_rows] for query_rows in ivf_rows]
+    exact_ids = [[ids[row] for row in query_rows] for query_rows in exact_rows]
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(ivf_ids, exact_ids)])
+    assert recall >= 0.9
+    # Probing every list is exact.
+    all_rows, _ = ivf.search(queries, k=10, n_probe=32)
+    assert [set(ivf.ad_ids[row] for row in query_rows) for query_rows in all_rows] == [set(row_ids) for row_ids in exact_ids]
+
+def test_arrays_round_trip():
+    vectors, ids = corpus(500)
+    ivf = VectorIndex.build(vectors, ids, kind="ivf", n_lists=8)
+    restored = VectorIndex.from_arrays(ivf.arrays(), ivf.ad_ids, ivf.metric)
+    assert restored.kind == "ivf" and restored.describe() == ivf.describe()
+    for a, b in zip(ivf.search(vectors[:5], 3), restored.search(vectors[:5], 3)):
+        np.testing.assert_array_equal(a, b)
+
+def test_k_larger_than_the_corpus_pads_with_minus_one():
+    vectors, ids = corpus(3)
+    rows, distances = VectorIndex.build(vectors, ids, kind="exact").search(vectors[:1], k=5)
+    assert list(rows[0, 3:]) == [-1, -1] and np.all(np.isinf(distances[0, 3:]))
+
+def test_invalid_inputs_are_rejected():
+    vectors, ids = corpus(10)
+    with pytest.raises(ValueError):
+        VectorIndex(vectors, ids[:5])
+    with pytest.raises(ValueError):
+        VectorIndex.build(vectors, ids, kind="hnsw")
+    with pytest.raises(ValueError):
+        VectorIndex.build(vectors, ids).search(np.zeros((1, 3)), k=1)
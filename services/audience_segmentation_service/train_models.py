@@ -1,11 +1,24 @@
+import argparse
 import joblib
 import numpy as np
 import json
 import os
+import time
+from joblib import Parallel, delayed
 from sentence_transformers import SentenceTransformer
+from chunking import LONG_TEXT_MODES, POOLING_MODES, ChunkingConfig, encode_long_texts
+from cluster_profiling import generate_cluster_profiles, load_taxonomy
+from dedup import deduplicate
+from embedding_store import EmbeddingStore, content_hash
+from model_bundle import ModelBundle, ModelBundleError, sha256_file, write_bundle
 from umap import UMAP
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
+from vector_index import INDEX_KINDS, VectorIndex
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA
+from sklearn.linear_model import Ridge
+from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score, silhouette_score
+from sklearn.model_selection import KFold, cross_val_predict
+from sklearn.pipeline import make_pipeline
 
 # --- Configuration (should match or be consistent with main.py and create_dummy_models.py) --- #
 # Get the absolute path of the directory where the script is located
@@ -14,6 +27,9 @@ MODEL_DIR = os.path.join(SCRIPT_DIR, "models")
 DATA_DIR = os.path.join(SCRIPT_DIR, "data")
 CORPUS_PATH = os.path.join(DATA_DIR, "job_ads_corpus.json")
 SBERT_MODEL_NAME = 'all-MiniLM-L6-v2'
+ONNX_ENCODER_DIR = os.path.join(MODEL_DIR, "onnx_encoder") # Same location main.py loads the ONNX backends from
+# Long ads are chunked and pooled (see chunking.py); must match main.py's SEGMENTATION_LONG_TEXT_MODE / SEGMENTATION_CHUNK_* settings
+CORPUS_CHUNKING = ChunkingConfig(mode="chunk", max_tokens=0, overlap_tokens=32, pooling="mean")
 
 # UMAP Parameters (tune these based on your data and experimentation)
 UMAP_N_COMPONENTS = 50
@@ -21,16 +37,50 @@ UMAP_N_NEIGHBORS = 15 # Default, can be tuned
 UMAP_MIN_DIST = 0.1   # Default, can be tuned
 UMAP_RANDOM_STATE = 42
 
+# Fast projection Parameters (linear maps from SBERT space onto the UMAP coordinates, see fit_projection_heads)
+PROJECTION_PATH = os.path.join(MODEL_DIR, "fitted_projection.npz")
+PROJECTION_RIDGE_ALPHA = 1.0 # L2 regularization of the SBERT -> UMAP least-squares fit
+PROJECTION_PCA_COMPONENTS = 32 # Rank of the "pca" projection (capped by the corpus size)
+PROJECTION_CV_FOLDS = 5 # Folds for the out-of-sample cluster agreement report
+
+# Versioned artifact bundles (raw .npy arrays + JSON manifest), loaded by main.py with memory mapping
+MODEL_BUNDLE_DIR = os.path.join(MODEL_DIR, "bundles")
+CLUSTER_PROFILES_PATH = os.path.join(MODEL_DIR, "cluster_profiles.json")
+AUDIENCE_TAXONOMY_PATH = os.path.join(SCRIPT_DIR, "..", "..", "lib", "automation", "audience_taxonomy.yaml") # Skills/industries/seniorities profiles are matched against
+
+# Persistent corpus embeddings (see embedding_store.py): only new or changed ads are re-encoded
+EMBEDDING_STORE_DIR = os.path.join(DATA_DIR, "embedding_store")
+EMBEDDING_STORE_COMPACT_FRACTION = 0.25 # Rewrite the store once this share of its rows is stale
+
+# Near-duplicate collapsing (see dedup.py): reposts of the same ad are dropped before embedding so they do not
+# pull centroids towards themselves; the first ad of each group is kept
+CORPUS_DEDUP_THRESHOLD = 0.85 # Estimated Jaccard similarity of word 3-shingles above which two ads are duplicates
+DEDUP_REPORT_PATH = os.path.join(MODEL_DIR, "dedup_report.json") # {dropped ad id: kept ad id} of the last run
+
+# Similar-ads index over the corpus (see vector_index.py), stored in the bundle for main.py's similar_ads lookups
+SIMILAR_ADS_INDEX_KIND = "auto" # "exact", "ivf", "auto" (IVF above vector_index.IVF_AUTO_THRESHOLD ads) or "none"
+SIMILAR_ADS_INDEX_SPACE = "sbert" # "sbert" (cosine, independent of the serving reduction mode) or "reduced" (euclidean on the UMAP coordinates)
+SIMILAR_ADS_IVF_N_LISTS = None # IVF lists, None = ~4 * sqrt(corpus size)
+
 # K-Means Parameters
 KMEANS_K_RANGE = range(2, 7) # k will be tested from 2 to 6 (inclusive of 2, exclusive of 7)
 KMEANS_RANDOM_STATE = 42
+KMEANS_SEARCH_N_JOBS = -1 # k candidates fitted in parallel (joblib processes), -1 = all cores
+KMEANS_SELECTION_CRITERION = "silhouette" # "silhouette" (sampled), "calinski_harabasz" or "davies_bouldin"
+KMEANS_SILHOUETTE_SAMPLE_SIZE = 10000 # Silhouette is O(n^2); score a random sample of this many ads
+KMEANS_MINIBATCH_THRESHOLD = 50000 # Use MiniBatchKMeans above this many ads ("auto" mode)
+KMEANS_MINIBATCH_BATCH_SIZE = 4096
+KMEANS_SEARCH_REPORT_PATH = os.path.join(MODEL_DIR, "k_search_report.json") # Per-k timings and scores of the last search
+# Whether a higher score is better for each criterion (Davies-Bouldin is lower-is-better)
+KMEANS_CRITERIA_HIGHER_IS_BETTER = {"silhouette": True, "calinski_harabasz": True, "davies_bouldin": False}
 
 # --- Helper Functions --- # 
-def load_job_ad_corpus(filepath=CORPUS_PATH):
+def load_job_ad_corpus(filepath=CORPUS_PATH, with_ids=False):
     """
     Placeholder function to load your job ad dataset.
     Expects a JSON file where each entry has a field like 'text' or 'description'.
     Adjust to your actual data format.
+    With `with_ids`, returns (ad_ids, texts); ads without an 'id' are identified by their content hash.
     """
     print(f"Loading job ad corpus from {filepath}...")
     if not os.path.exists(filepath):
@@ -42,64 +92,365 @@ def load_job_ad_corpus(filepath=CORPUS_PATH):
         with open(filepath, 'r') as f:
             corpus_data = json.load(f)
         # Assuming each item in corpus_data is a dict and has a 'text' field
-        job_texts = [item['text'] for item in corpus_data if 'text' in item and item['text']]
+        job_items = [item for item in corpus_data if 'text' in item and item['text']]
+        job_texts = [item['text'] for item in job_items]
         if not job_texts:
             print("Error: No job texts found in the corpus file. Ensure items have a 'text' field with content.")
             return None
         print(f"Loaded {len(job_texts)} job ad texts from corpus.")
+        if with_ids:
+            return [str(item['id']) if item.get('id') is not None else content_hash(item['text']) for item in job_items], job_texts
         return job_texts
     except Exception as e:
         print(f"Error loading or parsing corpus: {e}")
         return None
 
+def fit_projection_heads(sbert_embeddings, umap_embeddings):
+    """
+    Fits linear approximations of the UMAP transform so the service can reduce with one matrix multiply:
+      "linear": ridge regression from SBERT space onto the UMAP coordinates.
+      "pca":    PCA down to PROJECTION_PCA_COMPONENTS, then ridge onto the UMAP coordinates (a low-rank map).
+    Both are folded into a single (weights, bias) pair. Returns {mode: (weights, bias, sklearn_estimator)}.
+    """
+    heads = {}
+    ridge = Ridge(alpha=PROJECTION_RIDGE_ALPHA).fit(sbert_embeddings, umap_embeddings)
+    heads["linear"] = (ridge.coef_.T.astype(np.float32), ridge.intercept_.astype(np.float32),
+                       Ridge(alpha=PROJECTION_RIDGE_ALPHA))
+
+    n_components = max(1, min(PROJECTION_PCA_COMPONENTS, sbert_embeddings.shape[0] - 1, sbert_embeddings.shape[1]))
+    pca = PCA(n_components=n_components, random_state=UMAP_RANDOM_STATE).fit(sbert_embeddings)
+    pca_ridge = Ridge(alpha=PROJECTION_RIDGE_ALPHA).fit(pca.transform(sbert_embeddings), umap_embeddings)
+    # x -> ((x - mean) @ components.T) @ coef.T + intercept, folded into x @ W + b
+    pca_weights = pca.components_.T @ pca_ridge.coef_.T
+    pca_bias = pca_ridge.intercept_ - pca.mean_ @ pca_weights
+    # The cross-validation copy is refitted on each training fold, which has fewer samples than the corpus.
+    cv_train_size = sbert_embeddings.shape[0] - int(np.ceil(sbert_embeddings.shape[0] / PROJECTION_CV_FOLDS))
+    cv_components = max(1, min(n_components, cv_train_size - 1))
+    heads["pca"] = (pca_weights.astype(np.float32), pca_bias.astype(np.float32),
+                    make_pipeline(PCA(n_components=cv_components, random_state=UMAP_RANDOM_STATE), Ridge(alpha=PROJECTION_RIDGE_ALPHA)))
+    return heads
+
+def report_projection_agreement(heads, sbert_embeddings, umap_embeddings, kmeans_model):
+    """Prints how often each projection mode yields the same K-Means cluster as the true UMAP transform."""
+    umap_labels = kmeans_model.predict(umap_embeddings)
+    n_folds = min(PROJECTION_CV_FOLDS, sbert_embeddings.shape[0])
+    print("\nCluster assignment agreement of the fast projection modes vs. true UMAP:")
+    report = {}
+    for mode, (weights, bias, estimator) in heads.items():
+        in_sample_labels = kmeans_model.predict(sbert_embeddings @ weights + bias)
+        in_sample = float(np.mean(in_sample_labels == umap_labels))
+        out_of_fold = None
+        if n_folds >= 2:
+            # Out-of-fold predictions estimate agreement on ads the projection was not fitted on.
+            predicted = cross_val_predict(estimator, sbert_embeddings, umap_embeddings,
+                                          cv=KFold(n_splits=n_folds, shuffle=True, random_state=UMAP_RANDOM_STATE))
+            out_of_fold = float(np.mean(kmeans_model.predict(predicted.astype(np.float32)) == umap_labels))
+        report[mode] = {"in_sample_agreement": in_sample, "out_of_fold_agreement": out_of_fold}
+        out_of_fold_text = f"{out_of_fold:.2%}" if out_of_fold is not None else "N/A"
+        print(f"  {mode}: in-sample {in_sample:.2%}, out-of-fold ({n_folds}-fold) {out_of_fold_text}")
+    return report
+
+def build_similar_ads_index(ad_ids, sbert_embeddings, reduced_embeddings, kind=SIMILAR_ADS_INDEX_KIND, space=SIMILAR_ADS_INDEX_SPACE):
+    """Nearest-neighbour index over the corpus for the service's similar_ads lookups, or None when disabled or failing."""
+    if kind == "none":
+        return None
+    vectors = sbert_embeddings if space == "sbert" else reduced_embeddings
+    metric = "cosine" if space == "sbert" else "euclidean"
+    print(f"\nBuilding the similar-ads index ({kind}, {space} space, {metric}) over {len(ad_ids)} ads...")
+    try:
+        started = time.perf_counter()
+        index = VectorIndex.build(vectors, ad_ids, kind=kind, metric=metric, n_lists=SIMILAR_ADS_IVF_N_LISTS, random_state=KMEANS_RANDOM_STATE)
+        print(f"Similar-ads index built in {time.perf_counter() - started:.1f}s: {index.describe()}")
+        return index
+    except Exception as e:
+        print(f"Error building the similar-ads index: {e}")
+        return None
+
+def write_model_bundle(kmeans_model, projection_heads, reduced_dimension, similar_ads_index=None, similar_ads_space=SIMILAR_ADS_INDEX_SPACE,
+                       chunking=CORPUS_CHUNKING):
+    """Writes centroids, projection matrices, cluster profiles and the similar-ads index as a new bundle version and points LATEST at it."""
+    print(f"\nWriting pickle-free model bundle to {MODEL_BUNDLE_DIR}...")
+    arrays = {"kmeans_centroids": kmeans_model.cluster_centers_.astype(np.float32)}
+    for mode, (weights, bias, _) in projection_heads.items():
+        arrays[f"{mode}_weights"] = weights.astype(np.float32)
+        arrays[f"{mode}_bias"] = bias.astype(np.float32)
+
+    json_files = {}
+    metadata = {}
+    if similar_ads_index is not None:
+        arrays.update({f"similar_ads_{name}": array for name, array in similar_ads_index.arrays().items()})
+        json_files["similar_ads_ids"] = similar_ads_index.ad_ids
+        metadata["similar_ads"] = {**similar_ads_index.describe(), "space": similar_ads_space}
+    if os.path.exists(CLUSTER_PROFILES_PATH):
+        with open(CLUSTER_PROFILES_PATH, 'r') as f:
+            json_files["cluster_profiles"] = json.load(f)
+        missing_labels = [str(i) for i in range(kmeans_model.n_clusters) if str(i) not in json_files["cluster_profiles"]]
+        if missing_labels:
+            print(f"WARNING: cluster_profiles.json has no profile for cluster(s) {missing_labels}; update it for k={kmeans_model.n_clusters}.")
+
+    umap_model_path = os.path.join(MODEL_DIR, "fitted_umap.pkl")
+    try:
+        version = write_bundle(MODEL_BUNDLE_DIR, arrays, json_files, metadata={
+            "encoder": {"name": SBERT_MODEL_NAME, "long_text": chunking.describe()},
+            "reduction": {
+                "modes": sorted(projection_heads),
+                "output_dimension": int(reduced_dimension),
+                # UMAP itself cannot be stored pickle-free; "umap" mode still loads this file, and main.py refuses
+                # it when its checksum differs (e.g. after rolling back to an older bundle).
+                "umap_model_file": "fitted_umap.pkl",
+                "umap_model_sha256": sha256_file(umap_model_path) if os.path.exists(umap_model_path) else None,
+            },
+            "kmeans": {"n_clusters": int(kmeans_model.n_clusters)},
+            **metadata,
+        })
+        print(f"Model bundle '{version}' written and marked as LATEST.")
+        return version
+    except Exception as e:
+        print(f"Error writing model bundle: {e}")
+        return None
+
+def deduplicate_corpus(ad_ids, job_ad_texts, threshold=CORPUS_DEDUP_THRESHOLD):
+    """Drops near-duplicate ads (keeping the first of each group) and writes DEDUP_REPORT_PATH. Returns (ad_ids, texts)."""
+    started = time.perf_counter()
+    kept, duplicate_of = deduplicate(ad_ids, job_ad_texts, threshold=threshold)
+    print(f"Near-duplicate detection: {len(duplicate_of)} of {len(ad_ids)} ads collapsed into {len(set(duplicate_of.values()))} kept ad(s) "
+          f"in {time.perf_counter() - started:.1f}s (threshold {threshold}).")
+    try:
+        with open(DEDUP_REPORT_PATH, 'w') as f:
+            json.dump({"threshold": threshold, "n_input": len(ad_ids), "n_kept": len(kept), "duplicate_of": duplicate_of}, f, indent=2)
+    except OSError as e:
+        print(f"Error writing {DEDUP_REPORT_PATH}: {e}")
+    return [ad_ids[i] for i in kept], [job_ad_texts[i] for i in kept]
+
+def encode_corpus(sbert_model, ad_ids, job_ad_texts, use_store=True, chunking=CORPUS_CHUNKING):
+    """SBERT embeddings of the corpus (long ads chunked and pooled), read from the embedding store where the ad's text is unchanged."""
+    encode = lambda texts: encode_long_texts(sbert_model, texts, chunking, show_progress_bar=True)
+    if not use_store:
+        print("Generating embeddings for the whole corpus (this may take a while)...")
+        return encode(job_ad_texts)
+    # Chunked embeddings of long ads differ from truncated ones, so each setting has its own store contents.
+    store_encoder_name = SBERT_MODEL_NAME if chunking.mode == "truncate" else f"{SBERT_MODEL_NAME}|{chunking.describe()}"
+    store = EmbeddingStore(EMBEDDING_STORE_DIR, store_encoder_name, sbert_model.get_sentence_embedding_dimension())
+    embeddings, n_encoded = store.embed(ad_ids, job_ad_texts, encode)
+    print(f"Embedding store: reused {len(job_ad_texts) - n_encoded} embedding(s), encoded {n_encoded} new or changed ad(s).")
+    if store.n_rows - len(set(ad_ids)) > EMBEDDING_STORE_COMPACT_FRACTION * store.n_rows:
+        store.compact(ad_ids)
+    store.save()
+    return embeddings
+
+def load_previous_models():
+    """
+    Fitted UMAP and K-Means centroids of the previous run, for warm starts. Centroids come from the
+    LATEST bundle, falling back to fitted_kmeans.pkl. Returns (None, None) when either is missing.
+    """
+    try:
+        previous_umap = joblib.load(os.path.join(MODEL_DIR, 'fitted_umap.pkl'))
+    except Exception as e:
+        print(f"No previous UMAP model to warm-start from ({e}).")
+        return None, None
+    try:
+        previous_centroids = np.array(ModelBundle.load(MODEL_BUNDLE_DIR, "latest").array("kmeans_centroids"))
+    except (ModelBundleError, KeyError):
+        try:
+            previous_centroids = joblib.load(os.path.join(MODEL_DIR, 'fitted_kmeans.pkl')).cluster_centers_
+        except Exception as e:
+            print(f"No previous K-Means centroids to warm-start from ({e}).")
+            return None, None
+    if previous_centroids.shape[1] != getattr(previous_umap, 'n_components', None):
+        print(f"Previous centroids ({previous_centroids.shape[1]}d) do not match the previous UMAP output; not warm-starting.")
+        return None, None
+    return previous_umap, previous_centroids
+
+def score_clustering(reduced_embeddings, cluster_labels, criterion=KMEANS_SELECTION_CRITERION,
+                     sample_size=KMEANS_SILHOUETTE_SAMPLE_SIZE):
+    """Cluster quality under `criterion`, or None if undefined (a single label, or one ad per label)."""
+    n_labels = len(np.unique(cluster_labels))
+    if not 1 < n_labels < reduced_embeddings.shape[0]:
+        return None
+    if criterion == "silhouette":
+        sample = sample_size if sample_size and reduced_embeddings.shape[0] > sample_size else None
+        return float(silhouette_score(reduced_embeddings, cluster_labels, sample_size=sample, random_state=KMEANS_RANDOM_STATE))
+    if criterion == "calinski_harabasz":
+        return float(calinski_harabasz_score(reduced_embeddings, cluster_labels))
+    if criterion == "davies_bouldin":
+        return float(davies_bouldin_score(reduced_embeddings, cluster_labels))
+    raise ValueError(f"Unknown K-Means selection criterion '{criterion}'. Expected one of {sorted(KMEANS_CRITERIA_HIGHER_IS_BETTER)}.")
+
+def evaluate_k(reduced_embeddings, k, use_minibatch, criterion, sample_size):
+    """Fits and scores one k candidate; runs in a joblib worker. Returns (report entry, fitted model or None)."""
+    entry = {"k": k, "algorithm": "MiniBatchKMeans" if use_minibatch else "KMeans"}
+    try:
+        started = time.perf_counter()
+        if use_minibatch:
+            kmeans_model = MiniBatchKMeans(n_clusters=k, random_state=KMEANS_RANDOM_STATE, n_init='auto',
+                                           batch_size=KMEANS_MINIBATCH_BATCH_SIZE)
+        else:
+            kmeans_model = KMeans(n_clusters=k, random_state=KMEANS_RANDOM_STATE, n_init='auto')
+        cluster_labels = kmeans_model.fit_predict(reduced_embeddings)
+        entry["fit_seconds"] = round(time.perf_counter() - started, 3)
+        started = time.perf_counter()
+        entry["score"] = score_clustering(reduced_embeddings, cluster_labels, criterion, sample_size)
+        entry["score_seconds"] = round(time.perf_counter() - started, 3)
+        entry["inertia"] = float(kmeans_model.inertia_)
+        entry["n_labels"] = int(len(np.unique(cluster_labels)))
+        return entry, kmeans_model
+    except Exception as e:
+        entry["error"] = str(e)
+        return entry, None
+
+def search_kmeans_k(reduced_embeddings, k_values=KMEANS_K_RANGE, criterion=KMEANS_SELECTION_CRITERION,
+                    minibatch="auto", n_jobs=KMEANS_SEARCH_N_JOBS, sample_size=KMEANS_SILHOUETTE_SAMPLE_SIZE):
+    """
+    Fits every candidate k in parallel and returns (best model, best score, report). `minibatch` is
+    "auto" (MiniBatchKMeans above KMEANS_MINIBATCH_THRESHOLD ads), "always" or "never". The report
+    (settings, per-k fit/score seconds, scores and inertia) is also written to KMEANS_SEARCH_REPORT_PATH.
+    """
+    n_samples = reduced_embeddings.shape[0]
+    use_minibatch = minibatch == "always" or (minibatch == "auto" and n_samples > KMEANS_MINIBATCH_THRESHOLD)
+    candidates = [k for k in k_values if k < n_samples]
+    skipped = [k for k in k_values if k >= n_samples]
+    if skipped:
+        print(f"Skipping k={skipped}, not enough samples ({n_samples}).")
+    print(f"Testing k values {candidates} with {'MiniBatchKMeans' if use_minibatch else 'KMeans'} "
+          f"(criterion={criterion}, n_jobs={n_jobs}) on {n_samples} ads...")
+
+    started = time.perf_counter()
+    # Each candidate is independent; processes sidestep the GIL in the scoring code.
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(evaluate_k)(reduced_embeddings, k, use_minibatch, criterion, sample_size) for k in candidates
+    )
+    higher_is_better = KMEANS_CRITERIA_HIGHER_IS_BETTER[criterion]
+    best_entry, best_model = None, None
+    for entry, kmeans_model in results:
+        if "error" in entry:
+            print(f"  k={entry['k']}: error during K-Means: {entry['error']}")
+            continue
+        score_text = f"{entry['score']:.4f}" if entry["score"] is not None else "N/A"
+        print(f"  k={entry['k']}: {criterion} {score_text} (fit {entry['fit_seconds']}s, score {entry['score_seconds']}s)")
+        if entry["score"] is None:
+            continue
+        if best_entry is None or (entry["score"] > best_entry["score"] if higher_is_better else entry["score"] < best_entry["score"]):
+            best_entry, best_model = entry, kmeans_model
+
+    report = {
+        "n_samples": int(n_samples),
+        "criterion": criterion,
+        "higher_is_better": higher_is_better,
+        "silhouette_sample_size": sample_size if criterion == "silhouette" else None,
+        "algorithm": "MiniBatchKMeans" if use_minibatch else "KMeans",
+        "n_jobs": n_jobs,
+        "total_seconds": round(time.perf_counter() - started, 3),
+        "best_k": best_entry["k"] if best_entry else None,
+        "candidates": [entry for entry, _ in results],
+        "skipped_k": skipped,
+    }
+    try:
+        with open(KMEANS_SEARCH_REPORT_PATH, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"k search report saved to {KMEANS_SEARCH_REPORT_PATH} ({report['total_seconds']}s total).")
+    except OSError as e:
+        print(f"Error saving k search report: {e}")
+    return best_model, (best_entry["score"] if best_entry else None), report
+
+def fit_warm_started_kmeans(reduced_embeddings, previous_centroids, criterion=KMEANS_SELECTION_CRITERION,
+                            sample_size=KMEANS_SILHOUETTE_SAMPLE_SIZE):
+    """K-Means initialized at the previous centroids (same k, one init), so cluster ids stay stable across retrains."""
+    k = previous_centroids.shape[0]
+    if reduced_embeddings.shape[0] <= k:
+        print(f"Not enough samples ({reduced_embeddings.shape[0]}) to warm-start K-Means with k={k}.")
+        return None, None
+    kmeans_model = KMeans(n_clusters=k, init=previous_centroids, n_init=1, random_state=KMEANS_RANDOM_STATE)
+    cluster_labels = kmeans_model.fit_predict(reduced_embeddings)
+    shift = np.linalg.norm(kmeans_model.cluster_centers_ - previous_centroids, axis=1)
+    print(f"  Warm-started K-Means converged in {kmeans_model.n_iter_} iteration(s); centroid shift mean {shift.mean():.4f}, max {shift.max():.4f}.")
+    return kmeans_model, score_clustering(reduced_embeddings, cluster_labels, criterion, sample_size)
+
+def write_generated_profiles(job_ad_texts, reduced_embeddings, centroids):
+    """Generates cluster profiles from the corpus and writes them to CLUSTER_PROFILES_PATH (read by main.py and the bundle)."""
+    print("\nGenerating cluster profiles from the corpus...")
+    try:
+        profiles = generate_cluster_profiles(job_ad_texts, reduced_embeddings, centroids, load_taxonomy(AUDIENCE_TAXONOMY_PATH))
+        with open(CLUSTER_PROFILES_PATH, 'w') as f:
+            json.dump(profiles, f, indent=2)
+        for cluster_id, profile in profiles.items():
+            print(f"  {cluster_id}: {profile['name']} ({profile['size']} ads, industry={profile['industry']}, "
+                  f"characteristic_distance={profile.get('characteristic_distance')})")
+        print(f"Cluster profiles saved to {CLUSTER_PROFILES_PATH}")
+        return profiles
+    except Exception as e:
+        print(f"Error generating cluster profiles: {e}")
+        return None
+
 # --- Main Training Pipeline --- #
-def train_pipeline():
+def train_pipeline(warm_start=False, use_embedding_store=True, k_search=None, generate_profiles=False,
+                   similar_ads_index=SIMILAR_ADS_INDEX_KIND, similar_ads_space=SIMILAR_ADS_INDEX_SPACE, dedup_threshold=CORPUS_DEDUP_THRESHOLD,
+                   chunking=CORPUS_CHUNKING):
+    """
+    Full pipeline: corpus -> SBERT (via the embedding store) -> UMAP -> K-Means -> projections -> bundle.
+    With `warm_start`, the previous UMAP is reused as-is (its space must stay fixed for the old centroids to
+    mean anything) and K-Means is refined from the previous centroids at the previous k instead of
+    searching k from scratch. Falls back to a full retrain if no previous models exist.
+    `k_search` holds keyword arguments for search_kmeans_k (k_values, criterion, minibatch, n_jobs, sample_size).
+    The tracked, hand-written cluster_profiles.json is kept as-is unless `generate_profiles` replaces it with profiles generated from the corpus.
+    `similar_ads_index` ("auto", "exact", "ivf" or "none") and `similar_ads_space` configure the bundled similar-ads index.
+    Near-duplicate ads are collapsed before embedding unless `dedup_threshold` is None.
+    `chunking` is how ads longer than the encoder's token limit are embedded; the bundle records it for main.py.
+    """
+    k_search = {"criterion": KMEANS_SELECTION_CRITERION, **(k_search or {})}
     print("Starting offline model training pipeline...")
     os.makedirs(MODEL_DIR, exist_ok=True)
 
     # 1. Load Corpus
-    job_ad_texts = load_job_ad_corpus()
-    if not job_ad_texts:
+    corpus = load_job_ad_corpus(with_ids=True)
+    if not corpus:
         print("Halting pipeline due to corpus loading issues.")
         return
+    ad_ids, job_ad_texts = corpus
+    if dedup_threshold is not None:
+        ad_ids, job_ad_texts = deduplicate_corpus(ad_ids, job_ad_texts, dedup_threshold)
 
     # 2. Load SBERT and Generate Embeddings
     print(f"Loading SBERT model ({SBERT_MODEL_NAME}) for embedding generation...")
     try:
         sbert_model = SentenceTransformer(SBERT_MODEL_NAME)
-        print("SBERT model loaded. Generating embeddings for corpus (this may take a while)...")
-        corpus_sbert_embeddings = sbert_model.encode(job_ad_texts, show_progress_bar=True)
+        print("SBERT model loaded.")
+        corpus_sbert_embeddings = encode_corpus(sbert_model, ad_ids, job_ad_texts, use_store=use_embedding_store, chunking=chunking)
         print(f"Generated {corpus_sbert_embeddings.shape[0]} SBERT embeddings with dimension {corpus_sbert_embeddings.shape[1]}.")
     except Exception as e:
         print(f"Error during SBERT model loading or embedding generation: {e}")
         return
 
+    previous_umap, previous_centroids = load_previous_models() if warm_start else (None, None)
+
     # 3. Train and Save UMAP Model
-    print("\nTraining UMAP model...")
+    print("\nTraining UMAP model..." if previous_umap is None else "\nReusing the previous UMAP model (warm start)...")
     try:
-        num_samples = corpus_sbert_embeddings.shape[0]
-        # Drastically reduce n_neighbors for small N and try random initialization
-        current_umap_n_neighbors = min(5, num_samples - 1) if num_samples > 1 else 1
-        if current_umap_n_neighbors <= 1: # Needs at least 2 for some default UMAP logic if not random init
-            print(f"Warning: n_neighbors is very small ({current_umap_n_neighbors}). This may affect UMAP quality.")
-            # If using init='spectral', n_neighbors often needs to be > 1. For random, 1 might be okay.
-            current_umap_n_neighbors = max(2, current_umap_n_neighbors) if num_samples > 2 else 1
-
-        print(f"Using n_neighbors={current_umap_n_neighbors}, init='random' for UMAP with {num_samples} samples.")
-
-        umap_trainer = UMAP(
-            n_components=UMAP_N_COMPONENTS,
-            n_neighbors=current_umap_n_neighbors,
-            min_dist=UMAP_MIN_DIST,
-            init='random',  # Change from 'spectral' to 'random' for initialization
-            random_state=UMAP_RANDOM_STATE,
-            n_jobs=1,
-            densmap=False # Explicitly false, though it is the default
-        )
-        print(f"Fitting UMAP on {corpus_sbert_embeddings.shape[0]} embeddings...")
-        fitted_umap_model = umap_trainer.fit(corpus_sbert_embeddings)
-        joblib.dump(fitted_umap_model, os.path.join(MODEL_DIR, 'fitted_umap.pkl'))
-        print(f"UMAP model trained and saved to {os.path.join(MODEL_DIR, 'fitted_umap.pkl')}")
+        if previous_umap is not None:
+            fitted_umap_model = previous_umap
+        else:
+            num_samples = corpus_sbert_embeddings.shape[0]
+            # Drastically reduce n_neighbors for small N and try random initialization
+            current_umap_n_neighbors = min(5, num_samples - 1) if num_samples > 1 else 1
+            if current_umap_n_neighbors <= 1: # Needs at least 2 for some default UMAP logic if not random init
+                print(f"Warning: n_neighbors is very small ({current_umap_n_neighbors}). This may affect UMAP quality.")
+                # If using init='spectral', n_neighbors often needs to be > 1. For random, 1 might be okay.
+                current_umap_n_neighbors = max(2, current_umap_n_neighbors) if num_samples > 2 else 1
+
+            print(f"Using n_neighbors={current_umap_n_neighbors}, init='random' for UMAP with {num_samples} samples.")
+
+            umap_trainer = UMAP(
+                n_components=UMAP_N_COMPONENTS,
+                n_neighbors=current_umap_n_neighbors,
+                min_dist=UMAP_MIN_DIST,
+                init='random',  # Change from 'spectral' to 'random' for initialization
+                random_state=UMAP_RANDOM_STATE,
+                n_jobs=1,
+                densmap=False # Explicitly false, though it is the default
+            )
+            print(f"Fitting UMAP on {corpus_sbert_embeddings.shape[0]} embeddings...")
+            fitted_umap_model = umap_trainer.fit(corpus_sbert_embeddings)
+            joblib.dump(fitted_umap_model, os.path.join(MODEL_DIR, 'fitted_umap.pkl'))
+            print(f"UMAP model trained and saved to {os.path.join(MODEL_DIR, 'fitted_umap.pkl')}")
         
         # Transform corpus with the fitted UMAP for K-Means training
         print("Transforming corpus embeddings with fitted UMAP...")
@@ -109,41 +460,18 @@ def train_pipeline():
         print(f"Error during UMAP training or saving: {e}")
         return
 
-    # 4. Train and Save K-Means Model (with Auto-K using Silhouette Score)
-    print("\nTraining K-Means model with auto-k selection...")
-    best_k = -1
-    best_silhouette_score = -1 # Silhouette scores range from -1 to 1
-    best_kmeans_model = None
-
-    if corpus_reduced_embeddings.shape[0] <= max(KMEANS_K_RANGE): # Ensure enough samples for max k
-        print(f"Warning: Number of samples ({corpus_reduced_embeddings.shape[0]}) is small for K-Means range up to {max(KMEANS_K_RANGE)}. Adjust KMEANS_K_RANGE or increase corpus size.")
-        # Potentially adjust KMEANS_K_RANGE here if too few samples
-
-    print(f"Testing k values in {list(KMEANS_K_RANGE)} for K-Means...")
-    for k_val in KMEANS_K_RANGE:
-        if corpus_reduced_embeddings.shape[0] <= k_val:
-            print(f"Skipping k={k_val}, not enough samples ({corpus_reduced_embeddings.shape[0]}).")
-            continue
-        try:
-            print(f"  Fitting K-Means with k={k_val}...")
-            kmeans_temp = KMeans(n_clusters=k_val, random_state=KMEANS_RANDOM_STATE, n_init='auto')
-            cluster_labels = kmeans_temp.fit_predict(corpus_reduced_embeddings)
-            
-            # Silhouette score requires at least 2 labels and less than n_samples-1 labels if all points are not in one cluster
-            if len(set(cluster_labels)) > 1 and len(set(cluster_labels)) < corpus_reduced_embeddings.shape[0]:
-                silhouette_avg = silhouette_score(corpus_reduced_embeddings, cluster_labels)
-                print(f"  For k={k_val}, Silhouette Score: {silhouette_avg:.4f}")
-                if silhouette_avg > best_silhouette_score:
-                    best_silhouette_score = silhouette_avg
-                    best_k = k_val
-                    best_kmeans_model = kmeans_temp # Keep the fitted model
-            else:
-                print(f"  For k={k_val}, could not calculate silhouette score (num_labels={len(set(cluster_labels))}).")
-        except Exception as e:
-            print(f"  Error during K-Means for k={k_val}: {e}")
+    # 4. Train and Save K-Means Model (auto-k search, or warm-started from the previous centroids)
+    print("\nTraining K-Means model with auto-k selection..." if previous_centroids is None else "\nRefining K-Means from the previous centroids (warm start)...")
+    if previous_centroids is not None:
+        best_kmeans_model, best_score = fit_warm_started_kmeans(corpus_reduced_embeddings, previous_centroids, criterion=k_search["criterion"],
+                                                                sample_size=k_search.get("sample_size", KMEANS_SILHOUETTE_SAMPLE_SIZE))
+    else:
+        best_kmeans_model, best_score, _ = search_kmeans_k(corpus_reduced_embeddings, **k_search)
+    best_k = best_kmeans_model.n_clusters if best_kmeans_model is not None else -1
 
     if best_kmeans_model and best_k != -1:
-        print(f"Best k found: {best_k} with Silhouette Score: {best_silhouette_score:.4f}")
+        score_text = f"{best_score:.4f}" if best_score is not None else "N/A"
+        print(f"{'Warm-started' if previous_centroids is not None else 'Best'} k: {best_k} with {k_search['criterion']} score: {score_text}")
         joblib.dump(best_kmeans_model, os.path.join(MODEL_DIR, 'fitted_kmeans.pkl'))
         print(f"Optimal K-Means model (k={best_k}) trained and saved to {os.path.join(MODEL_DIR, 'fitted_kmeans.pkl')}")
         # You can now assign all corpus ads to their clusters using best_kmeans_model.predict(corpus_reduced_embeddings)
@@ -152,21 +480,150 @@ def train_pipeline():
         print("Could not determine optimal K-Means model. K-Means model not saved.")
         print("Consider checking your KMEANS_K_RANGE, corpus size, or data characteristics.")
 
-    # 5. Guidance for Cluster Profiles (cluster_profiles.json)
-    print("\n--- Guidance for Cluster Profiles --- ")
-    print(f"K-Means model was trained with k={best_k if best_k != -1 else 'N/A'}.")
-    print("To create 'cluster_profiles.json':")
-    print("  1. If K-Means saved, load it and predict cluster labels for your corpus_reduced_embeddings.")
-    print("  2. For each cluster label (0 to k-1):")
-    print("     a. Gather all job ad texts that belong to this cluster.")
-    print("     b. Analyze these texts (e.g., common n-grams, topics via zero-shot classification) to define a profile.")
-    print(f"     c. Create an entry in {os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models', 'cluster_profiles.json')} like: \"0\": {{ \"name\": \"Cluster 0 Profile\", \"industry\": \"X\", ... }}")
+    # 4b. Fast projection modes (main.py SEGMENTATION_REDUCTION_MODE=linear / pca)
+    print("\nFitting fast linear projections of the UMAP transform...")
+    projection_heads = {}
+    try:
+        projection_heads = fit_projection_heads(corpus_sbert_embeddings, corpus_reduced_embeddings)
+        np.savez(PROJECTION_PATH, **{
+            array_name: array
+            for mode, (weights, bias, _) in projection_heads.items()
+            for array_name, array in ((f"{mode}_weights", weights), (f"{mode}_bias", bias))
+        })
+        print(f"Projection modes {list(projection_heads)} saved to {PROJECTION_PATH}")
+        if best_kmeans_model is not None:
+            report_projection_agreement(projection_heads, corpus_sbert_embeddings, corpus_reduced_embeddings, best_kmeans_model)
+    except Exception as e:
+        print(f"Error fitting or saving the fast projection modes: {e}")
+
+    # 5. Cluster Profiles (cluster_profiles.json), generated from the corpus only when asked to
+    if best_kmeans_model is not None and generate_profiles:
+        write_generated_profiles(job_ad_texts, corpus_reduced_embeddings, best_kmeans_model.cluster_centers_)
+    elif best_kmeans_model is not None:
+        print(f"\nKeeping the existing {CLUSTER_PROFILES_PATH} (pass --generate-profiles to regenerate it); "
+              f"make sure it has a profile for each of the {best_k} clusters.")
+
+    # 5b. Pickle-free, memory-mappable artifact bundle for the service (includes the profiles written above)
+    if best_kmeans_model is not None:
+        similar_ads = build_similar_ads_index(ad_ids, corpus_sbert_embeddings, corpus_reduced_embeddings, similar_ads_index, similar_ads_space)
+        write_model_bundle(best_kmeans_model, projection_heads, fitted_umap_model.n_components, similar_ads, similar_ads_space, chunking)
 
     print("\nOffline training pipeline finished.")
 
+# --- Encoder Backend Export & Parity Check --- #
+def export_encoder_backends(chunking=CORPUS_CHUNKING, dedup_threshold=CORPUS_DEDUP_THRESHOLD):
+    """Exports the SBERT model to ONNX (fp32 + int8) for main.py's ONNX encoder backends, then checks parity."""
+    from encoders import export_onnx_encoder
+
+    print(f"\nExporting {SBERT_MODEL_NAME} to ONNX (fp32 + dynamic int8) in {ONNX_ENCODER_DIR}...")
+    try:
+        sbert_model = SentenceTransformer(SBERT_MODEL_NAME)
+        export_onnx_encoder(sbert_model, SBERT_MODEL_NAME, ONNX_ENCODER_DIR, quantize=True)
+        print("ONNX encoder backends exported successfully.")
+    except Exception as e:
+        print(f"Error exporting ONNX encoder backends: {e}")
+        return
+    check_encoder_parity(sbert_model, chunking, dedup_threshold)
+
+def check_encoder_parity(sbert_model, chunking=CORPUS_CHUNKING, dedup_threshold=CORPUS_DEDUP_THRESHOLD):
+    """
+    Encodes the corpus with every encoder backend and compares the resulting K-Means assignments
+    (through the saved UMAP + K-Means models) against the PyTorch backend. The corpus is deduplicated and
+    long ads chunked as in training and serving, so the check covers the pooled embeddings the service uses.
+    """
+    from encoders import OnnxSentenceEncoder
+
+    corpus = load_job_ad_corpus(with_ids=True)
+    if not corpus:
+        print("Skipping encoder parity check: no corpus available.")
+        return
+    ad_ids, job_ad_texts = corpus
+    if dedup_threshold is not None:
+        kept, _ = deduplicate(ad_ids, job_ad_texts, threshold=dedup_threshold)
+        job_ad_texts = [job_ad_texts[i] for i in kept]
+    try:
+        fitted_umap_model = joblib.load(os.path.join(MODEL_DIR, 'fitted_umap.pkl'))
+        fitted_kmeans_model = joblib.load(os.path.join(MODEL_DIR, 'fitted_kmeans.pkl'))
+    except Exception as e:
+        print(f"Skipping encoder parity check: could not load saved UMAP/K-Means models ({e}).")
+        return
+
+    print("\nChecking encoder backend parity on the corpus...")
+    reference_embeddings = encode_long_texts(sbert_model, job_ad_texts, chunking)
+    reference_labels = fitted_kmeans_model.predict(fitted_umap_model.transform(reference_embeddings))
+    report = {"corpus_size": len(job_ad_texts), "reference_backend": "torch", "long_text": chunking.describe(), "backends": {}}
+    for backend, quantized in (("onnx", False), ("onnx-int8", True)):
+        encoder = OnnxSentenceEncoder(ONNX_ENCODER_DIR, quantized=quantized)
+        embeddings = encode_long_texts(encoder, job_ad_texts, chunking)
+        labels = fitted_kmeans_model.predict(fitted_umap_model.transform(embeddings))
+        cosine = np.sum(embeddings * reference_embeddings, axis=1) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference_embeddings, axis=1))
+        agreement = float(np.mean(labels == reference_labels))
+        report["backends"][backend] = {
+            "kmeans_assignment_agreement": agreement,
+            "min_cosine_similarity": float(np.min(cosine)),
+            "mean_cosine_similarity": float(np.mean(cosine)),
+        }
+        print(f"  {backend}: K-Means agreement {agreement:.2%}, min cosine similarity {np.min(cosine):.4f}")
+        if agreement < 1.0:
+            print(f"  WARNING: {backend} changes {int(np.sum(labels != reference_labels))} K-Means assignment(s) on the corpus.")
+
+    report_path = os.path.join(ONNX_ENCODER_DIR, "parity_report.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Parity report saved to {report_path}")
+
 if __name__ == "__main__":
     # Before running, ensure you have a corpus file, e.g., ./data/job_ads_corpus.json
     # You might need to create the ./data directory and the file.
     # Example: os.makedirs("./data", exist_ok=True)
     # with open("./data/job_ads_corpus.json", 'w') as f: json.dump([{"id":1, "text":"sample job ad"}], f)
-    train_pipeline() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Offline training pipeline for the audience segmentation service.")
+    parser.add_argument("--export-onnx", action="store_true",
+                        help="Export the ONNX and int8 encoder backends and run the K-Means parity check.")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="Reuse the previous UMAP model and refine K-Means from the previous centroids instead of retraining from scratch.")
+    parser.add_argument("--full-reencode", action="store_true",
+                        help="Encode the whole corpus again instead of reusing embeddings from the embedding store.")
+    parser.add_argument("--k-range", default=f"{KMEANS_K_RANGE.start}-{KMEANS_K_RANGE.stop - 1}",
+                        help="Inclusive range of k values to search, e.g. 2-20.")
+    parser.add_argument("--criterion", choices=sorted(KMEANS_CRITERIA_HIGHER_IS_BETTER), default=KMEANS_SELECTION_CRITERION,
+                        help="Criterion used to pick k.")
+    parser.add_argument("--silhouette-sample-size", type=int, default=KMEANS_SILHOUETTE_SAMPLE_SIZE,
+                        help="Ads sampled for the silhouette score (0 = all, O(n^2)).")
+    parser.add_argument("--minibatch", choices=("auto", "always", "never"), default="auto",
+                        help=f"Use MiniBatchKMeans (auto: above {KMEANS_MINIBATCH_THRESHOLD} ads).")
+    parser.add_argument("--n-jobs", type=int, default=KMEANS_SEARCH_N_JOBS, help="Parallel k candidates (-1 = all cores).")
+    parser.add_argument("--generate-profiles", action="store_true",
+                        help="Overwrite cluster_profiles.json with profiles generated from the corpus instead of keeping the hand-written file.")
+    parser.add_argument("--long-text-mode", choices=LONG_TEXT_MODES, default=CORPUS_CHUNKING.mode,
+                        help="chunk: embed every token-bounded chunk of long ads and pool them; truncate: the encoder's own truncation.")
+    parser.add_argument("--chunk-pooling", choices=POOLING_MODES, default=CORPUS_CHUNKING.pooling,
+                        help="How chunk embeddings are pooled per ad (length = weighted by chunk token count).")
+    parser.add_argument("--dedup-threshold", type=float, default=CORPUS_DEDUP_THRESHOLD,
+                        help="Similarity above which corpus ads are collapsed as near-duplicates before training.")
+    parser.add_argument("--no-dedup", action="store_true", help="Train on every corpus ad, including near-duplicates.")
+    parser.add_argument("--similar-ads-index", choices=("auto",) + INDEX_KINDS + ("none",), default=SIMILAR_ADS_INDEX_KIND,
+                        help="Similar-ads index bundled for the service: exact, ivf (approximate, large corpora), auto or none.")
+    parser.add_argument("--similar-ads-space", choices=("sbert", "reduced"), default=SIMILAR_ADS_INDEX_SPACE,
+                        help="Embeddings the similar-ads index is built on.")
+    parser.add_argument("--skip-training", action="store_true",
+                        help="Reuse the saved UMAP/K-Means models instead of retraining (e.g. to only export encoders).")
+    args = parser.parse_args()
+
+    chunking = ChunkingConfig(mode=args.long_text_mode, max_tokens=CORPUS_CHUNKING.max_tokens,
+                              overlap_tokens=CORPUS_CHUNKING.overlap_tokens, pooling=args.chunk_pooling)
+    dedup_threshold = None if args.no_dedup else args.dedup_threshold
+    if not args.skip_training:
+        k_min, k_max = (int(bound) for bound in args.k_range.split("-"))
+        train_pipeline(warm_start=args.warm_start, use_embedding_store=not args.full_reencode, generate_profiles=args.generate_profiles,
+                       similar_ads_index=args.similar_ads_index, similar_ads_space=args.similar_ads_space,
+                       dedup_threshold=dedup_threshold, chunking=chunking, k_search={
+            "k_values": range(k_min, k_max + 1),
+            "criterion": args.criterion,
+            "minibatch": args.minibatch,
+            "n_jobs": args.n_jobs,
+            "sample_size": args.silhouette_sample_size,
+        })
+    if args.export_onnx:
+        export_encoder_backends(chunking, dedup_threshold)
\ No newline at end of file
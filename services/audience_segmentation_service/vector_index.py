@@ -0,0 +1,154 @@
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# Nearest-neighbour index over the corpus embeddings ("similar past ads"), built by train_models.py into
+# the model bundle and memory-mapped by main.py.
+#
+#   exact  one (queries x corpus) matrix product per block of queries; exact, fine up to ~100k ads
+#   ivf    inverted file: a coarse k-means splits the corpus into n_lists lists stored contiguously,
+#          a query only scans the n_probe lists with the nearest centroids and ranks those rows exactly
+#
+# Metric "cosine" stores L2-normalized vectors and reports 1 - cosine similarity; "euclidean" reports the
+# euclidean distance. Rows are kept in list order, so an IVF list is one contiguous slice of the matrix.
+INDEX_KINDS = ("exact", "ivf")
+INDEX_METRICS = ("cosine", "euclidean")
+IVF_AUTO_THRESHOLD = 50000 # kind="auto" builds an IVF index above this many vectors
+IVF_DEFAULT_N_PROBE = 8
+EXACT_QUERY_BLOCK = 64 # Queries scored per matrix product, bounds the (block x corpus) distance matrix
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k smallest distances of each row, nearest first."""
+    if k < distances.shape[1]:
+        candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    order = np.argsort(np.take_along_axis(distances, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+class VectorIndex:
+    """Read-only k-NN index; `vectors` may be a memory-mapped bundle array."""
+
+    def __init__(self, vectors: np.ndarray, ad_ids: Sequence[str], metric: str = "cosine",
+                 list_centroids: Optional[np.ndarray] = None, list_offsets: Optional[np.ndarray] = None):
+        if metric not in INDEX_METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {INDEX_METRICS}.")
+        if len(ad_ids) != vectors.shape[0]:
+            raise ValueError(f"{len(ad_ids)} ad ids for {vectors.shape[0]} vectors.")
+        self.vectors = vectors
+        self.ad_ids = list(ad_ids)
+        self.metric = metric
+        self.list_centroids = list_centroids
+        self.list_offsets = list_offsets
+        # ||v||^2 for the euclidean expansion; cosine vectors are unit length.
+        self.sq_norms = np.einsum("ij,ij->i", vectors, vectors) if metric == "euclidean" else None
+        # IVF lists are ranked with an exact index over their centroids.
+        self._list_index = VectorIndex(list_centroids, [""] * len(list_centroids), metric) if list_centroids is not None else None
+
+    @property
+    def kind(self) -> str:
+        return "ivf" if self.list_centroids is not None else "exact"
+
+    @property
+    def size(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def dimension(self) -> int:
+        return self.vectors.shape[1]
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, ad_ids: Sequence[str], kind: str = "auto", metric: str = "cosine",
+              n_lists: Optional[int] = None, random_state: int = 42) -> "VectorIndex":
+        """Builds an index; kind "auto" picks "ivf" above IVF_AUTO_THRESHOLD vectors. n_lists defaults to ~4 * sqrt(n)."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if metric == "cosine":
+            vectors = _normalize(vectors)
+        if kind == "auto":
+            kind = "ivf" if vectors.shape[0] > IVF_AUTO_THRESHOLD else "exact"
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind '{kind}', expected one of {INDEX_KINDS} or 'auto'.")
+        if kind == "exact":
+            return cls(vectors, ad_ids, metric)
+
+        from sklearn.cluster import MiniBatchKMeans # Only needed to build an IVF index
+        n_lists = int(n_lists or max(1, round(4 * np.sqrt(vectors.shape[0]))))
+        n_lists = max(1, min(n_lists, vectors.shape[0]))
+        quantizer = MiniBatchKMeans(n_clusters=n_lists, random_state=random_state, n_init=3,
+                                    batch_size=max(1024, 4 * n_lists)).fit(vectors)
+        list_centroids = quantizer.cluster_centers_.astype(np.float32)
+        if metric == "cosine":
+            list_centroids = _normalize(list_centroids)
+        labels = quantizer.labels_
+        order = np.argsort(labels, kind="stable")
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))]).astype(np.int64)
+        return cls(vectors[order], [ad_ids[i] for i in order], metric, list_centroids, list_offsets)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays to store in a model bundle, see from_arrays."""
+        arrays = {"vectors": self.vectors}
+        if self.kind == "ivf":
+            arrays["list_centroids"] = self.list_centroids
+            arrays["list_offsets"] = self.list_offsets
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], ad_ids: Sequence[str], metric: str) -> "VectorIndex":
+        return cls(arrays["vectors"], ad_ids, metric, arrays.get("list_centroids"), arrays.get("list_offsets"))
+
+    def _distances(self, queries: np.ndarray, rows: Union[slice, np.ndarray]) -> np.ndarray:
+        """(n_queries, n_rows) distances from already-prepared queries to vectors[rows]."""
+        products = queries @ np.asarray(self.vectors[rows]).T
+        if self.metric == "cosine":
+            return np.maximum(1.0 - products, 0.0)
+        sq_distances = np.einsum("ij,ij->i", queries, queries)[:, None] - 2.0 * products + self.sq_norms[rows][None, :]
+        return np.sqrt(np.maximum(sq_distances, 0.0))
+
+    def search(self, queries: np.ndarray, k: int, n_probe: int = IVF_DEFAULT_N_PROBE) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k nearest corpus rows of each query, nearest first: (rows, distances), both (n_queries, k).
+        Rows are -1 (distance inf) where fewer than k candidates exist, e.g. in sparse IVF lists.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.dimension:
+            raise ValueError(f"Expected queries of shape (n, {self.dimension}), got {queries.shape}.")
+        if self.metric == "cosine":
+            queries = _normalize(queries)
+        n_queries, k = queries.shape[0], max(1, int(k))
+        rows = np.full((n_queries, k), -1, dtype=np.int64)
+        distances = np.full((n_queries, k), np.inf, dtype=np.float32)
+        if self.size == 0:
+            return rows, distances
+
+        if self.kind == "exact":
+            width = min(k, self.size)
+            for start in range(0, n_queries, EXACT_QUERY_BLOCK):
+                block_distances = self._distances(queries[start:start + EXACT_QUERY_BLOCK], slice(None))
+                nearest = _top_k(block_distances, width)
+                rows[start:start + len(nearest), :width] = nearest
+                distances[start:start + len(nearest), :width] = np.take_along_axis(block_distances, nearest, axis=1)
+            return rows, distances
+
+        # IVF: rank the lists by centroid distance for all queries at once, then scan the n_probe nearest.
+        probe = min(max(1, n_probe), self._list_index.size)
+        nearest_lists, _ = self._list_index.search(queries, probe)
+        for i, lists in enumerate(nearest_lists):
+            candidates = np.concatenate([np.arange(self.list_offsets[j], self.list_offsets[j + 1]) for j in lists])
+            if not len(candidates):
+                continue
+            candidate_distances = self._distances(queries[i:i + 1], candidates)
+            width = min(k, len(candidates))
+            nearest = _top_k(candidate_distances, width)[0]
+            rows[i, :width] = candidates[nearest]
+            distances[i, :width] = candidate_distances[0, nearest]
+        return rows, distances
+
+    def describe(self) -> Dict[str, Any]:
+        description = {"kind": self.kind, "metric": self.metric, "size": self.size, "dimension": self.dimension}
+        if self.kind == "ivf":
+            description["n_lists"] = int(len(self.list_centroids))
+        return description